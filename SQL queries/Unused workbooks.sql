@@ -7,8 +7,9 @@ to be used yet.
 
 Dashboards that have the tag 'NO_DELETE' are not affected.
 */
-WITH RECURSIVE recur_folder_structure AS 
-(  
+WITH RECURSIVE project_hierarchy AS
+(
+    -- the hierarchy is walked from the root projects down, every project extends the path of its parent
     SELECT s.id AS "project site id",
            s.name AS "project site name",
            s.url_namespace AS "project site url namespace",
@@ -16,57 +17,35 @@ WITH RECURSIVE recur_folder_structure AS
            p.name AS "project name",
            p.id AS "root project id",
            p.name AS "root project name",
-           p.special AS "special",
-           1 AS level
+           CAST(p.name AS TEXT) AS "project path",
+           p.special AS "special"
     FROM public.projects p
     JOIN public.sites s on p.site_id = s.id
-UNION
-    SELECT s.id AS "project site id",
-           s.name AS "project site name",
-           s.url_namespace AS "project site url namespace",
+    WHERE p.parent_project_id IS NULL
+UNION ALL
+    SELECT h."project site id",
+           h."project site name",
+           h."project site url namespace",
            p.id AS "project id",
            p.name AS "project name",
-           COALESCE(recur_folder_structure."root project id", p.id) AS "root project id",
-           COALESCE(recur_folder_structure."root project name", p.name) AS "root project name",
-           p."special",
-           recur_folder_structure.level + 1 AS level
+           h."root project id",
+           h."root project name",
+           h."project path"||'/'||p.name AS "project path",
+           p."special"
     FROM public.projects p
-    JOIN public.sites s on p.site_id = s.id
-    JOIN recur_folder_structure ON p.parent_project_id = recur_folder_structure."project id"
-), project_path AS
+    JOIN project_hierarchy h ON p.parent_project_id = h."project id"
+), folder_structure AS 
 (
     SELECT "project site id",
            "project site name",
-           "project site url namespace",
            "project id",
            "project name",
-           STRING_AGG("root project name",'/' ORDER BY level DESC) AS "project path",
-           MAX(special) AS special,
-           MAX(level) AS level    
-    FROM recur_folder_structure
-    GROUP BY "project site id",
-             "project site name",
-             "project site url namespace",
-             "project id",
-             "project name"
-), folder_structure AS 
-(
-SELECT pp."project site id",
-       pp."project site name",
-       pp."project id",
-       pp."project name",
-       'TABLEAUSERVERURL/'||pp."project site url namespace"||'/projects/'||pp."project id" AS "project link",
-       "root project id",
-       "root project name",
-       pp."project path",
-       COALESCE(pp.special,0) AS "special"
-FROM project_path pp
-JOIN recur_folder_structure rfs
-ON pp."project site id" = rfs."project site id"
-AND pp."project site name" = rfs."project site name"
-AND pp."project id" = rfs."project id"
-AND pp."project name" = rfs."project name"
-AND pp.level = rfs.level
+           'TABLEAUSERVERURL/'||"project site url namespace"||'/projects/'||"project id" AS "project link",
+           "root project id",
+           "root project name",
+           "project path",
+           COALESCE(special,0) AS "special"
+    FROM project_hierarchy
 ), NO_DELETE AS
 (
 SELECT DISTINCT
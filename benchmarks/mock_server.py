@@ -0,0 +1,145 @@
+import re
+import json
+import time
+import threading
+import http.server
+from urllib.parse import urlparse, parse_qs
+from synthetic_data import SyntheticSite, packaged_file
+
+API_VERSION = "3.15"
+SITE_ID = "site-0"
+TOKEN = "benchmark-token"
+DOWNLOAD_SIZE = 256 * 1024 # bytes of the extract in every downloaded workbook or data source
+
+COLLECTION_PATTERN = re.compile(r"^/api/[\d.]+/sites/[^/]+/(projects|workbooks|datasources|flows|users|groups)$")
+PERMISSIONS_PATTERN = re.compile(r"^/api/[\d.]+/sites/[^/]+/(projects|workbooks|datasources|flows)/([^/]+)/permissions$")
+DEFAULT_PERMISSIONS_PATTERN = re.compile(r"^/api/[\d.]+/sites/[^/]+/projects/([^/]+)/default-permissions/(workbooks|datasources|flows)$")
+CONTENT_PATTERN = re.compile(r"^/api/[\d.]+/sites/[^/]+/(workbooks|datasources)/([^/]+)/content$")
+ITEM_PATTERN = re.compile(r"^/api/[\d.]+/sites/[^/]+/(workbooks|datasources)/([^/]+)$")
+
+
+class MockTableauServer:
+    """
+    A local stand-in for Tableau Server that serves a SyntheticSite: sign in, server info, the paged lists of
+    projects, workbooks, data sources, flows, users and groups, (default) permissions, downloads, deletes and the Metadata API.
+    Every response is delayed by latency seconds. The number of requests and bytes sent are counted.
+    """
+    def __init__(self, site:SyntheticSite, latency:float=0.0):
+        self.site = site
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self.graphql_nodes = 0
+        self._lock = threading.Lock()
+        self._downloads = {
+            "workbooks": packaged_file("Workbook.twb", DOWNLOAD_SIZE),
+            "datasources": packaged_file("Datasource.tds", DOWNLOAD_SIZE)
+        }
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def config(self, environment:str="benchmark") -> dict:
+        # a ts_config with one environment for this server
+        return {environment: {
+            "server": self.url, "api_version": API_VERSION,
+            "personal_access_token_name": "benchmark", "personal_access_token_secret": "benchmark",
+            "site_name": "benchmark", "site_url": "benchmark"
+        }}
+
+    def _count(self, sent:int, nodes:int=0) -> None:
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            self.graphql_nodes += nodes
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keeps connections alive like Tableau Server does
+            # the headers and body are sent in one write, otherwise delayed acknowledgements add 40ms to every response
+            wbufsize = 64 * 1024
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status:int, body:bytes=b"", content_type:str="application/json", headers:dict=None, nodes:int=0) -> None:
+                if server.latency:
+                    time.sleep(server.latency)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                server._count(len(body), nodes)
+
+            def _json(self, obj, status:int=200, nodes:int=0) -> None:
+                self._send(status, json.dumps(obj).encode(), nodes=nodes)
+
+            def _body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_POST(self):
+                body, path = self._body(), urlparse(self.path).path
+                if path.endswith("/auth/signin"):
+                    return self._json({"credentials": {"token": TOKEN, "site": {"id": SITE_ID, "contentUrl": "benchmark"}, "user": {"id": "user-0"}, "estimatedTimeToExpiration": "3:59:00"}})
+                if path.endswith("/auth/signout"):
+                    return self._send(204, b"")
+                if path == "/api/metadata/graphql":
+                    response = server.site.graphql(json.loads(body)["query"])
+                    nodes = list(response["data"].values())[0]
+                    return self._json(response, nodes=len(nodes["nodes"] if isinstance(nodes, dict) else nodes))
+                self._json({"error": {"summary": "Not found"}}, status=404)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                path, parameters = url.path, parse_qs(url.query)
+                if path.endswith("/serverinfo"):
+                    return self._json({"serverInfo": {"productVersion": {"value": "2022.1.0"}, "restApiVersion": API_VERSION}})
+
+                match = COLLECTION_PATTERN.match(path)
+                if match:
+                    page_number = int(parameters.get("pageNumber", ["1"])[0])
+                    page_size = int(parameters.get("pageSize", ["100"])[0])
+                    return self._json(server.site.page(match.group(1), page_number, page_size))
+
+                match = PERMISSIONS_PATTERN.match(path)
+                if match:
+                    collection, item_id = match.groups()
+                    return self._json({"permissions": {collection[:-1]: {"id": item_id}, "granteeCapabilities": server.site.grantee_capabilities(item_id)}})
+
+                match = DEFAULT_PERMISSIONS_PATTERN.match(path)
+                if match:
+                    project_id, collection = match.groups()
+                    return self._json({"permissions": {"project": {"id": project_id}, "granteeCapabilities": server.site.grantee_capabilities(f"{project_id}-{collection}")}})
+
+                match = CONTENT_PATTERN.match(path)
+                if match:
+                    collection, item_id = match.groups()
+                    file_name = f"{item_id}.twbx" if collection == "workbooks" else f"{item_id}.tdsx"
+                    return self._send(200, server._downloads[collection], content_type="application/octet-stream",
+                                      headers={"Content-Disposition": f'attachment; filename="{file_name}"'})
+                self._json({"error": {"summary": "Not found"}}, status=404)
+
+            def do_DELETE(self):
+                if ITEM_PATTERN.match(urlparse(self.path).path):
+                    return self._send(204)
+                self._json({"error": {"summary": "Not found"}}, status=404)
+
+        return Handler
@@ -0,0 +1,214 @@
+"""
+Benchmarks the stages of the scripts against a local mock Tableau Server with generated sites of several scales.
+Every scale runs in a fresh process, so the peak memory of a scale is not influenced by the previous ones.
+The time the scripts take to start (interpreter and imports) is measured as well.
+
+    python benchmarks/run_benchmarks.py --scales small medium --baseline output/benchmarks/benchmark-....json
+"""
+import os, sys
+import io
+import json
+import time
+import tempfile
+import contextlib
+import subprocess
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_FOLDER = os.path.join(os.path.dirname(BENCHMARK_FOLDER), "tableau_api")
+sys.path.insert(0, SCRIPT_FOLDER)
+
+from synthetic_data import SyntheticSite, SCALES
+from mock_server import MockTableauServer
+
+OUTPUT_FOLDER = "output\\benchmarks"
+ENVIRONMENT = "benchmark"
+LIST_PAGE_SIZE = 100 # small pages, so the paging of the lists is part of the benchmark
+DOWNLOADS = 50 # number of workbooks that are downloaded and repackaged per scale
+MAX_WORKERS = 8
+STARTUP_REPEATS = 5 # the fastest of these runs is reported, the others are slowed down by the disk cache or other processes
+# commands that only start the interpreter and import, the time scheduled health checks and --help pay before doing any work
+STARTUP_COMMANDS = {
+    "import utils": ["-c", "import utils"],
+    "metadata_api --help": ["metadata_api.py", "--help"],
+    "permissions --help": ["permissions.py", "--help"],
+    "automatic_archiving --help": ["automatic_archiving.py", "--help"],
+}
+
+
+def peak_rss_mb():
+    # the peak resident memory of the process so far, None when it can not be measured on this platform
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 1024 / 1024, 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+class StageRecorder:
+    def __init__(self, scale:str, server:MockTableauServer):
+        self.scale = scale
+        self.server = server
+        self.results = []
+
+    @contextlib.contextmanager
+    def stage(self, name:str):
+        # the body sets counter["rows"] to the number of rows (or items) the stage handled
+        counter = {"rows": 0}
+        requests, bytes_sent, start = self.server.requests, self.server.bytes_sent, time.perf_counter()
+        yield counter
+        seconds = time.perf_counter() - start
+        requests = self.server.requests - requests
+        self.results.append({
+            "scale": self.scale,
+            "stage": name,
+            "seconds": round(seconds, 3),
+            "requests": requests,
+            "requests_per_second": round(requests / seconds, 1) if seconds else None,
+            "bytes": self.server.bytes_sent - bytes_sent,
+            "rows": counter["rows"],
+            "rows_per_second": round(counter["rows"] / seconds, 1) if seconds else None,
+            "peak_rss_mb": peak_rss_mb()
+        })
+
+
+def run_scale(scale:str, parameters:dict, latency:float=0.0) -> list:
+    from tableau_api_lib import TableauServerConnection
+    from tableau_api_lib.utils import extract_pages
+    from utils import FlattenedDataFrame, ProjectDataFrame, ItemDataFrame, fetch_permissions, install_http_session, convert_query, queries, page_sizes, DEFAULT_PAGE_SIZE
+    import permissions
+    import automatic_archiving
+
+    with MockTableauServer(SyntheticSite(**parameters), latency=latency) as server, tempfile.TemporaryDirectory() as folder:
+        recorder = StageRecorder(scale, server)
+        quiet = lambda: contextlib.redirect_stdout(io.StringIO())
+
+        with recorder.stage("sign in"):
+            install_http_session()
+            conn = TableauServerConnection(server.config(ENVIRONMENT), ssl_verify=False, env=ENVIRONMENT)
+            conn.sign_in()
+
+        with recorder.stage("list items") as counter:
+            lists = {
+                name: extract_pages(getattr(conn, method), page_size=LIST_PAGE_SIZE)
+                for name, method in [("projects", "query_projects"), ("datasources", "query_data_sources"), ("workbooks", "query_workbooks_for_site"),
+                                     ("flows", "query_flows_for_site"), ("groups", "query_groups"), ("users", "get_users_on_site")]
+            }
+            counter["rows"] = sum(len(items) for items in lists.values())
+
+        with recorder.stage("flatten items") as counter, quiet():
+            df_projects = ProjectDataFrame(lists["projects"])
+            items = {
+                "project": permissions.projects_to_query(df_projects),
+                "datasource": ItemDataFrame(lists["datasources"], df_projects),
+                "workbook": ItemDataFrame(lists["workbooks"], df_projects),
+                "flow": ItemDataFrame(lists["flows"], df_projects)
+            }
+            FlattenedDataFrame(lists["groups"]), FlattenedDataFrame(lists["users"])
+            counter["rows"] = sum(len(items) for items in lists.values())
+
+        with recorder.stage("fetch permissions") as counter:
+            jobs = [(item_type, id) for item_type, df_items in items.items() for id in df_items["id"]]
+            capabilities = fetch_permissions(conn, jobs, max_workers=MAX_WORKERS)
+            counter["rows"] = len(jobs)
+
+        with recorder.stage("merge permissions") as counter:
+            df = df_projects.loc[df_projects["parentProjectId"].isna()].drop(columns="projectPath").reset_index(drop=True)
+            for item_type, df_items in items.items():
+                item_capabilities, capabilities = capabilities[:len(df_items)], capabilities[len(df_items):]
+                if not df_items.empty:
+                    counter["rows"] += len(permissions.item_permissions(df, df_items, item_type, item_capabilities))
+
+        with recorder.stage("metadata queries") as counter, quiet():
+            nodes = server.graphql_nodes
+            for query_name, query in queries.items():
+                convert_query(folder, conn, query_name, query, page_size=page_sizes.get(query_name, DEFAULT_PAGE_SIZE), output_format="csv")
+            counter["rows"] = server.graphql_nodes - nodes
+
+        with recorder.stage("download items") as counter, quiet():
+            workbook_ids = list(items["workbook"]["id"])[:DOWNLOADS]
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                list(executor.map(lambda id: automatic_archiving.cleanup_item(id, "workbook", conn, os.path.join(folder, "in_progress")), workbook_ids))
+            counter["rows"] = len(workbook_ids)
+
+    return recorder.results
+
+
+def measure_startup(repeats:int=STARTUP_REPEATS) -> dict:
+    """
+    Returns {command: seconds} of starting a new interpreter for every startup command, including the interpreter itself.
+    """
+    startup = {}
+    for name, arguments in STARTUP_COMMANDS.items():
+        durations = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *arguments], cwd=SCRIPT_FOLDER, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            durations.append(time.perf_counter() - start)
+        startup[name] = round(min(durations), 3)
+    return startup
+
+
+def print_startup(startup:dict, baseline:dict=None) -> None:
+    baseline = baseline or {}
+    print(f"\n{'startup':<30}{'seconds':>10}{'vs baseline':>13}")
+    for name, seconds in startup.items():
+        speedup = f"{baseline[name] / seconds:.2f}x" if name in baseline and seconds else ""
+        print(f"{name:<30}{seconds:>10.3f}{speedup:>13}")
+
+
+def print_results(results:list, baseline:list=None) -> None:
+    baseline = {(result["scale"], result["stage"]): result for result in baseline or []}
+    print(f"\n{'scale':<8}{'stage':<20}{'seconds':>10}{'requests':>10}{'req/s':>10}{'rows':>10}{'rows/s':>12}{'peak RSS MB':>13}{'vs baseline':>13}")
+    for result in results:
+        previous = baseline.get((result["scale"], result["stage"]))
+        speedup = f"{previous['seconds'] / result['seconds']:.2f}x" if previous and result["seconds"] else ""
+        print(
+            f"{result['scale']:<8}{result['stage']:<20}{result['seconds']:>10.3f}{result['requests']:>10}{result['requests_per_second'] or 0:>10.1f}"
+            f"{result['rows']:>10}{result['rows_per_second'] or 0:>12.1f}{result['peak_rss_mb'] or 0:>13.1f}{speedup:>13}"
+        )
+
+
+def main(scales:list, latency:float=0.0, baseline:str=None) -> str:
+    print("Measuring the startup time...")
+    startup = measure_startup()
+    results = []
+    for scale in scales:
+        print(f"Running the {scale} benchmark {SCALES[scale]}...")
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results.extend(executor.submit(run_scale, scale, SCALES[scale], latency).result())
+
+    previous = {}
+    if baseline:
+        with open(baseline) as f:
+            previous = json.load(f)
+    print_startup(startup, previous.get("startup"))
+    print_results(results, previous.get("results"))
+
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    report = os.path.join(OUTPUT_FOLDER, f"benchmark-{time.strftime('%Y-%m-%d-%HH-%MM-%SS')}.json")
+    with open(report, "w") as f:
+        json.dump({"scales": {scale: SCALES[scale] for scale in scales}, "latency": latency, "startup": startup, "results": results}, f, indent=4)
+    print(f"\nThe results are saved at {report}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmarks the scripts against a local mock Tableau Server with generated sites")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small", "medium"], help="sizes of the generated sites. default: small medium")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the mock server waits before every response, to mimic a remote server. default: 0")
+    parser.add_argument("--baseline", help="report of an earlier run to compare the durations with")
+    args = parser.parse_args()
+
+    # setting to root directory after imports
+    root = os.path.dirname(BENCHMARK_FOLDER)
+    os.chdir(root)
+
+    main(args.scales, args.latency, args.baseline)
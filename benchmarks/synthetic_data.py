@@ -0,0 +1,142 @@
+import io
+import re
+import random
+import zipfile
+
+# the parser of the GraphQL queries is reused, so every query of metadata_queries.py can be answered
+from utils.graphql import _tokenize, _parse_selection, _root_field
+
+CONTENT_PERMISSIONS = ("ManagedByOwner", "LockedToProject", "LockedToProjectWithoutNested")
+CAPABILITIES = ("Read", "Write", "ExportData", "ExportImage", "ExportXml", "ViewComments", "AddComment", "Filter", "ShareView", "WebAuthoring")
+SCALES = {
+    "small": {"projects": 50, "depth": 3, "workbooks": 200, "datasources": 100, "flows": 20, "users": 100, "groups": 20, "grantees": 3, "graphql_nodes": 200, "fanout": 3},
+    "medium": {"projects": 500, "depth": 4, "workbooks": 2000, "datasources": 1000, "flows": 200, "users": 1000, "groups": 100, "grantees": 4, "graphql_nodes": 2000, "fanout": 3},
+    "large": {"projects": 2000, "depth": 5, "workbooks": 10000, "datasources": 5000, "flows": 1000, "users": 5000, "groups": 400, "grantees": 5, "graphql_nodes": 10000, "fanout": 4},
+}
+
+
+class SyntheticSite:
+    """
+    A generated Tableau site in the shape of the REST API responses: a project hierarchy of the given depth, workbooks,
+    data sources and flows spread over the projects, users, groups and the grantee capabilities of every item.
+    The same seed always generates the same site.
+    """
+    def __init__(self, projects:int=50, depth:int=3, workbooks:int=200, datasources:int=100, flows:int=20, users:int=100,
+                 groups:int=20, grantees:int=3, graphql_nodes:int=200, fanout:int=3, seed:int=0):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.graphql_nodes = graphql_nodes
+        self.fanout = fanout
+        self.users = [{"id": f"user-{i}", "name": f"user{i}", "siteRole": "Viewer"} for i in range(users)]
+        self.groups = [{"id": f"group-{i}", "name": f"Group {i}"} for i in range(groups)]
+        self.projects = self._projects(projects, depth)
+        self.workbooks = self._items("workbook", workbooks)
+        self.datasources = self._items("datasource", datasources)
+        self.flows = self._items("flow", flows)
+        self.collections = {
+            "projects": self.projects, "workbooks": self.workbooks, "datasources": self.datasources,
+            "flows": self.flows, "users": self.users, "groups": self.groups
+        }
+        self._grantees = grantees
+        self._capabilities = {}
+
+    def _projects(self, count:int, depth:int) -> list:
+        # the first projects are roots, every next project is placed under a random project that is not at the maximum depth yet
+        roots = max(1, count // (2 ** (depth - 1)))
+        projects, depths = [], {}
+        for i in range(count):
+            project = {"id": f"project-{i}", "name": f"Project {i}", "contentPermissions": self.random.choice(CONTENT_PERMISSIONS), "owner": {"id": "user-0"}}
+            parents = [p["id"] for p in projects if depths[p["id"]] < depth]
+            if i >= roots and parents:
+                project["parentProjectId"] = self.random.choice(parents)
+                depths[project["id"]] = depths[project["parentProjectId"]] + 1
+            else:
+                depths[project["id"]] = 1
+            projects.append(project)
+        return projects
+
+    def _items(self, item_type:str, count:int) -> list:
+        items = []
+        for i in range(count):
+            project = self.random.choice(self.projects)
+            items.append({
+                "id": f"{item_type}-{i}",
+                "name": f"{item_type.title()} {i}",
+                "project": {"id": project["id"], "name": project["name"]},
+                "owner": {"id": self.random.choice(self.users)["id"]},
+                "createdAt": "2022-01-01T00:00:00Z",
+                "updatedAt": "2022-06-01T00:00:00Z",
+            })
+        return items
+
+    def page(self, collection:str, page_number:int, page_size:int) -> dict:
+        items = self.collections[collection]
+        start = (page_number - 1) * page_size
+        return {
+            "pagination": {"pageNumber": str(page_number), "pageSize": str(page_size), "totalAvailable": str(len(items))},
+            collection: {collection[:-1]: items[start:start + page_size]}
+        }
+
+    def grantee_capabilities(self, item_id:str) -> list:
+        # generated once per item from its own seed, so the permissions do not depend on the order of the requests
+        if item_id not in self._capabilities:
+            generator, capabilities = random.Random(f"{self.seed}-{item_id}"), []
+            for _ in range(self._grantees):
+                grantee = {"group": {"id": generator.choice(self.groups)["id"]}} if generator.random() < 0.7 else {"user": {"id": generator.choice(self.users)["id"]}}
+                grantee["capabilities"] = {"capability": [
+                    {"name": name, "mode": generator.choice(("Allow", "Deny"))} for name in generator.sample(CAPABILITIES, 4)
+                ]}
+                capabilities.append(grantee)
+            self._capabilities[item_id] = capabilities
+        return self._capabilities[item_id]
+
+    def graphql(self, query:str) -> dict:
+        """
+        Answers a Metadata API query with generated nodes for every selected field.
+        Paginated queries ({root}Connection(first: n, after: cursor)) return one page and its pageInfo.
+        """
+        tokens = _tokenize(query)
+        name, _, selection = _root_field(tokens)
+        fields, _ = _parse_selection(tokens, selection)
+        root = tokens[name][0]
+
+        if root.endswith("Connection"):
+            first = int(re.search(r"first:\s*(\d+)", query).group(1))
+            after = re.search(r'after:\s*"(\d+)"', query)
+            start = int(after.group(1)) if after else 0
+            end = min(start + first, self.graphql_nodes)
+            nodes = [self._node(fields["nodes"], root, i) for i in range(start, end)]
+            return {"data": {root: {"nodes": nodes, "pageInfo": {"hasNextPage": end < self.graphql_nodes, "endCursor": str(end)}}}}
+        return {"data": {root: [self._node(fields, root, i) for i in range(self.graphql_nodes)]}}
+
+    def _node(self, selection:dict, path:str, index:int, level:int=0) -> dict:
+        node = {}
+        for field, child_selection in selection.items():
+            if child_selection is None:
+                node[field] = self._value(field, f"{path}-{index}")
+            else:
+                # the first level of nested fields are lists of fanout entities, deeper levels a single entity
+                count = self.fanout if level == 0 else 1
+                node[field] = [self._node(child_selection, f"{path}-{index}-{field}", i, level + 1) for i in range(count)]
+        return node
+
+    @staticmethod
+    def _value(field:str, key:str):
+        if field in ("id", "luid"):
+            return key
+        if field.endswith("At"):
+            return "2022-06-01T00:00:00Z"
+        if field.startswith(("is", "has")):
+            return False
+        return f"{field} {key}"
+
+
+def packaged_file(unpackaged_name:str, size:int) -> bytes:
+    """
+    A packaged workbook or data source (twbx/tdsx) with the twb/tds file and an extract of about size bytes.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(unpackaged_name, "<?xml version='1.0' encoding='utf-8' ?><workbook>" + "<column/>" * 1000 + "</workbook>")
+        zip_file.writestr("Data/Extracts/extract.hyper", random.Random(size).randbytes(size))
+    return buffer.getvalue()
@@ -1,172 +1,406 @@
-try:
-    import os, sys
-    import win32com.client as win32
-    import re
-    import pandas as pd
-    import warnings
-    import time
-    from zipfile import ZipFile, ZIP_DEFLATED
-    from argparse import ArgumentParser
-    from utils import lookup_error, setup_database_connection, setup_REST_connection, query_orphan_datasources, query_unused_workbooks, move_file_to
-except ModuleNotFoundError as e:
-    print("\n\n--------------------------------------------------------------------------------------------------------------\n")
-    print("The python environment you are running this script in does not contain all the dependencies.")
-    print("\n--------------------------------------------------------------------------------------------------------------\n\n")
-    raise Exception(str(e)) from None
-
-
-class IDNotFoundError(Exception):
-    pass
-
-try:
-    outlook = win32.Dispatch('outlook.application')
-except:
-    print("Please open outlook")
-    
-def setup_mail(item_name:str, item_type:str, owner:str, email:str, tableau_location:str, attachment_location:str) -> None:
-    mail = outlook.CreateItem(0)
-    mail.Subject = f"Tableau: {item_type} - {item_name}"
-    mail.SentOnBehalfOfName = "EMAILADDRESSTOSENDFROM"
-    mail.to = email
-    mail.HTMLBody = (
-        fr"""
-        HERE STRUCTURE YOUR EMAIL IN HTML FORMAT
-        """
-    )
-    mail.Attachments.Add(os.path.join(os.getcwd(), attachment_location))
-    mail.Save()
-    
-
-def cleanup_workbooks(dbConnection, REST_conn, delete=False) -> pd.DataFrame:
-    if delete:
-        print("Are you sure you want to delete the workbooks? type 'continue' to continue or 'quit' to quit")
-        breakpoint()
-    df_w = pd.read_sql(query_unused_workbooks(), dbConnection)
-    df_w["id"] = df_w["id"].astype(str)
-    df_w = df_w[df_w["project site name"] == REST_conn.site_name]
-    
-    for index, row in df_w.iterrows():
-        attachment_location = cleanup_item(row["id"], "workbook", REST_conn.download_workbook, REST_conn.delete_workbook if delete else None)
-        setup_mail(
-            item_name=row["workbook name"],
-            item_type="workbook",
-            owner=row["owner"],
-            email=row["email"],
-            tableau_location=row["project path"],
-            attachment_location=attachment_location
-        )
-        move_file_to(attachment_location, BACKUP_LOCATION)
-    
-    return df_w
-    
-def cleanup_datasouces(dbConnection, REST_conn, delete=False) -> pd.DataFrame:
-    if delete:
-        print("Are you sure you want to delete the data sources? type 'continue' to continue or 'quit' to quit")
-        breakpoint()
-    df_d = pd.read_sql(query_orphan_datasources(), dbConnection)
-    df_d["id"] = df_d["id"].astype(str)
-    df_d = df_d[df_d["project site name"] == REST_conn.site_name]
-    
-    for index, row in df_d.iterrows():
-        attachment_location = cleanup_item(row["id"], "data_source", REST_conn.download_data_source, REST_conn.delete_data_source if delete else None)
-        setup_mail(
-            item_name=row["data source name"],
-            item_type="data_source",
-            owner=row["owner"],
-            email=row["email"],
-            tableau_location=row["project path"],
-            attachment_location=attachment_location      
-        )
-        move_file_to(attachment_location, BACKUP_LOCATION)
-    
-    return df_d
-    
-def cleanup_item(id: str, type: str, download_endpoint, delete_endpoint=None) -> str:
-    if type not in ("workbook", "data_source"):
-        raise NotImplementedError(f"Type {type} has not yet been implemented. in function cleanup_item.")
-    
-    unpackaged_extension = 'tds' if type == 'data_source' else 'twb'
-    
-    response = download_endpoint(id)
-    if response.status_code != 200:
-        err = lookup_error(f"download_{type}", response.status_code)
-        raise Exception(err)
-        
-    file_location, item_extension = zip_item(response)
-    
-    if item_extension in (".tdsx", ".twbx"): # packaged tableau data source
-        # extract the tds from the zip file
-        with ZipFile(file_location, 'r') as zf:
-            files = zf.namelist()
-            for file in files:
-                if file.endswith(unpackaged_extension):
-                    extracted_file = zf.extract(file)
-                    break # there is only one file we want to extract, the moment we have it we can stop the loop
-        os.remove(file_location) # we remove the old zipfile since we will create a new one with the same name that contains only the tds/twb file
-        with ZipFile(file_location, "w") as zf:
-            try:
-                extracted_file = re.findall(r".*\\(.*\.(?:twb|tds))", extracted_file)[0]
-            except IndexError:
-                breakpoint()
-            zf.write(extracted_file, compress_type=ZIP_DEFLATED)
-        os.remove(extracted_file) # since we created the zipfile we can now remove the tds/twb file  
-    
-    if delete_endpoint: # this will delete in case an endpoint is provided
-        delete_endpoint(id)
-    
-    return file_location
-    
-        
-def zip_item(response) -> str:
-    filename = re.findall(r'filename="(.*)"', response.headers['Content-Disposition'])[0]
-    file, extension = re.findall(r'(.*)(\..*)', filename)[0]
-    
-    if extension in (".twbx", ".tdsx"):
-        with open(f"{file}.zip", "wb") as f:
-            f.write(response.content)
-        
-    elif extension in (".twb", ".tds"):
-        with open(filename, "wb") as f:
-            f.write(response.content)
-        with ZipFile(f"{file}.zip", 'w') as zf:
-            zf.write(filename, compress_type=ZIP_DEFLATED)
-        os.remove(filename)           
-    return f"{file}.zip", extension
-    
-
-def main(delete: bool, production: bool):
-    dbConn = setup_database_connection()
-    restConn = setup_REST_connection("ts_config.json")
-    
-    workbooks_removed = cleanup_workbooks(dbConn, restConn, delete=delete)
-    data_sources_removed = cleanup_datasouces(dbConn, restConn, delete=delete)
-    try:
-        combined = pd.concat([workbooks_removed, data_sources_removed])
-        combined["item type"] = combined.apply(lambda row: "data source" if isinstance(row["data source name"], str) else "workbook", axis=1)
-        combined["item name"] = combined.apply(lambda row: row["data source name"] if row["item type"]=="data source" else row["workbook name"], axis=1)
-        combined = combined.drop(columns=["data source name", "workbook name"])
-        combined.to_excel(f"{OUTPUT_LOCATION}\\{time.strftime('%Y-%m-%d-%HH-%MM-%SS')}.xlsx", index=False)
-    except:
-        print("There were no workbooks or datasources in need of deletion.")
-    
-    
-    
-    
-if __name__ == "__main__":
-    parser = ArgumentParser(description='A script that allows for automatic archiving of unused workbooks and data sources on Tableau XXX Site')
-    parser.add_argument("--delete", dest="delete", action='store_true', help="default is set to delete")
-    parser.add_argument("--no-delete", dest="delete", action='store_false', help="default is set to delete")
-    
-    parser.set_defaults(delete=True)
-    args = parser.parse_args()
-    
-    OUTPUT_LOCATION = "output\\automatic_archiving"
-    BACKUP_LOCATION = os.path.join(OUTPUT_LOCATION, "backup")
-    
-    # setting to root directory after imports
-    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.chdir(root)
-    
-    with warnings.catch_warnings(): # if your company has a proxy, each request will trigger an SSL warning. To keep the console clean we ignore these
-        warnings.simplefilter("ignore")
-        main(args.delete, args.production)
\ No newline at end of file
+try:
+    import os, sys
+    import re
+    import warnings
+    import time
+    import copy
+    import shutil
+    import tempfile
+    import contextlib
+    from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+    from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+    from argparse import ArgumentParser, Namespace
+    from utils import DEFAULT_REST_ENV, UNUSED_DAYS, NO_DELETE_TAG, NOTIFICATION_BACKENDS, DEFAULT_NOTIFICATION_BACKEND, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT, output_format_error
+except ModuleNotFoundError as e:
+    print("\n\n--------------------------------------------------------------------------------------------------------------\n")
+    print("The python environment you are running this script in does not contain all the dependencies.")
+    print("\n--------------------------------------------------------------------------------------------------------------\n\n")
+    raise Exception(str(e)) from None
+
+
+OUTPUT_LOCATION = "output\\automatic_archiving"
+# the backup store is shared by all sites and the usage index by the sites of a repository, the other files are kept in the output folder of the run
+BACKUP_LOCATION = os.path.join(OUTPUT_LOCATION, "backup")
+USAGE_INDEX_FOLDER = os.path.join(OUTPUT_LOCATION, "usage_index")
+WORK_FOLDER = "in_progress"
+JOURNAL_FILE = "archive_journal.sqlite"
+DEFAULT_MAX_WORKERS = 4
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024 # bytes written at once while downloading and repackaging
+SPOOL_MAX_SIZE = 16 * 1024 * 1024 # packaged files up to this size are repackaged in memory, larger ones in a temporary file (per worker)
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0) # a fixed timestamp makes the archives of identical content identical
+
+# the extension of the unpackaged file of every item type
+ITEM_TYPES = {
+    "workbook": "twb",
+    "data_source": "tds"
+}
+
+def parse_arguments() -> Namespace:
+    parser = ArgumentParser(description='A script that allows for automatic archiving of unused workbooks and data sources on Tableau XXX Site')
+    parser.add_argument("--delete", dest="delete", action='store_true', help="default is set to delete")
+    parser.add_argument("--no-delete", dest="delete", action='store_false', help="default is set to delete")
+    parser.add_argument("--yes", dest="confirm", action='store_false', help="delete without asking for confirmation first, e.g. when the script is scheduled")
+    
+    parser.add_argument("--environment", default=DEFAULT_REST_ENV, help=f"environment of ts_config.json to archive. options: tableau_prod_{{site name}} & tableau_sim_{{site name}}. default: {DEFAULT_REST_ENV}")
+    parser.add_argument("--output-folder", default=OUTPUT_LOCATION, help=f"folder the report, journal and mails of the run are saved in. default: {OUTPUT_LOCATION}")
+    
+    parser.add_argument("--unused-days", type=int, default=UNUSED_DAYS, help=f"workbooks that were not used and data sources that were not published for this many days are archived. default: {UNUSED_DAYS}")
+    parser.add_argument("--no-delete-tag", default=NO_DELETE_TAG, help=f"items with this tag are never archived. default: {NO_DELETE_TAG}")
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS, help=f"number of items that are downloaded and repackaged at the same time. default: {DEFAULT_MAX_WORKERS}")
+    parser.add_argument("--notification-backend", choices=list(NOTIFICATION_BACKENDS), default=DEFAULT_NOTIFICATION_BACKEND, help=f"how the owners are notified, smtp and maildir also work without outlook. default: {DEFAULT_NOTIFICATION_BACKEND}")
+    parser.add_argument("--smtp-host", help="SMTP server used by the smtp notification backend, SMTP_USERNAME and SMTP_PASSWORD are read from the environment")
+    parser.add_argument("--smtp-port", type=int, default=25, help="port of the SMTP server. default: 25")
+    parser.add_argument("--smtp-starttls", dest="smtp_starttls", action="store_true", default=None, help="encrypt the connection to the SMTP server with STARTTLS. default: on when SMTP_USERNAME is set")
+    parser.add_argument("--no-smtp-starttls", dest="smtp_starttls", action="store_false", help="do not use STARTTLS, also when SMTP_USERNAME is set")
+    parser.add_argument("--maildir", help="folder the maildir notification backend writes the mails to. default: the mails folder in the output folder")
+    parser.add_argument("--project-structure", action="store_true", help="also save the project structure of the site, which is read from the project hierarchy the unused items were looked up in")
+    parser.add_argument("--output-format", choices=list(OUTPUT_FORMATS), default=DEFAULT_OUTPUT_FORMAT, help=f"file format of the report of archived items. default: {DEFAULT_OUTPUT_FORMAT}")
+    parser.add_argument("--profile", action="store_true", help="profile the run and save the profile in the profile folder of the output folder, the functions that took the most time are printed")
+    parser.add_argument("--profile-memory", action="store_true", help="also trace the memory allocations while profiling and save the lines that allocated the most memory. makes the run slower")
+    parser.add_argument("--sign-out", action="store_true", help="sign out the Tableau sessions that were kept between runs (when TABLEAU_TOKEN_CACHE is 1) and remove the token cache, nothing else is run")
+    
+    parser.set_defaults(delete=True)
+    args = parser.parse_args()
+    if args.notification_backend == "smtp" and not args.smtp_host:
+        parser.error("--smtp-host is required for the smtp notification backend")
+    if output_format_error(args.output_format):
+        parser.error(output_format_error(args.output_format))
+    return args
+
+
+# the arguments are parsed before pandas, SQLAlchemy and tableau_api_lib are imported, so --help and wrong arguments are answered at once
+if __name__ == "__main__":
+    args = parse_arguments()
+
+try:
+    import pandas as pd
+    from tableau_api_lib import api_endpoints
+    from utils import lookup_error, open_json, repository_details, setup_database_connection, setup_REST_connection, sign_out_cached_sessions, create_project_hierarchy, query_project_structure, query_orphan_datasources, query_unused_workbooks, read_sql_chunks, read_sql_streamed, tableau_requests, UsageIndex, ArchiveJournal, BackupStore, Notifier, OutlookBackend, SmtpBackend, MaildirBackend, open_sink, instrumentation, profiled
+except ModuleNotFoundError as e:
+    print("\n\n--------------------------------------------------------------------------------------------------------------\n")
+    print("The python environment you are running this script in does not contain all the dependencies.")
+    print("\n--------------------------------------------------------------------------------------------------------------\n\n")
+    raise Exception(str(e)) from None
+
+
+class IDNotFoundError(Exception):
+    pass
+
+def usage_index_location(repository: str) -> str:
+    # SERVERNAME:8060/workgroup? -> usage_index\SERVERNAME_8060_workgroup.sqlite
+    return os.path.join(USAGE_INDEX_FOLDER, re.sub(r"\W+", "_", repository).strip("_") + ".sqlite")
+
+def unused_items(dbConnection, REST_conn, type: str, delete=False, unused_days=UNUSED_DAYS, no_delete_tag=NO_DELETE_TAG, usage_index=None, confirm=True) -> pd.DataFrame:
+    if type not in ITEM_TYPES:
+        raise NotImplementedError(f"Type {type} has not yet been implemented. in function unused_items.")
+    
+    if delete and confirm:
+        print(f"Are you sure you want to delete the {type.replace('_', ' ')}s? type 'continue' to continue or 'quit' to quit")
+        breakpoint()
+    # only the projects of the site we are signed into are computed by the database, once for workbooks and data sources
+    create_project_hierarchy(dbConnection, site=REST_conn.site_name)
+    if type == "workbook":
+        query, item_name_column = query_unused_workbooks(no_delete_tag=no_delete_tag), "workbook name"
+    else:
+        query, item_name_column = query_orphan_datasources(unused_days=unused_days, no_delete_tag=no_delete_tag), "data source name"
+    df = read_sql_streamed(query, dbConnection)
+    if type == "workbook":
+        df = filter_unused_workbooks(df, dbConnection, usage_index, unused_days)
+    df["id"] = df["id"].astype(str)
+    df["item type"] = type
+    df = df.rename(columns={item_name_column: "item name"})
+    return df
+
+def filter_unused_workbooks(df, dbConnection, usage_index, unused_days=UNUSED_DAYS) -> pd.DataFrame:
+    """
+    Keeps the workbooks that were not used for unused_days, the last use comes from the local usage index of the repository
+    which only reads the historical events that were added since the previous run.
+    """
+    if usage_index is None:
+        # the index of the repository the connection belongs to
+        url = dbConnection.engine.url
+        with UsageIndex(usage_index_location(f"{url.host}:{url.port}/{url.database}")) as usage_index:
+            return filter_unused_workbooks(df, dbConnection, usage_index, unused_days)
+
+    print("Updating the usage index...")
+    with instrumentation.stage("update usage index"):
+        events = usage_index.update(dbConnection)
+    print(f"{events} historical events were read into the usage index")
+
+    # the repository stores its timestamps in UTC
+    df["last used"] = usage_index.last_used(df["workbook repository id"]).values
+    unused_since = pd.Timestamp.now(tz="UTC").tz_localize(None) - pd.Timedelta(days=unused_days)
+    df = df[df["last used"].isna() | (df["last used"] <= unused_since)]
+    return df.drop(columns="workbook repository id").reset_index(drop=True)
+
+def archive_items(df, REST_conn, journal, store, notifier, delete=False, max_workers=DEFAULT_MAX_WORKERS, work_folder=os.path.join(OUTPUT_LOCATION, WORK_FOLDER)) -> pd.DataFrame:
+    """
+    Archives the items in df in stages: download -> repackage -> move to backup -> mail.
+    Downloading and repackaging run for up to max_workers items at the same time, the other stages run on the main thread as soon as an item is ready.
+    The mails are grouped per owner and delivered by the notifier in the background, the owner gets one mail once all of their items are archived.
+    The items are deleted by delete_items once the notifier delivered the mails. Returns the items that were archived.
+    Every completed stage is recorded in the journal, stages that an earlier run already completed are skipped.
+    Items that an earlier run deleted before their owner was mailed are mailed again with the backup of that run.
+    """
+    archived = []
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures, stages = {}, {}
+        for index, row in df.iterrows():
+            stages[index] = journal.completed(row["id"])
+            resume_location = stages[index].get("backed_up") or stages[index].get("prepared")
+            
+            if "mailed" in stages[index] and ("deleted" in stages[index] or ("backed_up" in stages[index] and not delete)):
+                print(f"{row['item type']} {row['item name']} was already archived in an earlier run, skipping")
+                continue
+            elif "mailed" in stages[index] and "backed_up" in stages[index]:
+                # only the delete is left, which delete_items does once the mails are delivered
+                future = Future()
+                future.set_result(resume_location)
+            elif resume_location and os.path.exists(resume_location):
+                # the archive of an earlier run is reused instead of downloading the item again
+                future = Future()
+                future.set_result(resume_location)
+            else:
+                journal.forget(row["id"])
+                stages[index] = {}
+                # every item gets its own copy of the connection since tableau_api_lib stores the active request on the instance
+                future = executor.submit(cleanup_item, row["id"], row["item type"], copy.copy(REST_conn), work_folder)
+            futures[future] = index
+            if "mailed" not in stages[index]:
+                notifier.expect(row["email"])
+        
+        for future in as_completed(futures):
+            index = futures[future]
+            row, completed = df.loc[index], stages[index]
+            notified = "mailed" in completed
+            try:
+                attachment_location = future.result()
+                if "prepared" not in completed:
+                    journal.record(row["id"], "prepared", attachment_location)
+                
+                if "backed_up" in completed:
+                    backup_location = completed["backed_up"]
+                else:
+                    with instrumentation.stage("backup"):
+                        backup_location = backup_item(attachment_location, row, store)
+                    journal.record(row["id"], "backed_up", backup_location)
+                
+                if not notified:
+                    # the backup is attached, the files in progress are already removed
+                    notifier.add(row["email"], row["owner"], {
+                        "id": row["id"],
+                        "item_name": row["item name"],
+                        "item_type": row["item type"],
+                        "tableau_location": row["project path"],
+                        "attachment_location": backup_location,
+                        "attachment_name": store.lookup(row["id"])[0]["file_name"]
+                    })
+                    notified = True
+            except Exception as err:
+                print(f"{row['item type']} {row['item name']} ({row['id']}) could not be archived and is skipped:\n{err}")
+                if not notified:
+                    notifier.skip(row["email"])
+                instrumentation.count("items failed")
+                continue
+            
+            print(f"Archived {row['item type']} {row['item name']}, backup saved at {backup_location}")
+            archived.append(index)
+            instrumentation.count("items archived")
+    
+    return df.loc[df.index.isin(archived)]
+
+def delete_items(df, REST_conn, journal) -> list:
+    """
+    Deletes the archived items of which the owner was mailed, so nobody loses an item without being told.
+    Items of which the mail could not be delivered are kept, the next run delivers the mail and deletes them.
+    Returns for every item whether it is deleted.
+    """
+    deleted = []
+    for _, row in df.iterrows():
+        completed = journal.completed(row["id"])
+        if "deleted" in completed:
+            deleted.append(True)
+            continue
+        if "mailed" not in completed:
+            print(f"{row['item type']} {row['item name']} is not deleted since its owner was not mailed yet")
+            deleted.append(False)
+            continue
+        
+        delete_endpoint = REST_conn.delete_workbook if row["item type"] == "workbook" else REST_conn.delete_data_source
+        with instrumentation.stage("delete"):
+            response = delete_endpoint(row["id"])
+        if response.status_code != 204:
+            print(f"{row['item type']} {row['item name']} ({row['id']}) could not be deleted, status code {response.status_code}")
+            deleted.append(False)
+            continue
+        journal.record(row["id"], "deleted")
+        instrumentation.count("items deleted")
+        deleted.append(True)
+    return deleted
+    
+def cleanup_item(id: str, type: str, REST_conn, work_folder: str = os.path.join(OUTPUT_LOCATION, WORK_FOLDER)) -> str:
+    """
+    Downloads the item and repackages it into a zip file that only contains the twb/tds file.
+    Every item is handled in its own folder, so items with the same file name can be processed at the same time.
+    """
+    if type not in ITEM_TYPES:
+        raise NotImplementedError(f"Type {type} has not yet been implemented. in function cleanup_item.")
+    
+    item_folder = os.path.join(work_folder, id)
+    if os.path.exists(item_folder):  # leftovers of a run that was interrupted
+        shutil.rmtree(item_folder)
+    os.makedirs(item_folder)
+    
+    with download_item(id, type, REST_conn) as response:
+        filename = os.path.basename(re.findall(r'filename="(.*)"', response.headers['Content-Disposition'])[0])
+        file, extension = os.path.splitext(filename)
+        zip_location = os.path.join(item_folder, f"{file}.zip")
+        chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        
+        if extension in (".twbx", ".tdsx"): # packaged tableau workbook or data source
+            # reading a zip needs random access, small downloads are kept in memory and only large ones are spooled to a temporary file
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=item_folder) as packaged_file:
+                with instrumentation.stage("download"):
+                    for chunk in chunks:
+                        packaged_file.write(chunk)
+                with instrumentation.stage("zip"):
+                    repackage_item(packaged_file, zip_location, ITEM_TYPES[type])
+        
+        elif extension in (".twb", ".tds"):
+            # the download is compressed straight into the zip file, so zipping is part of the download stage
+            with instrumentation.stage("download"), ZipFile(zip_location, "w", compression=ZIP_DEFLATED) as zf, zf.open(zip_member(filename), "w") as member:
+                for chunk in chunks:
+                    member.write(chunk)
+        
+        else:
+            raise NotImplementedError(f"Files with extension {extension} can not be archived.")
+    
+    return zip_location
+
+def download_item(id: str, type: str, REST_conn):
+    """
+    Requests the content of the item as a stream, so large packaged workbooks are never held in memory at once.
+    """
+    endpoint_class, endpoint_kwargs = {
+        "workbook": (api_endpoints.WorkbookEndpoint, {"workbook_id": id, "download_workbook": True}),
+        "data_source": (api_endpoints.DatasourceEndpoint, {"datasource_id": id, "download_datasource": True})
+    }[type]
+    url = endpoint_class(ts_connection=REST_conn, **endpoint_kwargs).get_endpoint()
+    
+    response = tableau_requests.get(url, headers=REST_conn.default_headers, verify=REST_conn.ssl_verify, stream=True)
+    if response.status_code != 200:
+        response.close()
+        err = lookup_error(f"download_{type}", response.status_code)
+        raise Exception(err)
+    return response
+        
+def repackage_item(packaged_file, zip_location: str, unpackaged_extension: str) -> None:
+    """
+    Copies the twb/tds file from the packaged file (twbx/tdsx) into a new zip file without extracting it to disk.
+    """
+    with ZipFile(packaged_file, "r") as packaged:
+        # zip files should use / as separator, but some tools write \ instead
+        members = [(re.split(r"[\\/]", info.filename), info) for info in packaged.infolist() if info.filename.lower().endswith(f".{unpackaged_extension}")]
+        if not members:
+            raise FileNotFoundError(f"The packaged file does not contain a .{unpackaged_extension} file")
+
+        # the file we want to keep is the one closest to the root of the packaged file
+        path, member = min(members, key=lambda member: len(member[0]))
+        arcname = path[-1]
+        with ZipFile(zip_location, "w", compression=ZIP_DEFLATED) as zf, packaged.open(member) as source, zf.open(zip_member(arcname), "w") as destination:
+            shutil.copyfileobj(source, destination, DOWNLOAD_CHUNK_SIZE)
+
+def zip_member(name: str) -> ZipInfo:
+    member = ZipInfo(name, date_time=ZIP_DATE_TIME)
+    member.compress_type = ZIP_DEFLATED
+    member.external_attr = 0o644 << 16
+    return member
+
+def backup_item(attachment_location: str, row, store) -> str:
+    """
+    Adds the archive to the content addressed backup store and verifies the backup (same hash and a readable zip) before it is trusted.
+    """
+    with ZipFile(attachment_location, "r") as zf:
+        corrupt_file = zf.testzip()
+    if corrupt_file is not None:
+        raise IOError(f"The archive at {attachment_location} is corrupt ({corrupt_file})")
+    
+    # the store checks the hash of the stored object
+    backup_location = store.add(attachment_location, row["id"], site=row["project site name"], project_path=row["project path"], owner=row["owner"])
+    
+    shutil.rmtree(os.path.dirname(attachment_location), ignore_errors=True)
+    return backup_location
+    
+
+def main(delete: bool, output_format: str = DEFAULT_OUTPUT_FORMAT, max_workers: int = DEFAULT_MAX_WORKERS, notification_backend=None, unused_days: int = UNUSED_DAYS, no_delete_tag: str = NO_DELETE_TAG, environment: str = DEFAULT_REST_ENV, output_folder: str = OUTPUT_LOCATION, confirm: bool = True, project_structure: bool = False):
+    instrumentation.start("automatic_archiving", environment)
+    with instrumentation.stage("sign in"):
+        restConn = setup_REST_connection("ts_config.json", environment=environment)
+    # the unused items are looked up in the repository of the server of the environment, never in the repository of another server
+    repository = repository_details(open_json("ts_config.json"), environment)
+    with instrumentation.stage("connect repository"):
+        dbConn = setup_database_connection(repository)
+    notification_backend = notification_backend or OutlookBackend()
+    
+    # the workbooks and data sources are archived together, so owners of both get one mail
+    with instrumentation.stage("query unused items"):
+        with UsageIndex(usage_index_location(repository)) as usage_index:
+            workbooks = unused_items(dbConn, restConn, "workbook", delete=delete, unused_days=unused_days, no_delete_tag=no_delete_tag, usage_index=usage_index, confirm=confirm)
+        items = pd.concat([
+            workbooks,
+            unused_items(dbConn, restConn, "data_source", delete=delete, unused_days=unused_days, no_delete_tag=no_delete_tag, confirm=confirm)
+        ]).reset_index(drop=True)
+    instrumentation.count("unused items", len(items))
+    report_name = time.strftime('%Y-%m-%d-%HH-%MM-%SS')
+    
+    if project_structure:
+        # the hierarchy was already computed for the unused items, so the project structure costs no second computation
+        print(f"Saving file at {output_folder}: '{report_name}_project_structure.{output_format}'")
+        with instrumentation.stage("write"), open_sink(output_format, output_folder, f"{report_name}_project_structure", sheet_name="project structure") as sink:
+            for chunk in read_sql_chunks(query_project_structure(), dbConn):
+                sink.write(chunk)
+    
+    # the journal remembers the stages that were completed, so a rerun continues where this run stopped
+    # the backup store only keeps one copy of items that are archived more than once
+    with ArchiveJournal(os.path.join(output_folder, JOURNAL_FILE)) as journal, BackupStore(BACKUP_LOCATION) as store:
+        mark_mailed = lambda digest: [journal.record(item["id"], "mailed") for item in digest["items"]]
+        with Notifier(notification_backend, on_sent=mark_mailed) as notifier:
+            combined = archive_items(items, restConn, journal, store, notifier, delete=delete, max_workers=max_workers, work_folder=os.path.join(output_folder, WORK_FOLDER))
+            print("Waiting until all mails are delivered...")
+        if notifier.errors:
+            print(f"{len(notifier.errors)} mail(s) could not be delivered, they will be retried in the next run")
+        # the items are only deleted after their owner was mailed, the mails are delivered once the notifier is closed
+        if delete and not combined.empty:
+            combined = combined.assign(deleted=delete_items(combined, restConn, journal))
+    
+    if combined.empty:
+        print("There were no workbooks or datasources in need of deletion.")
+    else:
+        combined["item type"] = combined["item type"].replace({"data_source": "data source"})
+        with instrumentation.stage("write"), open_sink(output_format, output_folder, report_name, sheet_name="archived items") as sink:
+            sink.write(combined)
+    # the durations of the stages and the cost of the requests are saved next to the report of the run
+    instrumentation.write(output_folder, f"{report_name}_run_report")
+    
+    
+if __name__ == "__main__":
+    # setting to root directory after imports
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(root)
+    
+    if args.sign_out:
+        sign_out_cached_sessions()
+        sys.exit()
+    
+    if args.notification_backend == "smtp":
+        notification_backend = SmtpBackend(args.smtp_host, args.smtp_port, username=os.environ.get("SMTP_USERNAME"), password=os.environ.get("SMTP_PASSWORD"), starttls=args.smtp_starttls)
+    elif args.notification_backend == "maildir":
+        notification_backend = MaildirBackend(args.maildir or os.path.join(args.output_folder, "mails"))
+    else:
+        notification_backend = OutlookBackend()
+    
+    profiler = profiled(args.output_folder, "automatic_archiving", memory=args.profile_memory) if args.profile or args.profile_memory else contextlib.nullcontext()
+    with profiler, warnings.catch_warnings(): # if your company has a proxy, each request will trigger an SSL warning. To keep the console clean we ignore these
+        warnings.simplefilter("ignore")
+        main(args.delete, args.output_format, args.max_workers, notification_backend, args.unused_days, args.no_delete_tag, args.environment, args.output_folder, args.confirm, args.project_structure)
\ No newline at end of file
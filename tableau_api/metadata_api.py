@@ -1,53 +1,168 @@
-try:
-    import os
-    import warnings
-    import time
-    import argparse
-    from tableau_api_lib import TableauServerConnection
-    from utils import queries, convert_query, move_to_historiek, setup_REST_connection
-except ModuleNotFoundError as e:
-    print("\n\n--------------------------------------------------------------------------------------------------------------\n")
-    print("The python environment you are running this script in does not contain all the dependencies.")
-    print("\n--------------------------------------------------------------------------------------------------------------\n\n")
-    raise Exception(str(e)) from None
-
-TS_CONFIG_NAME = "ts_config"
-OUTPUT_FOLDER = "output\\metadata_api"
-DEFAULT_ENV = ""
-
-def main(environment):   
-    with warnings.catch_warnings(): # we get a warning that no ssl is inplace if the company has a proxy
-        warnings.simplefilter("ignore")
-        
-        start_time = time.time()
-        
-        # establishing connection with REST API
-        conn = setup_REST_connection(f"{TS_CONFIG_NAME}.json", environment=environment)
-        
-        # move existing files to historiek
-        move_to_historiek(folder=OUTPUT_FOLDER)
-
-        # run queries and sign out
-        for query_name, query in queries.items():
-            convert_query(OUTPUT_FOLDER, conn, query_name, query)
-        conn.sign_out()
-
-        end_time = time.time()
-        print("Signed out succesfully!")
-        print(f"It took {int(round(end_time - start_time, 0))} seconds to run the program")
-
-            
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='A script that allows for metadata extraction by using graphql queries')
-    parser.add_argument(
-        "--environment",
-        help="Environment to run the extraction in. options: tableau_prod_{site name} & tableau_sim_{site name}.",
-        default=DEFAULT_ENV
-    )
-    args = parser.parse_args()
-    
-    # setting to root directory after imports
-    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.chdir(root)
-    
-    main(args.environment)
\ No newline at end of file
+try:
+    import os, sys
+    import warnings
+    import time
+    import argparse
+    import copy
+    import contextlib
+    from concurrent.futures import ThreadPoolExecutor
+    from utils import queries, page_sizes, incremental_queries, DEFAULT_PAGE_SIZE, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT, output_format_error
+except ModuleNotFoundError as e:
+    print("\n\n--------------------------------------------------------------------------------------------------------------\n")
+    print("The python environment you are running this script in does not contain all the dependencies.")
+    print("\n--------------------------------------------------------------------------------------------------------------\n\n")
+    raise Exception(str(e)) from None
+
+TS_CONFIG_NAME = "ts_config"
+OUTPUT_FOLDER = "output\\metadata_api"
+INCREMENTAL_FOLDER_NAME = "incremental"
+DEFAULT_ENV = ""
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='A script that allows for metadata extraction by using graphql queries')
+    parser.add_argument(
+        "--environment",
+        help="Environment to run the extraction in. options: tableau_prod_{site name} & tableau_sim_{site name}.",
+        default=DEFAULT_ENV
+    )
+    parser.add_argument(
+        "--normalize",
+        help="Save every entity level of a query (e.g. workbooks, dashboards, sheets) in its own sheet linked by key columns, instead of one exploded sheet.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--page-size",
+        help="Number of root entities requested per page for every query, overriding the page sizes in metadata_queries.py. Use 0 to run every query in one request.",
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        "--jobs",
+        help="Number of queries that are executed in parallel. default: 1",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--incremental",
+        help=f"Only extract the workbooks and data sources that changed since the previous incremental run and merge them into its results. Applies to: {', '.join(incremental_queries)}.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--output-folder",
+        help=f"Folder the results are saved in. default: {OUTPUT_FOLDER}",
+        default=OUTPUT_FOLDER
+    )
+    parser.add_argument(
+        "--output-format",
+        help=f"File format the results are saved in. xlsx is limited to 1048576 rows per sheet, parquet and feather require pyarrow. default: {DEFAULT_OUTPUT_FORMAT}",
+        choices=list(OUTPUT_FORMATS),
+        default=DEFAULT_OUTPUT_FORMAT
+    )
+    parser.add_argument(
+        "--record",
+        help="Record every request to the Tableau server and its response in this cassette file, e.g. output\\cassettes\\metadata_api.sqlite",
+        metavar="CASSETTE",
+        default=None
+    )
+    parser.add_argument(
+        "--replay",
+        help="Replay the responses of a recorded cassette file instead of sending the requests to the Tableau server",
+        metavar="CASSETTE",
+        default=None
+    )
+    parser.add_argument(
+        "--replay-latency",
+        help="Seconds every replayed response waits, to mimic the server. default: 0",
+        type=float,
+        default=0.0
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the run and save the profile in the profile folder of the output folder, the functions that took the most time are printed",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile-memory",
+        help="Also trace the memory allocations while profiling and save the lines that allocated the most memory. Makes the run slower.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--sign-out",
+        help="Sign out the Tableau sessions that were kept between runs (when TABLEAU_TOKEN_CACHE is 1) and remove the token cache, nothing else is run",
+        action="store_true"
+    )
+    args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error("--record can not be combined with --replay")
+    if args.incremental and args.normalize:
+        parser.error("--incremental can not be combined with --normalize")
+    if output_format_error(args.output_format):
+        parser.error(output_format_error(args.output_format))
+    return args
+
+
+# the arguments are parsed before pandas and tableau_api_lib are imported, so --help and wrong arguments are answered at once
+if __name__ == "__main__":
+    args = parse_arguments()
+
+try:
+    from utils import IncrementalState, convert_query, convert_query_incremental, move_to_historiek, setup_REST_connection, sign_out_REST_connection, sign_out_cached_sessions, use_cassette, instrumentation, profiled
+except ModuleNotFoundError as e:
+    print("\n\n--------------------------------------------------------------------------------------------------------------\n")
+    print("The python environment you are running this script in does not contain all the dependencies.")
+    print("\n--------------------------------------------------------------------------------------------------------------\n\n")
+    raise Exception(str(e)) from None
+
+def main(environment, normalize=False, page_size=None, jobs=1, incremental=False, output_format=DEFAULT_OUTPUT_FORMAT, output_folder=OUTPUT_FOLDER):   
+    with warnings.catch_warnings(): # we get a warning that no ssl is inplace if the company has a proxy
+        warnings.simplefilter("ignore")
+        
+        start_time = time.time()
+        instrumentation.start("metadata_api", environment)
+        
+        # establishing connection with REST API
+        with instrumentation.stage("sign in"):
+            conn = setup_REST_connection(f"{TS_CONFIG_NAME}.json", environment=environment)
+        
+        # move existing files to historiek
+        move_to_historiek(folder=output_folder)
+        
+        # watermarks and snapshots of the previous incremental runs
+        state = IncrementalState(f"{output_folder}\\{INCREMENTAL_FOLDER_NAME}") if incremental else None
+
+        # run queries
+        # the queries are independent, so up to jobs queries are requested, flattened and written at the same time
+        # every query gets its own copy of the signed in connection since tableau_api_lib stores the active request on the instance
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = []
+            for query_name, query in queries.items():
+                query_page_size = page_sizes.get(query_name, DEFAULT_PAGE_SIZE) if page_size is None else page_size
+                if incremental and query_name in incremental_queries:
+                    futures.append(executor.submit(convert_query_incremental, output_folder, copy.copy(conn), query_name, query, incremental_queries[query_name], state, page_size=query_page_size, output_format=output_format))
+                else:
+                    futures.append(executor.submit(convert_query, output_folder, copy.copy(conn), query_name, query, normalize=normalize, page_size=query_page_size, output_format=output_format))
+            for future in futures:
+                future.result()
+        sign_out_REST_connection(conn)
+
+        end_time = time.time()
+        print(f"It took {int(round(end_time - start_time, 0))} seconds to run the program")
+        # the durations of the stages and the cost of the requests are saved next to the results
+        instrumentation.write(output_folder)
+
+            
+if __name__ == "__main__":
+    # setting to root directory after imports
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(root)
+    
+    if args.sign_out:
+        sign_out_cached_sessions()
+        sys.exit()
+    
+    # the cassette records or replays the requests of the run, see utils/cassette.py
+    cassette = use_cassette(args.record or args.replay, "record" if args.record else "replay", args.replay_latency) if args.record or args.replay else contextlib.nullcontext()
+    profiler = profiled(args.output_folder, "metadata_api", memory=args.profile_memory) if args.profile or args.profile_memory else contextlib.nullcontext()
+    with cassette, profiler:
+        main(args.environment, args.normalize, args.page_size, args.jobs, args.incremental, args.output_format, args.output_folder)
\ No newline at end of file
@@ -1,209 +1,317 @@
-try:
-    import os
-    import warnings
-    import contextlib
-    import pandas as pd
-    from utils import FlattenedDataFrame, ProjectDataFrame, ItemDataFrame, setup_REST_connection, move_to_historiek
-    from tableau_api_lib.utils import extract_pages
-except ModuleNotFoundError as e:
-    print("\n\n--------------------------------------------------------------------------------------------------------------\n")
-    print("The python environment you are running this script in does not contain all the dependencies.")
-    print("\n--------------------------------------------------------------------------------------------------------------\n\n")
-    raise Exception(str(e)) from None
-
-TS_CONFIG_NAME = "ts_config.json"
-
-# mapping was retrieved from: https://help.tableau.com/current/api/rest_api/en-us/REST/rest_api_concepts_permissions.htm
-PERMISSION_MAPPING = { 
-    "AddComment": "Add Comment",
-    "ChangeHierarchy": "Move",
-    "ChangePermissions": "Set Permissions",
-    "CreateRefreshMetrics": "Create/Refresh Metrics",
-    "Execute": "Run Flow",
-    "ExportData": "View Summary Data",
-    "ExportImage": "Export Image",
-    "ExportXml": "Download",
-    "InheritedProjectLeader": "Project Leader",
-    "ProjectLeader": "Project Leader",
-    "Read": "View",
-    "RunExplainData": "Run Explain Data",
-    "ShareView": "Share Customized",
-    "SaveAs": "Save As",
-    "ViewComments": "View Comments",
-    "ViewUnderlyingData": "View Underlying Data",
-    "WebAuthoring": "Web Edit",
-    "Write": "Save"
-}
-
-def project_permissions(conn, df, df_projects):
-    project_responses = []
-    
-    # we only need to get the permissions for the root projects and subfolders that are not locked by the root folder
-    mask = df_projects["parentProjectId"].isna() | ~ (df_projects["rootParentContentPermissions"] =="LockedToProject")
-    df_projects = df_projects.loc[mask, :]
-    
-    for _, row in df_projects.iterrows():
-        id, name, rootParentProjectId = row["id"], row["name"], row["rootParentProjectId"]
-        # with statement blocks print statements done by FlattenedDataFrame
-        with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
-            temp = FlattenedDataFrame(conn.query_project_permissions(id).json().get("permissions").get("granteeCapabilities"))
-        temp[["item_id", "item_name", "item_type", "item_project", "rootParentProjectId"]] = id, name, "project", name, rootParentProjectId
-        project_responses.append(temp)
-    
-    to_return =  df.merge(
-        pd.concat(project_responses).reset_index(drop=True).drop(columns="snapshot_date"),
-        how="left", 
-        left_on="id", 
-        right_on="rootParentProjectId",
-        suffixes=["", "_y"]
-    ).drop(columns="rootParentProjectId_y")
-    
-    return to_return
-   
-def workbook_permissions(conn, df, df_workbooks):
-    workbook_responses = []
-
-    for _, row in df_workbooks.iterrows():
-        id, name, project_name, rootParentProjectId = row["id"], row["name"], row["project_name"], row["rootParentProjectId"]
-        
-        # with statement blocks the unnecessary prints done by FlattenedDataFrame
-        with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
-            temp = FlattenedDataFrame(conn.query_workbook_permissions(id).json().get("permissions").get("granteeCapabilities"))
-        temp[["item_id", "item_name", "item_type", "item_project", "rootParentProjectId"]] = id, name, "workbook", project_name, rootParentProjectId
-        workbook_responses.append(temp)
-    
-    to_return =  df.merge(
-        pd.concat(workbook_responses).reset_index(drop=True).drop(columns="snapshot_date"),
-        how="inner", 
-        left_on="id", 
-        right_on="rootParentProjectId",
-        suffixes=["", "_y"]
-    ).drop(columns="rootParentProjectId_y")
-    
-    return to_return
-    
-def datasource_permissions(conn, df, df_datasources):
-    datasource_responses = []
-    
-    for _, row in df_datasources.iterrows():
-        id, name, project_name, rootParentProjectId = row["id"], row["name"], row["project_name"], row["rootParentProjectId"]
-        
-        # with statement blocks the unnecessary prints done by FlattenedDataFrame
-        with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
-            temp = FlattenedDataFrame(conn.query_data_source_permissions(id).json().get("permissions").get("granteeCapabilities"))
-        temp[["item_id", "item_name", "item_type", "item_project", "rootParentProjectId"]] = id, name, "datasource", project_name, rootParentProjectId
-        datasource_responses.append(temp)
-    
-    to_return =  df.merge(
-        pd.concat(datasource_responses).reset_index(drop=True).drop(columns="snapshot_date"),
-        how="inner", 
-        left_on="id", 
-        right_on="rootParentProjectId",
-        suffixes=["", "_y"]
-    ).drop(columns="rootParentProjectId_y")
-    
-    return to_return
-
-def flow_permissions(conn, df, df_flows):
-    flow_responses = []
-    
-    for _, row in df_flows.iterrows():
-        id, name, project_name, rootParentProjectId = row["id"], row["name"], row["project_name"], row["rootParentProjectId"]
-        
-        # with statement blocks the unnecessary prints done by FlattenedDataFrame
-        with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
-            temp = FlattenedDataFrame(conn.query_flow_permissions(id).json().get("permissions").get("granteeCapabilities"))
-        temp[["item_id", "item_name", "item_type", "item_project", "rootParentProjectId"]] = id, name, "flow", project_name, rootParentProjectId
-        flow_responses.append(temp)
-        
-    to_return =  df.merge(
-        pd.concat(flow_responses).reset_index(drop=True).drop(columns="snapshot_date"),
-        how="inner", 
-        left_on="id", 
-        right_on="rootParentProjectId",
-        suffixes=["", "_y"]
-    ).drop(columns="rootParentProjectId_y")
-    
-    return to_return
-
-def main():
-    conn = setup_REST_connection(TS_CONFIG_NAME)
-    
-    # to have a full view of the permissions we need the permissions of all projects, data sources, workbooks, flows and combine this with the groups and users
-    # with statement blocks the unnecessary prints done by FlattenedDataFrame
-    with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
-        df_projects = ProjectDataFrame(extract_pages(conn.query_projects)) 
-        df_datasources = ItemDataFrame(extract_pages(conn.query_data_sources), df_projects) # we pass df_projects so we can see in which root project the data source lies
-        df_workbooks = ItemDataFrame(extract_pages(conn.query_workbooks_for_site), df_projects) # we pass df_projects so we can see in which root project the workbook lies
-        df_flows = ItemDataFrame(extract_pages(conn.query_flows_for_site), df_projects) # we pass df_projects so we can see in which root project the flow lies
-        df_groups = FlattenedDataFrame(extract_pages(conn.query_groups))[["id", "name"]].rename(columns={"id":"group_id", "name": "group_name"})
-        df_users = FlattenedDataFrame(extract_pages(conn.get_users_on_site))[["id", "name"]].rename(columns={"id": "user_id", "name":"user_name"})
-    
-    # we will use the root project as our main dataframe to which we will join the projects, data sources and workbooks 
-    df = df_projects.loc[df_projects["parentProjectId"].isna()].reset_index(drop=True)
-    
-    # retrieving project, datasource, workbook and flow permissions, then combining them into one dataframe
-    print("Retrieving project, datasource, workbook and flow permissions. This might take a while...")
-    pp = project_permissions(conn, df, df_projects)
-    print("\tProject permissions done!")
-    dp = datasource_permissions(conn, df, df_datasources)
-    print("\tData Source permissions done!")
-    wp = workbook_permissions(conn, df, df_workbooks)
-    print("\tWorkbook permissions done!")
-    fp = flow_permissions(conn,df, df_flows)
-    print("\tFlow permissions done!")
-    print("Done!\n")
-    
-    print("Combining permissions...", end="")
-    df = pd.concat([pp, dp, wp, fp]).reset_index(drop=True)
-    print(" Done!\n")
-    
-    
-    # adding groupnames
-    print("Adding group names...", end="")
-    df = df.merge(df_groups, how="left", left_on="group_id", right_on="group_id")
-    print(" Done!\n")
-    
-    # adding users
-    print("Adding user names...", end="")
-    df = df.merge(df_users, how="left", left_on="user_id", right_on="user_id")
-    print(" Done!\n")
-    
-    # tidying up the dataframe
-    print("Reformatting the data...", end="")
-    df.loc[df["group_id"].notna(), "grantee_type"] = "group"
-    df.loc[df["group_id"].notna(), "grantee_id"] = df.loc[df["group_id"].notna(), "group_id"]
-    df.loc[df["group_id"].notna(), "grantee"] = df.loc[df["group_id"].notna(), "group_name"]
-    df.loc[df["user_id"].notna(), "grantee_type"] = "user"
-    df.loc[df["user_id"].notna(), "grantee_id"] = df.loc[df["user_id"].notna(), "user_id"]
-    df.loc[df["user_id"].notna(), "grantee"] = df.loc[df["user_id"].notna(), "user_name"]
-    df = df.drop(columns=["parentProjectId", "group_id", "user_id", "group_name", "user_name"])
-    df = df.rename(
-        columns={
-        "name": "root_parent_project_name",
-        "rootParentProjectId": "root_parent_project_id",
-        "rootParentContentPermissions": "root_parent_content_permissions"}
-    )
-    df["capabilities_capability_name"] = df.apply(lambda row: PERMISSION_MAPPING.get(row["capabilities_capability_name"], row["capabilities_capability_name"]), axis=1)
-    print(" Done!\n")
-    
-    move_to_historiek("output\\permissions")
-    
-    # saving to output folder and to gateway
-    print("Saving results...", end="")
-    df.to_excel("output\\permissions\\Tableau_permissions.xlsx", sheet_name="Tableau_permissions", index=False)
-    print(" Done!")
-    
-    
-if __name__ == "__main__":
-    # setting to root directory after imports
-    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.chdir(root)
-    
-    with warnings.catch_warnings(): # we get a warning that no ssl is inplace. We ignore this warning since this is due to the companies proxy
-        warnings.simplefilter("ignore")
-        main()
-
-
-
-
+try:
+    import os, sys
+    import warnings
+    import contextlib
+    import argparse
+    from utils import DEFAULT_REST_ENV, DEFAULT_PERMISSION_OBJECTS, DEFAULT_MAX_WORKERS, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+except ModuleNotFoundError as e:
+    print("\n\n--------------------------------------------------------------------------------------------------------------\n")
+    print("The python environment you are running this script in does not contain all the dependencies.")
+    print("\n--------------------------------------------------------------------------------------------------------------\n\n")
+    raise Exception(str(e)) from None
+
+TS_CONFIG_NAME = "ts_config.json"
+OUTPUT_FOLDER = "output\\permissions"
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='A script that extracts the permissions of all projects, data sources, workbooks and flows on a site')
+    parser.add_argument(
+        "--environment",
+        help=f"Environment of ts_config.json to extract the permissions of. options: tableau_prod_{{site name}} & tableau_sim_{{site name}}. default: {DEFAULT_REST_ENV}",
+        default=DEFAULT_REST_ENV
+    )
+    parser.add_argument(
+        "--output-folder",
+        help=f"Folder the permissions are saved in. default: {OUTPUT_FOLDER}",
+        default=OUTPUT_FOLDER
+    )
+    parser.add_argument(
+        "--max-workers",
+        help=f"Maximum number of permission requests that are sent to the server at the same time. default: {DEFAULT_MAX_WORKERS}",
+        type=int,
+        default=DEFAULT_MAX_WORKERS
+    )
+    parser.add_argument(
+        "--infer-locked",
+        help="Infer the permissions of workbooks, data sources and flows in locked projects from the default permissions of their root project instead of requesting them item by item.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--output-format",
+        help=f"File format the permissions are saved in. parquet and feather require pyarrow. default: {DEFAULT_OUTPUT_FORMAT}",
+        choices=list(OUTPUT_FORMATS),
+        default=DEFAULT_OUTPUT_FORMAT
+    )
+    parser.add_argument(
+        "--record",
+        help="Record every request to the Tableau server and its response in this cassette file, e.g. output\\cassettes\\permissions.sqlite",
+        metavar="CASSETTE",
+        default=None
+    )
+    parser.add_argument(
+        "--replay",
+        help="Replay the responses of a recorded cassette file instead of sending the requests to the Tableau server",
+        metavar="CASSETTE",
+        default=None
+    )
+    parser.add_argument(
+        "--replay-latency",
+        help="Seconds every replayed response waits, to mimic the server. default: 0",
+        type=float,
+        default=0.0
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the run and save the profile in the profile folder of the output folder, the functions that took the most time are printed",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile-memory",
+        help="Also trace the memory allocations while profiling and save the lines that allocated the most memory. Makes the run slower.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--sign-out",
+        help="Sign out the Tableau sessions that were kept between runs (when TABLEAU_TOKEN_CACHE is 1) and remove the token cache, nothing else is run",
+        action="store_true"
+    )
+    args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error("--record can not be combined with --replay")
+    return args
+
+
+# the arguments are parsed before pandas and tableau_api_lib are imported, so --help and wrong arguments are answered at once
+if __name__ == "__main__":
+    args = parse_arguments()
+
+try:
+    import pandas as pd
+    from utils import FlattenedDataFrame, ProjectDataFrame, ItemDataFrame, setup_REST_connection, sign_out_cached_sessions, move_to_historiek, fetch_permissions, use_cassette, instrumentation, profiled, open_sink
+    from tableau_api_lib.utils import extract_pages
+except ModuleNotFoundError as e:
+    print("\n\n--------------------------------------------------------------------------------------------------------------\n")
+    print("The python environment you are running this script in does not contain all the dependencies.")
+    print("\n--------------------------------------------------------------------------------------------------------------\n\n")
+    raise Exception(str(e)) from None
+
+# mapping was retrieved from: https://help.tableau.com/current/api/rest_api/en-us/REST/rest_api_concepts_permissions.htm
+PERMISSION_MAPPING = { 
+    "AddComment": "Add Comment",
+    "ChangeHierarchy": "Move",
+    "ChangePermissions": "Set Permissions",
+    "CreateRefreshMetrics": "Create/Refresh Metrics",
+    "Execute": "Run Flow",
+    "ExportData": "View Summary Data",
+    "ExportImage": "Export Image",
+    "ExportXml": "Download",
+    "InheritedProjectLeader": "Project Leader",
+    "ProjectLeader": "Project Leader",
+    "Read": "View",
+    "RunExplainData": "Run Explain Data",
+    "ShareView": "Share Customized",
+    "SaveAs": "Save As",
+    "ViewComments": "View Comments",
+    "ViewUnderlyingData": "View Underlying Data",
+    "WebAuthoring": "Web Edit",
+    "Write": "Save"
+}
+
+def projects_to_query(df_projects) -> pd.DataFrame:
+    # we only need to get the permissions for the root projects and subfolders that are not locked by the root folder
+    mask = df_projects["parentProjectId"].isna() | ~ (df_projects["rootParentContentPermissions"] =="LockedToProject")
+    return df_projects.loc[mask, :]
+
+def split_locked_items(df_items, df_projects) -> tuple:
+    # items of which the root project is locked always have the default permissions of that root project
+    locked_roots = df_projects.loc[df_projects["parentProjectId"].isna() & (df_projects["rootParentContentPermissions"] == "LockedToProject"), "id"]
+    mask = df_items["rootParentProjectId"].isin(locked_roots)
+    return df_items.loc[~mask, :], df_items.loc[mask, :]
+
+def item_permissions(df, df_items, item_type, granteeCapabilities, how="inner"):
+    item_responses = []
+    
+    # projects are their own project, the other items have a project_name column
+    project_names = df_items["name"] if item_type == "project" else df_items["project_name"]
+    items = zip(df_items["id"], df_items["name"], project_names, df_items["projectPath"], df_items["rootParentProjectId"], granteeCapabilities)
+    
+    # with statement blocks the unnecessary prints done by FlattenedDataFrame
+    with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
+        for id, name, project_name, project_path, rootParentProjectId, capabilities in items:
+            temp = FlattenedDataFrame(capabilities)
+            temp[["item_id", "item_name", "item_type", "item_project", "item_project_path", "rootParentProjectId"]] = id, name, item_type, project_name, project_path, rootParentProjectId
+            item_responses.append(temp)
+    
+    to_return =  df.merge(
+        pd.concat(item_responses).reset_index(drop=True).drop(columns="snapshot_date"),
+        how=how, 
+        left_on="id", 
+        right_on="rootParentProjectId",
+        suffixes=["", "_y"]
+    ).drop(columns="rootParentProjectId_y")
+    
+    return to_return
+
+def inferred_item_permissions(df, df_items, item_type, default_capabilities:dict):
+    """
+    Builds the permissions of items in locked projects from the default permissions of their root project, 
+    default_capabilities contains the grantee capabilities for every root project id.
+    Every default is only flattened once and then joined onto all items of that root project.
+    """
+    defaults = []
+    
+    # with statement blocks the unnecessary prints done by FlattenedDataFrame
+    with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
+        for rootParentProjectId, capabilities in default_capabilities.items():
+            if not capabilities: # a project without default permissions for this item type
+                continue
+            temp = FlattenedDataFrame(capabilities).drop(columns="snapshot_date")
+            temp["rootParentProjectId"] = rootParentProjectId
+            defaults.append(temp)
+    
+    items = df_items[["id", "name", "project_name", "projectPath", "rootParentProjectId"]].rename(
+        columns={"id": "item_id", "name": "item_name", "project_name": "item_project", "projectPath": "item_project_path"}
+    )
+    items["item_type"] = item_type
+    defaults = pd.concat(defaults) if defaults else pd.DataFrame(columns=["rootParentProjectId"])
+    item_responses = defaults.merge(items, how="inner", on="rootParentProjectId")
+    
+    return df.merge(
+        item_responses,
+        how="inner", 
+        left_on="id", 
+        right_on="rootParentProjectId",
+        suffixes=["", "_y"]
+    ).drop(columns="rootParentProjectId_y")
+
+def main(max_workers:int=DEFAULT_MAX_WORKERS, output_format:str=DEFAULT_OUTPUT_FORMAT, infer_locked:bool=False, environment:str=DEFAULT_REST_ENV, output_folder:str=OUTPUT_FOLDER):
+    instrumentation.start("permissions", environment)
+    with instrumentation.stage("sign in"):
+        conn = setup_REST_connection(TS_CONFIG_NAME, environment=environment)
+    
+    # to have a full view of the permissions we need the permissions of all projects, data sources, workbooks, flows and combine this with the groups and users
+    with instrumentation.stage("list items"):
+        projects = extract_pages(conn.query_projects)
+        datasources = extract_pages(conn.query_data_sources)
+        workbooks = extract_pages(conn.query_workbooks_for_site)
+        flows = extract_pages(conn.query_flows_for_site)
+        groups = extract_pages(conn.query_groups)
+        users = extract_pages(conn.get_users_on_site)
+    # with statement blocks the unnecessary prints done by FlattenedDataFrame
+    with instrumentation.stage("flatten"), open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
+        df_projects = ProjectDataFrame(projects) 
+        df_datasources = ItemDataFrame(datasources, df_projects) # we pass df_projects so we can see in which root project the data source lies
+        df_workbooks = ItemDataFrame(workbooks, df_projects) # we pass df_projects so we can see in which root project the workbook lies
+        df_flows = ItemDataFrame(flows, df_projects) # we pass df_projects so we can see in which root project the flow lies
+        df_groups = FlattenedDataFrame(groups)[["id", "name"]].rename(columns={"id":"group_id", "name": "group_name"})
+        df_users = FlattenedDataFrame(users)[["id", "name"]].rename(columns={"id": "user_id", "name":"user_name"})
+    
+    # we will use the root project as our main dataframe to which we will join the projects, data sources and workbooks 
+    # the path of a root project is its name, the path of every item is added as item_project_path
+    df = df_projects.loc[df_projects["parentProjectId"].isna()].drop(columns="projectPath").reset_index(drop=True)
+    
+    # retrieving project, datasource, workbook and flow permissions, then combining them into one dataframe
+    # the permission calls of all item types are fanned out over one thread pool and collected in order
+    items = {
+        "project": projects_to_query(df_projects),
+        "datasource": df_datasources,
+        "workbook": df_workbooks,
+        "flow": df_flows
+    }
+    # with infer_locked, the items in locked projects are not queried one by one, only the default permissions of their root project are
+    locked_items = {}
+    if infer_locked:
+        for item_type in DEFAULT_PERMISSION_OBJECTS:
+            items[item_type], locked_items[item_type] = split_locked_items(items[item_type], df_projects)
+    
+    jobs = [(item_type, id) for item_type, df_items in items.items() for id in df_items["id"]]
+    default_jobs = [(f"default_{item_type}", id) for item_type, df_items in locked_items.items() for id in df_items["rootParentProjectId"].unique()]
+    if infer_locked:
+        print(f"{sum(len(df_items) for df_items in locked_items.values())} items are in locked projects, their permissions are inferred from {len(default_jobs)} default permissions")
+    print(f"Retrieving project, datasource, workbook and flow permissions ({len(jobs) + len(default_jobs)} requests, {max_workers} at a time). This might take a while...")
+    with instrumentation.stage("fetch permissions"):
+        capabilities = fetch_permissions(conn, jobs + default_jobs, max_workers=max_workers)
+    instrumentation.count("permission requests", len(jobs) + len(default_jobs))
+    print("Done!\n")
+    
+    with instrumentation.stage("merge"):
+        permissions = []
+        for item_type, df_items in items.items():
+            item_capabilities, capabilities = capabilities[:len(df_items)], capabilities[len(df_items):]
+            if df_items.empty:
+                continue
+            # projects are joined with a left join so root projects without explicit permissions are still listed
+            permissions.append(item_permissions(df, df_items, item_type, item_capabilities, how="left" if item_type == "project" else "inner"))
+        for item_type, df_items in locked_items.items():
+            root_ids = df_items["rootParentProjectId"].unique()
+            default_capabilities, capabilities = dict(zip(root_ids, capabilities[:len(root_ids)])), capabilities[len(root_ids):]
+            if df_items.empty:
+                continue
+            permissions.append(inferred_item_permissions(df, df_items, item_type, default_capabilities))
+        print("Combining permissions...", end="")
+        df = pd.concat(permissions).reset_index(drop=True)
+        print(" Done!\n")
+    
+    
+        # adding groupnames
+        print("Adding group names...", end="")
+        df = df.merge(df_groups, how="left", left_on="group_id", right_on="group_id")
+        print(" Done!\n")
+    
+        # adding users
+        print("Adding user names...", end="")
+        df = df.merge(df_users, how="left", left_on="user_id", right_on="user_id")
+        print(" Done!\n")
+    
+        # tidying up the dataframe
+        print("Reformatting the data...", end="")
+        df.loc[df["group_id"].notna(), "grantee_type"] = "group"
+        df.loc[df["group_id"].notna(), "grantee_id"] = df.loc[df["group_id"].notna(), "group_id"]
+        df.loc[df["group_id"].notna(), "grantee"] = df.loc[df["group_id"].notna(), "group_name"]
+        df.loc[df["user_id"].notna(), "grantee_type"] = "user"
+        df.loc[df["user_id"].notna(), "grantee_id"] = df.loc[df["user_id"].notna(), "user_id"]
+        df.loc[df["user_id"].notna(), "grantee"] = df.loc[df["user_id"].notna(), "user_name"]
+        df = df.drop(columns=["parentProjectId", "group_id", "user_id", "group_name", "user_name"])
+        df = df.rename(
+            columns={
+            "name": "root_parent_project_name",
+            "rootParentProjectId": "root_parent_project_id",
+            "rootParentContentPermissions": "root_parent_content_permissions"}
+        )
+        df["capabilities_capability_name"] = df.apply(lambda row: PERMISSION_MAPPING.get(row["capabilities_capability_name"], row["capabilities_capability_name"]), axis=1)
+        print(" Done!\n")
+    
+    move_to_historiek(output_folder)
+    
+    # saving to output folder and to gateway
+    print("Saving results...", end="")
+    # Excel continues on a new sheet after 1048576 rows, the other formats have no row limit
+    with instrumentation.stage("write"), open_sink(output_format, output_folder, "Tableau_permissions", sheet_name="Tableau_permissions") as sink:
+        sink.write(df)
+    instrumentation.count("rows written", len(df))
+    print(" Done!")
+    
+    # the durations of the stages and the cost of the requests are saved next to the permissions
+    instrumentation.write(output_folder)
+    
+    
+if __name__ == "__main__":
+    # setting to root directory after imports
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(root)
+    
+    if args.sign_out:
+        sign_out_cached_sessions()
+        sys.exit()
+    
+    # the cassette records or replays the requests of the run, see utils/cassette.py
+    cassette = use_cassette(args.record or args.replay, "record" if args.record else "replay", args.replay_latency) if args.record or args.replay else contextlib.nullcontext()
+    profiler = profiled(args.output_folder, "permissions", memory=args.profile_memory) if args.profile or args.profile_memory else contextlib.nullcontext()
+    with cassette, profiler, warnings.catch_warnings(): # we get a warning that no ssl is inplace. We ignore this warning since this is due to the companies proxy
+        warnings.simplefilter("ignore")
+        main(args.max_workers, args.output_format, args.infer_locked, args.environment, args.output_folder)
+
+
+
+
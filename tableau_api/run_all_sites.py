@@ -0,0 +1,197 @@
+try:
+    import os, sys
+    import re
+    import time
+    import fnmatch
+    import warnings
+    import subprocess
+    from argparse import ArgumentParser
+    from concurrent.futures import ThreadPoolExecutor
+    from utils import open_json, repository_details, personal_access_token, setup_REST_connection, prompt_tableau_database_credentials, move_to_historiek, open_sink, read_tables, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT, output_format_error
+except ModuleNotFoundError as e:
+    print("\n\n--------------------------------------------------------------------------------------------------------------\n")
+    print("The python environment you are running this script in does not contain all the dependencies.")
+    print("\n--------------------------------------------------------------------------------------------------------------\n\n")
+    raise Exception(str(e)) from None
+
+TS_CONFIG_NAME = "ts_config.json"
+MERGED_FOLDER_NAME = "all_sites"
+LOG_FILE = "run.log"
+
+# the script, output folder and name of the merged outputs of every script that can be run for several sites
+# the archiving reports are named after the time of the run, they are merged into one report
+SCRIPTS = {
+    "permissions": ("permissions.py", "output\\permissions", lambda name: name),
+    "metadata": ("metadata_api.py", "output\\metadata_api", lambda name: name),
+    "archiving": ("automatic_archiving.py", "output\\automatic_archiving", lambda name: "archived_items"),
+}
+
+
+def select_environments(ts_config:dict, patterns:list) -> list:
+    """
+    Returns the environments of ts_config that match one of the patterns, e.g. tableau_prod_* or tableau_*_SITE_NAME1.
+    """
+    environments = [environment for environment, config in ts_config.items() if isinstance(config, dict) and config.get("server")]
+    selected = [environment for environment in environments if any(fnmatch.fnmatchcase(environment, pattern) for pattern in patterns)]
+    if not selected:
+        raise ValueError(f"No environment of {TS_CONFIG_NAME} matches {patterns}. Environments: {environments}")
+    return selected
+
+
+def run_site(script:str, environment:str, output_folder:str, arguments:list, credentials:dict=None) -> tuple:
+    """
+    Runs the script for one environment in its own process, its output is written to the log file in the output folder.
+    The Personal Access Token in credentials is handed to the process in its environment variables, so it can sign in again by itself.
+    Returns the environment, the exit code and the number of seconds it took.
+    """
+    environment_variables = dict(os.environ)
+    if credentials:
+        environment_variables.update(TABLEAU_PAT_NAME=credentials["pat_name"], TABLEAU_PAT_SECRET=credentials["pat_secret"])
+    script_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), SCRIPTS[script][0])
+    os.makedirs(output_folder, exist_ok=True)
+    start_time = time.time()
+    with open(os.path.join(output_folder, LOG_FILE), "w") as log:
+        # the processes can not be prompted, they fail when they miss a credential instead of waiting for an answer
+        process = subprocess.run(
+            [sys.executable, script_file, "--environment", environment, "--output-folder", output_folder, *arguments],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, env=environment_variables
+        )
+    return environment, process.returncode, time.time() - start_time
+
+
+def run_sites(script:str, environments:list, site_folders:dict, arguments:list, credentials:dict) -> list:
+    # signing in with a Personal Access Token ends its other session, so the sites that share a token run one after the other
+    return [run_site(script, environment, site_folders[environment], arguments, credentials[environment]) for environment in environments]
+
+
+def site_outputs(folder:str, environment:str, output_format:str, since:float, merged_name) -> dict:
+    """
+    Returns {merged name: [files]} of the outputs the run wrote in the folder of a site.
+    The environment is removed from the file names and parts (e.g. Tableau_permissions_2.csv) are merged into their first part.
+    """
+    names = {}
+    for file in sorted(os.listdir(folder)):
+        path = os.path.join(folder, file)
+        name, extension = os.path.splitext(file)
+        if not os.path.isfile(path) or extension != f".{output_format}" or os.path.getmtime(path) < since:
+            continue
+        names[name.replace(f"_{environment}", "")] = path
+
+    outputs = {}
+    for name, path in names.items():
+        base = re.sub(r"_\d+$", "", name)
+        name = base if base != name and base in names else name
+        outputs.setdefault(merged_name(name), []).append(path)
+    return outputs
+
+
+def merge_outputs(site_folders:dict, merged_folder:str, output_format:str, since:float, merged_name) -> None:
+    """
+    Combines the outputs of all sites into one dataset per output in the merged folder, every row gets the environment it came from.
+    """
+    outputs = {}
+    for environment, folder in site_folders.items():
+        for name, paths in site_outputs(folder, environment, output_format, since, merged_name).items():
+            outputs.setdefault(name, []).extend((environment, path) for path in paths)
+
+    move_to_historiek(merged_folder)
+    for name, paths in outputs.items():
+        print(f"Merging {name} of {len(set(environment for environment, _ in paths))} sites...", end=" ")
+        with open_sink(output_format, merged_folder, name, sheet_name=name) as sink:
+            for environment, path in paths:
+                tables = read_tables(path)
+                main_sheet = next(iter(tables))
+                for table, df in tables.items():
+                    # continued sheets (e.g. Tableau_permissio_2) belong to the sheet they continue
+                    base = re.sub(r"_\d+$", "", str(table))
+                    if table == main_sheet or (base != table and str(main_sheet).startswith(base)):
+                        table = None
+                    else:
+                        table = base if base != table and base in tables else table
+                    df.insert(0, "environment", environment)
+                    sink.write(df, table=table)
+        print("done!")
+
+
+def main(script:str, patterns:list, processes:int=None, output_format:str=DEFAULT_OUTPUT_FORMAT, arguments:list=None):
+    arguments = [*(arguments or []), "--output-format", output_format]
+    _, base_folder, merged_name = SCRIPTS[script]
+    ts_config = open_json(TS_CONFIG_NAME)
+    environments = select_environments(ts_config, patterns)
+    print(f"Running {script} for {len(environments)} environments: {', '.join(environments)}\n")
+    if script == "archiving":
+        # every site is archived with the repository of its own server, sites without a known repository are refused before anything runs
+        try:
+            repositories = {environment: repository_details(ts_config, environment) for environment in environments}
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        print(f"Repositories: {', '.join(sorted(set(repositories.values())))}\n")
+
+    # the Personal Access Tokens are asked once here and every site is signed into to check them, the processes get the token of their site
+    credentials = {}
+    for environment in environments:
+        credentials[environment] = personal_access_token(ts_config, environment)
+        os.environ["TABLEAU_PAT_NAME"], os.environ["TABLEAU_PAT_SECRET"] = credentials[environment]["pat_name"], credentials[environment]["pat_secret"]
+        setup_REST_connection(TS_CONFIG_NAME, environment=environment)
+    os.environ.pop("TABLEAU_PAT_NAME"), os.environ.pop("TABLEAU_PAT_SECRET")
+    token_groups = {}
+    for environment in environments:
+        token_groups.setdefault(credentials[environment]["pat_name"], []).append(environment)
+    if len(token_groups) < len(environments):
+        print(f"Sites that share a Personal Access Token run one after the other, {len(token_groups)} run at the same time at most\n")
+    if script == "archiving":
+        if not (os.environ.get("TABLEAU_DB_USERNAME") and os.environ.get("TABLEAU_DB_PASSWORD")):
+            db_credentials = prompt_tableau_database_credentials()
+            os.environ["TABLEAU_DB_USERNAME"], os.environ["TABLEAU_DB_PASSWORD"] = db_credentials["username"], db_credentials["password"]
+        if "--no-delete" not in arguments and "--yes" not in arguments:
+            answer = input(f"Are you sure you want to delete the unused items of {len(environments)} sites? type 'continue' to continue or 'quit' to quit: ")
+            if answer != "continue":
+                sys.exit()
+            arguments.append("--yes")
+
+    # the sites run in parallel processes, so the run takes as long as the largest site
+    start_time = time.time()
+    site_folders = {environment: os.path.join(base_folder, environment) for environment in environments}
+    with ThreadPoolExecutor(max_workers=processes or len(token_groups)) as executor:
+        futures = [executor.submit(run_sites, script, group, site_folders, arguments, credentials) for group in token_groups.values()]
+        failed = []
+        for future in futures:
+            for environment, returncode, seconds in future.result():
+                status = "done" if returncode == 0 else f"FAILED (exit code {returncode})"
+                print(f"{environment}: {status} in {int(round(seconds, 0))} seconds, see {os.path.join(site_folders[environment], LOG_FILE)}")
+                if returncode != 0:
+                    failed.append(environment)
+
+    succeeded = {environment: folder for environment, folder in site_folders.items() if environment not in failed}
+    if succeeded:
+        print("")
+        merge_outputs(succeeded, os.path.join(base_folder, MERGED_FOLDER_NAME), output_format, start_time, merged_name)
+    print(f"\nIt took {int(round(time.time() - start_time, 0))} seconds to run {script} for all sites")
+    if failed:
+        print(f"{len(failed)} site(s) failed and are not in the merged results: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="A script that runs permissions, metadata extraction or archiving for several sites of ts_config.json in parallel and merges the results. Other arguments are passed to the script.")
+    parser.add_argument("script", choices=list(SCRIPTS), help="the script to run for every site")
+    parser.add_argument(
+        "--environments",
+        nargs="+",
+        default=["*"],
+        help="environments of ts_config.json to run, shell style patterns are allowed e.g. tableau_prod_* or tableau_*_SITE_NAME1. default: all environments"
+    )
+    parser.add_argument("--processes", type=int, default=None, help="maximum number of sites that run at the same time. default: all sites at once")
+    parser.add_argument("--output-format", choices=list(OUTPUT_FORMATS), default=DEFAULT_OUTPUT_FORMAT, help=f"file format of the results of every site and the merged results. default: {DEFAULT_OUTPUT_FORMAT}")
+    args, arguments = parser.parse_known_args()
+    if output_format_error(args.output_format):
+        parser.error(output_format_error(args.output_format))
+
+    # setting to root directory after imports
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(root)
+
+    with warnings.catch_warnings(): # we get a warning that no ssl is inplace if the company has a proxy
+        warnings.simplefilter("ignore")
+        main(args.script, args.environments, args.processes, args.output_format, arguments)
@@ -1,7 +1,53 @@
-from .flattened_dataframe import *
-from .metadata_queries import *
-from .helpers import *
-from .unused_items_queries import *
-from .ts_config import *
+"""
+The public names of the utils modules. A module is only imported when one of its names is used for the first time,
+so a script only pays for the modules (and their dependencies such as pandas, SQLAlchemy and tableau_api_lib) it uses.
+"""
+import importlib
 
-#__all__ = [FlattenedDataFrame, ProjectDataFrame, ItemDataFrame, queries, open_json, convert_query, unpack_response, http_error_sign_in, move_to_historiek]
\ No newline at end of file
+# the names every module exports, a new name has to be added here to be importable from utils
+_MODULES = {
+    "flattened_dataframe": ["FlattenedDataFrame", "ProjectDataFrame", "ItemDataFrame", "NormalizedTables"],
+    "metadata_queries": ["DEFAULT_PAGE_SIZE", "page_sizes", "incremental_queries", "queries"],
+    "helpers": [
+        "current_date", "TABLEAU_DATABASE_CONNECTION_DETAILS", "SQL_CHUNK_SIZE", "LOOKUP_RESPONSES", "LoginError", "ValueNotFoundError",
+        "open_json", "unpack_response", "unpack_page", "query_pages", "create_folder", "move_to_historiek", "move_file_to", "convert_query", "lookup_error",
+        "personal_access_token", "prompt_personal_access_token", "prompt_tableau_database_credentials", "read_sql_chunks", "read_sql_streamed", "repository_details", "database_connection_string",
+        "setup_database_connection", "setup_REST_connection", "sign_out_REST_connection", "sign_out_cached_sessions"
+    ],
+    "unused_items_queries": ["create_project_hierarchy", "query_project_structure", "query_orphan_datasources", "query_unused_workbooks", "query_workbook_usage", "UNUSED_DAYS", "NEW_WORKBOOK_DAYS", "NO_DELETE_TAG"],
+    "ts_config": ["generate_config", "DEFAULT_REST_ENV"],
+    "permission_fetcher": ["fetch_permissions", "PERMISSION_ENDPOINTS", "DEFAULT_PERMISSION_OBJECTS", "DEFAULT_MAX_WORKERS"],
+    "graphql": ["paginate_query", "selection_fields", "selection_columns", "filter_query"],
+    "incremental": ["IncrementalState", "convert_query_incremental"],
+    "output_sinks": ["OUTPUT_FORMATS", "DEFAULT_OUTPUT_FORMAT", "output_format_error", "open_sink", "read_tables", "ExcelSink", "CsvSink", "ParquetSink", "FeatherSink"],
+    "project_tree": ["ProjectTree"],
+    "archive_journal": ["ArchiveJournal", "ARCHIVE_STAGES"],
+    "backup_store": ["BackupStore", "file_hash"],
+    "notifications": ["Notifier", "OutlookBackend", "SmtpBackend", "MaildirBackend", "NOTIFICATION_BACKENDS", "DEFAULT_NOTIFICATION_BACKEND"],
+    "usage_index": ["UsageIndex"],
+    "retry": ["RetryPolicy", "AdaptiveLimiter", "RETRY_POLICIES", "DEFAULT_RETRY_POLICY", "request_limiter", "retry_policy", "send_with_retry"],
+    "session": ["http_session", "install_http_session", "tableau_requests", "TokenCache", "repository_engine", "discard_repository_engine", "HTTP_POOL_SIZE", "TOKEN_CACHE_LOCATION", "TOKEN_CACHE_VARIABLE"],
+    "cassette": ["Cassette", "CassetteError", "use_cassette", "CASSETTE_MODES"],
+    "instrumentation": ["Instrumentation", "instrumentation", "LATENCY_BUCKETS", "RUN_REPORT_NAME"],
+    "profiling": ["profiled", "PROFILE_FOLDER_NAME"],
+}
+_NAMES = {name: module for module, names in _MODULES.items() for name in names}
+__all__ = list(_NAMES)
+
+# the instrumentation object has the name of its module, importing the module would hide the object behind the module
+from .instrumentation import instrumentation
+
+
+def __getattr__(name:str):
+    module = _NAMES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value # the next lookup does not pass through __getattr__
+    return value
+
+
+def __dir__() -> list:
+    return sorted(set(globals()) | set(__all__))
+
+#__all__ = [FlattenedDataFrame, ProjectDataFrame, ItemDataFrame, queries, open_json, convert_query, unpack_response, http_error_sign_in, move_to_historiek]
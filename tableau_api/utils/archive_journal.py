@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import datetime
+import threading
+
+__all__ = ["ArchiveJournal", "ARCHIVE_STAGES"]
+
+# the stages of archiving an item, in the order they are completed
+ARCHIVE_STAGES = ("prepared", "mailed", "backed_up", "deleted")
+
+
+class ArchiveJournal:
+    """
+    Records on disk which archiving stages were completed for every item (by luid), so a run that stopped halfway
+    can be resumed: stages that were completed are skipped and the files they produced are reused.
+    """
+    def __init__(self, path:str):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stages (
+                    luid TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    location TEXT,
+                    completed_at TEXT NOT NULL,
+                    PRIMARY KEY (luid, stage)
+                )
+                """
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def completed(self, luid:str) -> dict:
+        """
+        Returns {stage: location} of the stages that were completed for the item.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT stage, location FROM stages WHERE luid = ?", (luid,)).fetchall()
+        return dict(rows)
+
+    def record(self, luid:str, stage:str, location:str=None) -> None:
+        if stage not in ARCHIVE_STAGES:
+            raise ValueError(f"Unknown archiving stage {stage}. Stages: {ARCHIVE_STAGES}")
+
+        # every stage is committed at once, so a crash right after a stage never loses it
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO stages (luid, stage, location, completed_at) VALUES (?, ?, ?, ?)",
+                (luid, stage, location, datetime.datetime.now().isoformat(timespec="seconds"))
+            )
+
+    def forget(self, luid:str) -> None:
+        # used when the files of earlier stages are gone and the item has to be archived from the start
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM stages WHERE luid = ?", (luid,))
+
+    def close(self) -> None:
+        self._connection.close()
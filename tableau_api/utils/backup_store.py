@@ -0,0 +1,116 @@
+import os
+import shutil
+import sqlite3
+import hashlib
+import uuid
+import datetime
+import threading
+
+__all__ = ["BackupStore", "file_hash"]
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path:str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class BackupStore:
+    """
+    Stores archived items by the hash of their content, so an item that is archived more than once
+    (in reruns or on several sites) is only stored once. Objects are saved as objects/ab/abcdef....zip
+    and a manifest keeps track of which item (luid) was archived when, from where and with which content.
+    """
+    def __init__(self, folder:str):
+        self.folder = folder
+        self.objects_folder = os.path.join(folder, "objects")
+        if not os.path.exists(self.objects_folder):
+            os.makedirs(self.objects_folder)
+
+        self._lock = threading.Lock()
+        # several processes (one per site) can archive into the same store, they wait for each other's writes
+        self._connection = sqlite3.connect(os.path.join(folder, "manifest.sqlite"), check_same_thread=False, timeout=60)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS manifest (
+                    luid TEXT NOT NULL,
+                    site TEXT,
+                    project_path TEXT,
+                    owner TEXT,
+                    file_name TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    archived_at TEXT NOT NULL
+                )
+                """
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS manifest_luid ON manifest (luid)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def object_path(self, hash:str) -> str:
+        return os.path.join(self.objects_folder, hash[:2], f"{hash}.zip")
+
+    def add(self, file:str, luid:str, site:str=None, project_path:str=None, owner:str=None) -> str:
+        """
+        Moves file into the store (or removes it when the same content is already stored), verifies the stored object
+        and adds it to the manifest. Returns the path of the stored object.
+        """
+        hash, size = file_hash(file), os.path.getsize(file)
+        object_path = self.object_path(hash)
+
+        with self._lock:
+            if os.path.exists(object_path):
+                os.remove(file)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                # the object only gets its final name once it is completely written, the temporary name is unique per process
+                temporary_path = f"{object_path}.{uuid.uuid4().hex}.tmp"
+                shutil.move(file, temporary_path)
+                os.replace(temporary_path, object_path)
+
+        # an existing object is verified as well, a corrupt object must not be trusted as backup
+        if os.path.getsize(object_path) != size or file_hash(object_path) != hash:
+            raise IOError(f"The backup at {object_path} does not match the archived item")
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO manifest (luid, site, project_path, owner, file_name, hash, size, archived_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (luid, site, project_path, owner, os.path.basename(file), hash, size, datetime.datetime.now().isoformat(timespec="seconds"))
+            )
+        return object_path
+
+    def lookup(self, luid:str) -> list:
+        """
+        Returns the manifest entries of the item, the most recent backup first.
+        """
+        with self._lock:
+            cursor = self._connection.execute("SELECT * FROM manifest WHERE luid = ? ORDER BY archived_at DESC, rowid DESC", (luid,))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def restore(self, luid:str, destination:str) -> str:
+        """
+        Copies the most recent backup of the item to the destination folder under its original file name.
+        """
+        entries = self.lookup(luid)
+        if not entries:
+            raise FileNotFoundError(f"No backup was found for {luid}")
+
+        if not os.path.exists(destination):
+            os.makedirs(destination)
+        restored_file = os.path.join(destination, entries[0]["file_name"])
+        shutil.copyfile(self.object_path(entries[0]["hash"]), restored_file)
+        return restored_file
+
+    def close(self) -> None:
+        self._connection.close()
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import datetime
+import sqlite3
+import threading
+import requests
+from urllib.parse import urlsplit
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+__all__ = ["Cassette", "CassetteError", "use_cassette", "CASSETTE_MODES"]
+
+CASSETTE_MODES = ("record", "replay")
+REDACTED_TOKEN = "cassette-token"
+COMMIT_EVERY = 200 # recorded interactions per transaction
+SKIPPED_HEADERS = ("set-cookie", "content-length", "transfer-encoding")
+
+
+class CassetteError(Exception):
+    pass
+
+
+def _request_body(kwargs:dict) -> bytes:
+    if kwargs.get("json") is not None:
+        return json.dumps(kwargs["json"], sort_keys=True).encode()
+    data = kwargs.get("data")
+    if data is None:
+        return b""
+    return data.encode() if isinstance(data, str) else bytes(data)
+
+
+def request_key(method:str, url:str, kwargs:dict) -> str:
+    """
+    Identifies a request by its method, path, query and body. The server is left out, so a cassette can be replayed
+    with another ts_config, and so is the body of a sign in, which holds the Personal Access Token.
+    """
+    parts = urlsplit(url)
+    path = f"{parts.path}?{parts.query}" if parts.query else parts.path
+    body = b"" if parts.path.endswith("/auth/signin") else _request_body(kwargs)
+    return f"{method.upper()} {path} {hashlib.sha256(body).hexdigest()[:16]}"
+
+
+class Cassette:
+    """
+    Records every response of the Tableau server in a local SQLite file (bodies are compressed) or replays them
+    without the server. Identical requests (e.g. the server info before every sign in) are replayed in the order they
+    were recorded, the last recording is repeated when a request was sent more often than during the recording.
+    Replayed responses wait latency seconds, to mimic a remote server.
+    """
+    def __init__(self, path:str, mode:str="replay", latency:float=0.0):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"mode must be one of {CASSETTE_MODES}, not {mode}")
+        if mode == "replay" and not os.path.exists(path):
+            raise CassetteError(f"The cassette {path} does not exist, record it first with --record")
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.interactions = 0
+        self._occurrences = {}
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            if mode == "record":
+                self._connection.execute("DROP TABLE IF EXISTS interactions")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS interactions (key TEXT NOT NULL, occurrence INTEGER NOT NULL, status INTEGER NOT NULL, "
+                "reason TEXT, headers TEXT NOT NULL, body BLOB NOT NULL, elapsed REAL NOT NULL, PRIMARY KEY (key, occurrence))"
+            )
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def send(self, send, method:str, url:str, **kwargs) -> requests.Response:
+        # send(method, url, **kwargs) sends the request to the server, it is only called while recording
+        key = request_key(method, url, kwargs)
+        with self._lock:
+            occurrence = self._occurrences.get(key, 0)
+            self._occurrences[key] = occurrence + 1
+        if self.replaying:
+            return self._replay(key, occurrence, url)
+
+        response = send(method, url, **kwargs)
+        self._record(key, occurrence, url, response)
+        return response
+
+    def _record(self, key:str, occurrence:int, url:str, response:requests.Response) -> None:
+        body = response.content # reads streamed downloads as well, they can still be iterated afterwards
+        if urlsplit(url).path.endswith("/auth/signin") and response.status_code == 200:
+            # the token gives access to the site, it is not kept in the cassette
+            credentials = json.loads(body)
+            credentials["credentials"]["token"] = REDACTED_TOKEN
+            body = json.dumps(credentials).encode()
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in SKIPPED_HEADERS}
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO interactions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, occurrence, response.status_code, response.reason, json.dumps(headers), zlib.compress(body), response.elapsed.total_seconds())
+            )
+            self.interactions += 1
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_EVERY:
+                self._connection.commit()
+                self._uncommitted = 0
+
+    def _replay(self, key:str, occurrence:int, url:str) -> requests.Response:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status, reason, headers, body FROM interactions WHERE key = ? AND occurrence <= ? ORDER BY occurrence DESC LIMIT 1",
+                (key, occurrence)
+            ).fetchone()
+            self.interactions += 1
+        if row is None:
+            raise CassetteError(f"{key.rsplit(' ', 1)[0]} was not recorded in the cassette {self.path}")
+        if self.latency:
+            time.sleep(self.latency)
+
+        status, reason, headers, body = row
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.url = url
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.elapsed = datetime.timedelta(seconds=self.latency)
+        response._content = zlib.decompress(body)
+        response._content_consumed = True
+        return response
+
+
+def use_cassette(path:str, mode:str, latency:float=0.0) -> Cassette:
+    """
+    Records (mode="record") or replays (mode="replay") every request of tableau_api_lib and the downloads in the cassette at path.
+    A replayed run signs in with the recorded responses, no credentials are needed.
+    """
+    from .session import install_http_session, tableau_requests
+    install_http_session()
+    cassette = Cassette(path, mode, latency)
+    tableau_requests.cassette = cassette
+    print(f"{'Recording' if mode == 'record' else 'Replaying'} the requests to the Tableau server {'in' if mode == 'record' else 'from'} {path}")
+    return cassette
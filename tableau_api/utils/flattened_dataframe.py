@@ -2,122 +2,165 @@ import pandas as pd
 import warnings
 import time
 import numpy as np
+from .project_tree import ProjectTree
+from .graphql import selection_fields
+
+class _ColumnNode:
+    """
+    Node of the column tree that is built while flattening. 
+    The kind of a node (dict, list or value) is decided by the first non null value that is found for it.
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.kind = None
+        self.children = {}
+    
+    def child(self, key):
+        node = self.children.get(key)
+        if node is None:
+            node = self.children[key] = _ColumnNode(key if self.name is None else f"{self.name}_{key}")
+        return node
+    
+    @property
+    def nested(self) -> bool:
+        return self.kind in (dict, list)
+
 
 class FlattenedDataFrame(pd.DataFrame):
-    def __init__(self, data=None, index=None, columns=None, dtype=None, copy=None):
+    def __init__(self, data=None, index=None, columns=None, dtype=None, copy=None, verbose=True):
+        # verbose=False does not print the unpacked columns, e.g. for every page after the first
+        if isinstance(data, pd.DataFrame):
+            data = data.to_dict("records")
+        
+        if isinstance(data, list):
+            data, original_columns = self.flatten(data, verbose=verbose)
+        else:
+            original_columns = []
+        
         # initializing DataFrame class
         super().__init__(data=data, index=index, columns=columns, dtype=dtype, copy=copy)
         
         # pandas raises a warning that we should not set columns directly (we are only accessing so no problem)
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
-            self.original_columns = self.columns
+            self.original_columns = pd.Index(original_columns)
         
-        self.flatten()
         self["snapshot_date"] = pd.to_datetime('today').strftime('%Y-%m-%d')
     
-    def flatten(self):
-        flattened_columns = {}
-        while self.check_dtypes(): # as long as there are columns with type dict or list keep unpacking
-            for columnname, typename in self.get_dtypes().items():
-                if typename in ('str', 'int', 'float', 'NoneType', 'bool', 'numpy.bool_', 'bool_', 'int64', 'Series', 'NoneType'):
-                    continue
-
-                elif typename == 'dict':
-                    flattened_columns[columnname] = "dict"
-                    temp = pd.concat([self.loc[:, self.columns != columnname], self._flatten_dict(columnname)], axis=1)
-                    self.re_inititialize_super_class(temp)
-                    break  # since we unpacked a column we need to restart the for loop
-
-                elif typename == 'list':
-                    flattened_columns[columnname] = "list"
-                    temp = self.loc[:, self.columns != columnname].join(self._flatten_list(columnname), how="left")
-                    self.re_inititialize_super_class(temp)
-                    break  # since we unpacked a column we need to restart the for loop
-
-                else:
-                    print(typename=='NoneType')
-                    msg = (
-                        f"flattening type: {typename} found in column {columnname}has not been implemented\n"
-                    )
-                    raise NotImplementedError(msg)
+    @classmethod
+    def flatten(cls, records, verbose=True) -> tuple:
+        """
+        Flattens a list of (nested) JSON records in a single pass and returns the flattened columns and the original column names.
+        Dictionaries are unpacked into parent_child columns and lists are exploded into one row per element,
+        every record is walked once and its rows are written straight into the column buffers.
+        """
+        root = _ColumnNode()
+        buffers = {}
+        n_rows = 0
+        
+        for record in records:
+            for row in cls._flatten_record(record, root):
+                for columnname, value in row.items():
+                    buffer = buffers.get(columnname)
+                    if buffer is None:  # column was not seen before, all previous rows are missing this value
+                        buffer = buffers[columnname] = [np.nan] * n_rows
+                    buffer.append(value)
+                n_rows += 1
                 
-        newly_added_columns = [column for column in self.columns if column not in self.original_columns]
-
-        if newly_added_columns:
+                # padding the columns that were not present in this row
+                for buffer in buffers.values():
+                    if len(buffer) < n_rows:
+                        buffer.append(np.nan)
+        
+        original_columns = [node.name for node in root.children.values()]
+        columns = cls._column_order(root)
+        newly_added_columns = [column for column in columns if column not in original_columns]
+        
+        if verbose and newly_added_columns:
             print(f"By unpacking {len(newly_added_columns)} new columns were added:\n{newly_added_columns}\n")
-        else:
+        elif verbose:
             print(f"Data did not require unpacking, no new columns were added.\n")
-
-        return self
-                
-    def re_inititialize_super_class(self, new_df):
-        super().__init__(data=new_df.values, columns=new_df.columns) 
-
-    def get_dtypes(self) -> dict: 
+        
+        flattened = {column: buffers.get(column, [np.nan] * n_rows) for column in columns}
+        if not flattened and n_rows:  # records without any values still result in (empty) rows
+            return pd.DataFrame(index=range(n_rows)), original_columns
+        return flattened, original_columns
+    
+    @classmethod
+    def _flatten_record(cls, record, root) -> list:
         """
-        Checks in depth which datatype a column contains. 
-        Instead of returning "object" for a column, this function will explain whether it is a str, list, dict ...
+        Flattens one record into rows. Nested columns are unpacked in the order they are found (breadth first), 
+        so the rows and the column names are the same as unpacking the whole dataframe one column at a time.
         """
-        result = {}
+        row, queue = {}, []
+        cls._add_children(row, record, root, queue)
+        rows = [row]
         
-        # pandas raises a warning that we should not set columns directly (we are only accessing so no problem)
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            for columnname in self.columns:
-                index = self.loc[:, columnname].first_valid_index()
-                if index is not None:
-                    value = self.loc[index, columnname]
-                    result[columnname] = type(value).__name__
+        position = 0
+        while position < len(queue):  # the queue grows while nested columns are unpacked
+            node = queue[position]
+            position += 1
+            
+            unpacked_rows = []
+            for row in rows:
+                value = row.pop(node.name, None)
+                if node.kind is list and isinstance(value, list) and value:
+                    for element in value:
+                        element_row = dict(row)
+                        # lists of plain values are unpacked into a column named 0, like pandas does
+                        cls._add_children(element_row, element if isinstance(element, dict) else {0: element}, node, queue)
+                        unpacked_rows.append(element_row)
                 else:
-                    result[columnname] = type(None).__name__
-        return result
-    
-    def check_dtypes(self):
-        dtypes = self.get_dtypes().values()
-        return ('list' in dtypes or 'dict' in dtypes)
+                    if node.kind is dict and isinstance(value, dict):
+                        cls._add_children(row, value, node, queue)
+                    unpacked_rows.append(row)
+            rows = unpacked_rows
+        
+        return rows
     
-    def _flatten_dict(self, columnname) -> pd.DataFrame:
-        # checking if there are any NaN values, if there are we have to do transform them from NaN to {key: NaN}
-        if self[columnname].isnull().values.any():
-            # dirty way of extracting the key from the key: value in the dictionary
-            key = list(self.loc[self.loc[:, columnname].first_valid_index(), columnname].keys())[0]
-            # replacing NaN with {key: NaN}
-            self.loc[self[columnname].isna(), columnname] = self.loc[self[columnname].isna(), columnname].apply(lambda x: {key: np.nan})
-        replacement = pd.DataFrame(self.loc[:, columnname].tolist())
-        replacement = replacement.add_prefix(f"{columnname}_")
-        return replacement
-
-    def _flatten_list(self, columnname) -> pd.DataFrame:
-        values = self.loc[:, columnname].to_dict()
-        list_dfs = []
-        for index, list_dict in values.items():
-            if not isinstance(list_dict, list):  # nan values are not considered a list, however we can skip them as they dont require unpacking
+    @staticmethod
+    def _add_children(row, values, node, queue):
+        for key, value in values.items():
+            child = node.child(key)
+            if value is None:
                 continue
-            replacement = pd.DataFrame(list_dict, index=[index]*len(list_dict))
-            replacement = replacement.add_prefix(f"{columnname}_")
-            list_dfs.append(replacement)
-        return pd.concat(list_dfs)
+            
+            if child.kind is None:
+                child.kind = type(value) if isinstance(value, (dict, list)) else object
+            
+            row[child.name] = value
+            if child.nested and child not in queue:
+                queue.append(child)
+    
+    @staticmethod
+    def _column_order(root) -> list:
+        # nested columns are replaced by their children, which are added at the end of the columns
+        columns, queue = [], list(root.children.values())
+        for node in queue:
+            if node.nested:
+                queue.extend(node.children.values())
+            else:
+                columns.append(node.name)
+        return columns
+                
+    def re_inititialize_super_class(self, new_df):
+        super().__init__(data=new_df.values, columns=new_df.columns) 
 
 class ProjectDataFrame(FlattenedDataFrame):
-    COLUMNS_TO_KEEP = ["snapshot_date", "id", "name", "parentProjectId", "rootParentProjectId", "rootParentContentPermissions"]
+    COLUMNS_TO_KEEP = ["snapshot_date", "id", "name", "parentProjectId", "rootParentProjectId", "rootParentContentPermissions", "projectPath"]
     def __init__(self, data=None, index=None, columns=None, dtype=None, copy=None):
         super().__init__(data=data, index=index, columns=columns, dtype=dtype, copy=copy)
-        self.set_index("id", drop=False, inplace=True)
-        self["rootParentProjectId"] = self.apply(lambda row: self.find_root_project(row['id']), axis=1)
+        if "parentProjectId" not in self.columns:  # a site with only root projects
+            self["parentProjectId"] = np.nan
+        
+        # the hierarchy is indexed once, ItemDataFrame reuses the index to look up the projects of items
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.project_tree = ProjectTree.from_dataframe(self)
+        self["rootParentProjectId"] = self.project_tree.root(self["id"]).values
+        self["projectPath"] = self.project_tree.path(self["id"]).values
         super().re_inititialize_super_class(self.find_root_content_permissions())
         super().re_inititialize_super_class(self[self.COLUMNS_TO_KEEP])
-    
-    def find_root_project(self, project_id: str) -> str:
-        parent_id = self.at[project_id, 'parentProjectId']
-        
-        # if there is no parent project then we are already at the root project
-        if isinstance(parent_id, float):
-            return project_id
-        
-        # otherwise recursively call find_root_project with the parent_id until we are at the root project
-        else:
-            return self.find_root_project(parent_id)
         
     def find_root_content_permissions(self):
         root_projects = self.loc[self["parentProjectId"].isna(), ["rootParentProjectId", "contentPermissions"]]
@@ -129,13 +172,94 @@ class ProjectDataFrame(FlattenedDataFrame):
 class ItemDataFrame(FlattenedDataFrame):
     def __init__(self, data, project_dataframe, index=None, columns=None, dtype=None, copy=None):
         super().__init__(data=data, index=index, columns=columns, dtype=dtype, copy=copy)
-        self._project_dataframe = project_dataframe.set_index("id", drop=False)
-         
-        self["rootParentProjectId"] = self.apply(lambda row: self.safe_at(row["project_id"]), axis=1)
+        project_tree = getattr(project_dataframe, "project_tree", None) or ProjectTree.from_dataframe(project_dataframe)
+        
+        # items in projects that are not known get no root project and are dropped
+        self["rootParentProjectId"] = project_tree.root(self["project_id"]).values
+        self["projectPath"] = project_tree.path(self["project_id"]).values
         super().re_inititialize_super_class(self.loc[self["rootParentProjectId"].notna(), :])
+
+
+class NormalizedTables:
+    """
+    Splits nested JSON records into one table per entity level instead of one denormalized (exploded) table.
+    Dictionaries are unpacked into the table of their parent, every list becomes a child table of which
+    the rows refer to their parent row through a {parent table}_key column.
+    With the query the records are the result of, the columns of every table are taken from the query instead of the values
+    in the records, so every batch of a table has the same columns. Whether a field is a list is learned from the records,
+    the Metadata API returns empty lists as [], a field that was only null so far is taken to be an object.
+    """
+    def __init__(self, name:str, query:str=None):
+        self.name = name
+        # the next key of every table, kept between calls so the records can be normalized in batches
+        self._next_keys = {}
+        self._fields = selection_fields(query) if query is not None else None
+        self._lists = set() # the paths of the fields that were lists
+        self._columns = {} # the columns of every table, fixed by the first batch of the table
+    
+    def normalize(self, records) -> dict:
+        """
+        Returns a dictionary with the table name as key and a pandas DataFrame as value. 
+        The root table is named after the NormalizedTables instance, child tables after the path of their list.
+        """
+        tables = {self.name: []}
+        for record in records:
+            self._add_row(tables, self.name, record)
+        
+        snapshot_date = pd.to_datetime('today').strftime('%Y-%m-%d')
+        if self._fields is not None:
+            self._table_columns(self.name, self._fields, None, None)
+        dataframes = {}
+        for table, rows in tables.items():
+            dataframes[table] = pd.DataFrame(rows)
+            dataframes[table]["snapshot_date"] = snapshot_date
+            if table in self._columns:
+                # values that were null are missing from the rows, they are added as empty columns
+                dataframes[table] = dataframes[table].reindex(columns=self._columns[table])
+        return dataframes
+    
+    def _table_columns(self, table, fields, parent_table, path):
+        # fixes the columns of the table and of its child tables the first time they are seen
+        columns = [f"{table}_key"] + ([f"{parent_table}_key"] if parent_table is not None else [])
+        self._add_columns(columns, table, fields, None, path)
+        self._columns.setdefault(table, columns + ["snapshot_date"])
     
-    def safe_at(self, project_id: str):
-        try:
-            return self._project_dataframe.at[project_id, "rootParentProjectId"]
-        except KeyError:
-            return None
+    def _add_columns(self, columns, table, fields, column_prefix, path_prefix):
+        for name, selection in fields.items():
+            column = name if column_prefix is None else f"{column_prefix}_{name}"
+            path = name if path_prefix is None else f"{path_prefix}_{name}"
+            if path in self._lists:
+                # lists of plain values are unpacked into a column named 0
+                self._table_columns(path, selection or {0: None}, table, path)
+            elif selection:
+                self._add_columns(columns, table, selection, column, path)
+            else:
+                columns.append(column)
+    
+    def _add_row(self, tables, table, values, parent_table=None, parent_key=None):
+        key = self._next_keys.get(table, 0)
+        self._next_keys[table] = key + 1
+        
+        row = {f"{table}_key": key}
+        if parent_table is not None:
+            row[f"{parent_table}_key"] = parent_key
+        
+        # lists directly under the root are named after their column, deeper lists after their full path
+        path = None if table == self.name else table
+        self._add_values(tables, table, key, row, values, None, path)
+        tables.setdefault(table, []).append(row)
+    
+    def _add_values(self, tables, table, key, row, values, column_prefix, path_prefix):
+        for name, value in values.items():
+            column = name if column_prefix is None else f"{column_prefix}_{name}"
+            path = name if path_prefix is None else f"{path_prefix}_{name}"
+            
+            if isinstance(value, dict):
+                self._add_values(tables, table, key, row, value, column, path)
+            elif isinstance(value, list):
+                self._lists.add(path)
+                tables.setdefault(path, [])
+                for element in value:
+                    self._add_row(tables, path, element if isinstance(element, dict) else {0: element}, table, key)
+            elif value is not None:
+                row[column] = value
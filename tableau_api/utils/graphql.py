@@ -0,0 +1,116 @@
+import re
+import json
+
+__all__ = ["paginate_query", "selection_fields", "selection_columns", "filter_query"]
+
+# whitespace, comments and commas carry no meaning in GraphQL, strings are kept as one token
+TOKEN_PATTERN = re.compile(r'(?P<skip>[\s,]+|#[^\n]*)|(?P<token>"(?:\\.|[^"\\])*"|[_A-Za-z][_0-9A-Za-z]*|-?\d+(?:\.\d+)?|[^\s,])')
+
+
+def _tokenize(query:str) -> list:
+    return [(match.group("token"), match.start(), match.end()) for match in TOKEN_PATTERN.finditer(query) if match.group("token")]
+
+
+def _skip_arguments(tokens, position) -> int:
+    # skips a (possibly nested) list of arguments and returns the position after the closing bracket
+    depth = 0
+    while position < len(tokens):
+        token = tokens[position][0]
+        depth += {"(": 1, "[": 1, "{": 1, ")": -1, "]": -1, "}": -1}.get(token, 0)
+        position += 1
+        if depth == 0:
+            return position
+    raise ValueError("GraphQL query contains unbalanced brackets")
+
+
+def _parse_selection(tokens, position) -> tuple:
+    """
+    Parses the selection set starting at tokens[position] (an opening curly bracket).
+    Returns the selected fields as {name: sub selection or None} and the position after the closing bracket.
+    """
+    fields = {}
+    position += 1
+    while tokens[position][0] != "}":
+        name = tokens[position][0]
+        position += 1
+        if tokens[position][0] == ":":  # aliased field, the alias is what the response contains
+            position += 2
+        if tokens[position][0] == "(":
+            position = _skip_arguments(tokens, position)
+
+        selection = None
+        if tokens[position][0] == "{":
+            selection, position = _parse_selection(tokens, position)
+
+        # fields that are selected twice are only returned once
+        if isinstance(fields.get(name), dict) and selection:
+            fields[name].update(selection)
+        else:
+            fields[name] = selection
+    return fields, position + 1
+
+
+def _root_field(tokens) -> tuple:
+    # returns the positions of the root field name, its arguments (or None) and its selection set
+    name = next(i for i, (token, _, _) in enumerate(tokens) if token == "{") + 1
+    arguments = name + 1 if tokens[name + 1][0] == "(" else None
+    selection = _skip_arguments(tokens, arguments) if arguments else name + 1
+    return name, arguments, selection
+
+
+def selection_fields(query:str) -> dict:
+    """
+    Returns the fields the query selects on its root field as {name: sub selection or None}, e.g. {"name": None, "owner": {"name": None}}.
+    """
+    tokens = _tokenize(query)
+    _, _, selection = _root_field(tokens)
+    fields, _ = _parse_selection(tokens, selection)
+    return fields
+
+
+def selection_columns(query:str) -> list:
+    """
+    Returns the column names FlattenedDataFrame creates for the result of the query, in the same order.
+    Knowing the columns up front keeps them identical for every page of a paginated query.
+    """
+    fields = selection_fields(query)
+    columns, queue = [], [(name, selection) for name, selection in fields.items()]
+    for name, selection in queue:
+        if selection:
+            queue.extend((f"{name}_{child}", child_selection) for child, child_selection in selection.items())
+        else:
+            columns.append(name)
+    return columns
+
+
+def paginate_query(query:str, page_size:int, after:str=None) -> str:
+    """
+    Rewrites a query on a root field (e.g. workbooks) to its paginated form (workbooksConnection) that returns
+    page_size nodes after the cursor after, together with the pageInfo needed to request the next page.
+    """
+    tokens = _tokenize(query)
+    name, arguments, selection = _root_field(tokens)
+    _, end = _parse_selection(tokens, selection)
+
+    connection_arguments = [f"first: {page_size}"]
+    if after is not None:
+        connection_arguments.append(f"after: {json.dumps(after)}")
+    if arguments:  # keeping arguments (e.g. a filter) that were already on the root field
+        connection_arguments.append(query[tokens[arguments][2]:tokens[selection - 1][1]].strip())
+
+    root = tokens[name][0]
+    body = query[tokens[selection][1]:tokens[end - 1][2]]
+    return f"{{ {root}Connection({', '.join(connection_arguments)}) {{ nodes {body} pageInfo {{ hasNextPage endCursor }} }} }}"
+
+
+def filter_query(query:str, filter:str) -> str:
+    """
+    Adds a filter to the root field of the query, e.g. filter_query(query, '{luidWithin: ["..."]}').
+    """
+    tokens = _tokenize(query)
+    name, arguments, _ = _root_field(tokens)
+    if arguments:
+        position = tokens[arguments][2]
+        return f"{query[:position]}filter: {filter}, {query[position:]}"
+    position = tokens[name][2]
+    return f"{query[:position]}(filter: {filter}){query[position:]}"
@@ -6,17 +6,18 @@ import datetime
 import re
 import json
 import shutil
-import psycopg2
 import warnings
-from .flattened_dataframe import FlattenedDataFrame
-from .ts_config import generate_config
-from tableau_api_lib import TableauServerConnection
-from sqlalchemy import create_engine
-from sqlalchemy.exc import OperationalError
+from urllib.parse import urlsplit
+from .flattened_dataframe import FlattenedDataFrame, NormalizedTables
+from .ts_config import generate_config, DEFAULT_REST_ENV
+from .graphql import paginate_query, selection_columns
+from .output_sinks import open_sink, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+from .session import install_http_session, tableau_requests, TokenCache, repository_engine, discard_repository_engine
+from .instrumentation import instrumentation
 
 current_date = time.strftime("%Y-%m-%d")
 TABLEAU_DATABASE_CONNECTION_DETAILS = "SERVERNAME:8060/workgroup?"
-DEFAULT_REST_ENV = "XXXXXXXX"
+SQL_CHUNK_SIZE = 10000 # rows fetched from the repository at once
 
 LOOKUP_RESPONSES = {
     "sign_in": {
@@ -71,6 +72,47 @@ def unpack_response(to_unpack_dict):
         raise Exception(message)
 
 
+def unpack_page(response:dict) -> tuple:
+    """
+    Unpacks the response of a paginated Metadata API query into the nodes of the page and its pageInfo.
+    """
+    data = response.get("data")
+    if response.get("errors") or not isinstance(data, dict) or len(data) != 1:
+        message = (
+            f"response contained multiple messages:\n" 
+            f"{response.get('errors', '')}\n\b" 
+            f"Keys in the message are the following:\n" 
+            f"\t{response.keys()}" 
+        )
+        raise Exception(message)
+    
+    connection = list(data.values())[0]
+    return connection.get("nodes", []), connection.get("pageInfo", {})
+
+
+def query_pages(connection, query:str, page_size:int=None):
+    """
+    Generator that yields the nodes of the query one page at a time by following the endCursor of every page.
+    Without a page_size the query is executed as is, in one request.
+    """
+    if not page_size:
+        with instrumentation.stage("metadata query"):
+            nodes = unpack_response(connection.metadata_graphql_query(query=query).json())
+        yield nodes
+        return
+    
+    after = None
+    while True:
+        with instrumentation.stage("metadata query"):
+            response = connection.metadata_graphql_query(query=paginate_query(query, page_size, after)).json()
+            nodes, page_info = unpack_page(response)
+        yield nodes
+        
+        if not page_info.get("hasNextPage"):
+            return
+        after = page_info.get("endCursor")
+
+
 def create_folder(path:str):
     print(f"\n{path} does not exist, creating this folder...", end=" ")
     os.makedirs(path)
@@ -87,7 +129,8 @@ def move_to_historiek(folder:str):
         create_folder(historiek_folder)
     
     files = glob.glob(f"{folder}\\*.*")
-    p_file_name = r"(?<=\\)\w+\.(csv|xlsx)"
+    # the run reports (json) are moved along with the outputs they describe
+    p_file_name = rf"(?<=\\)\w+\.({'|'.join([*OUTPUT_FORMATS, 'json'])})"
     if files:
         print("\nStarted moving files to historiek")
     for file in files:
@@ -115,27 +158,56 @@ def move_file_to(file:str, to:str):
         create_folder(to)
     
     destination = os.path.join(to, os.path.basename(file))
-    shutil.move(file, destination) 
+    shutil.move(file, destination)
+    return destination 
     
 
-def convert_query(folder, connection, query_name, query) -> None:
+def convert_query(folder, connection, query_name, query, normalize=False, page_size=None, output_format=DEFAULT_OUTPUT_FORMAT) -> None:
     print("\n-----------------------------------------------------------") 
     print(f"Executing query: {query_name} \n")
     
-    response = connection.metadata_graphql_query(query=query).json()
-
+    file_name = f"{query_name}_{connection._env}"
+    # the columns are taken from the query, so every page results in the same columns
+    columns = selection_columns(query) + ["snapshot_date"]
+    normalized_tables = NormalizedTables(query_name, query)
+    sink = None
+    
     try: 
-        unpacked_response = unpack_response(response)
+        # every page is flattened and written before the next one is requested, so only one page is kept in memory
+        for page_number, nodes in enumerate(query_pages(connection, query, page_size), start=1):
+            with instrumentation.stage("flatten"):
+                if normalize:
+                    # one table per entity level, linked through the {parent}_key columns, instead of one exploded table
+                    tables = normalized_tables.normalize(nodes)
+                else:
+                    # FlattenedDataFrame prints the unpacked columns, which only needs to be shown once
+                    tables = {query_name: FlattenedDataFrame(nodes, verbose=page_number == 1)}
+            
+            with instrumentation.stage("write"):
+                if sink is None:
+                    print(f"Saving file at {folder}: '{file_name}.{output_format}'")
+                    # the flattened pages are reindexed to the columns of the query, the normalized tables already are
+                    sink = open_sink(output_format, folder, file_name, sheet_name=query_name, columns=None if normalize else columns)
+                for table, df in tables.items():
+                    sink.write(df, table=None if table == query_name else table)
+                    instrumentation.count("rows written", len(df))
+            
+            if page_size:
+                print(f"\tpage {page_number} saved ({len(nodes)} {query_name})")
 
     except Exception as err:
         print(f"The query '{query_name}' did not return a valid response and resulted in the following error:\n{err}")
+        if sink is not None:
+            print(f"The pages that were retrieved before the error are saved in '{file_name}.{output_format}'")
         print("-----------------------------------------------------------\n")
         return
-         
-    df = FlattenedDataFrame(unpacked_response)
-    print(f"Saving file at {folder}: '{query_name}_{connection._env}.xlsx'")
-    df.to_excel(f"{folder}\\{query_name}_{connection._env}.xlsx", index=False, sheet_name=query_name)
-    print("Finished running query")
+    
+    finally:
+        if sink is not None:
+            with instrumentation.stage("write"):
+                sink.close()
+    
+    print(f"Finished running query: {query_name}")
     print("-----------------------------------------------------------\n") 
 
 def lookup_error(method:str, status:int):
@@ -156,6 +228,22 @@ def prompt_personal_access_token(environment:str="tableau_prod") -> dict:
     print("")
     return {"pat_name": pat_name, "pat_secret": pat_secret}
 
+def personal_access_token(ts_config:dict, environment:str) -> dict:
+    """
+    Returns the Personal Access Token of the environment: the one in ts_config, the one in the TABLEAU_PAT_NAME and TABLEAU_PAT_SECRET
+    environment variables (run_all_sites hands the tokens to its processes like this) or else the one that is asked for.
+    """
+    config = ts_config.get(environment)
+    if config.get("personal_access_token_name") != "<YOUR_USERNAME>":
+        return {"pat_name": config.get("personal_access_token_name"), "pat_secret": config.get("personal_access_token_secret")}
+    if os.environ.get("TABLEAU_PAT_NAME") and os.environ.get("TABLEAU_PAT_SECRET"):
+        return {"pat_name": os.environ["TABLEAU_PAT_NAME"], "pat_secret": os.environ["TABLEAU_PAT_SECRET"]}
+    try:
+        return prompt_personal_access_token(environment)
+    except EOFError:
+        # e.g. a process of run_all_sites, it has no console to answer the prompt
+        raise LoginError(f"No Personal Access Token for {environment}: set TABLEAU_PAT_NAME and TABLEAU_PAT_SECRET or add it to ts_config.json") from None
+
 def prompt_tableau_database_credentials() -> dict:
     print("\nTo execute this script we need to log into the Tableau PRD database. Please provide the credentials.")
     username = input("\tUsername: ")
@@ -163,10 +251,49 @@ def prompt_tableau_database_credentials() -> dict:
     print("")
     return {"username": username, "password": password}
     
-def setup_database_connection():
-    response = prompt_tableau_database_credentials()
-    database_connection_string = f"postgresql+psycopg2://{response.get('username')}:{response.get('password')}@{TABLEAU_DATABASE_CONNECTION_DETAILS}"
-    alchemyEngine = create_engine(database_connection_string, pool_recycle=3600)
+def read_sql_chunks(query, dbConnection, chunksize:int=SQL_CHUNK_SIZE):
+    """
+    Yields the result of the query in dataframes of chunksize rows. A server side cursor is used,
+    so the database streams the rows instead of sending the whole result at once.
+    """
+    streaming_connection = dbConnection.execution_options(stream_results=True, max_row_buffer=chunksize)
+    yield from pd.read_sql(query, streaming_connection, chunksize=chunksize)
+
+def read_sql_streamed(query, dbConnection, chunksize:int=SQL_CHUNK_SIZE) -> pd.DataFrame:
+    chunks = list(read_sql_chunks(query, dbConnection, chunksize=chunksize))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+def repository_details(ts_config:dict, environment:str) -> str:
+    """
+    Returns the connection details (host:port/database) of the repository of the server of the environment: the repository
+    of the environment in ts_config, or TABLEAU_DATABASE_CONNECTION_DETAILS when that repository runs on the host of the server.
+    The items of a site are only looked up in the repository of its own server, the ids of another server would delete other items.
+    """
+    config = ts_config[environment]
+    if config.get("repository"):
+        return config["repository"]
+    server_host = (urlsplit(config.get("server", "")).hostname or "").lower()
+    repository_host = TABLEAU_DATABASE_CONNECTION_DETAILS.split(":")[0].split("/")[0].lower()
+    if server_host != repository_host:
+        raise ValueError(
+            f"The repository {TABLEAU_DATABASE_CONNECTION_DETAILS} does not belong to the server {config.get('server')} of {environment}. "
+            f"Add the repository of that server to {environment} in ts_config.json, e.g. \"repository\": \"{server_host or 'SERVERNAME'}:8060/workgroup?\""
+        )
+    return TABLEAU_DATABASE_CONNECTION_DETAILS
+
+def database_connection_string(details:str=TABLEAU_DATABASE_CONNECTION_DETAILS) -> str:
+    # scheduled and multi site runs can not be prompted, they provide the credentials in the environment
+    if os.environ.get("TABLEAU_DB_USERNAME") and os.environ.get("TABLEAU_DB_PASSWORD"):
+        response = {"username": os.environ["TABLEAU_DB_USERNAME"], "password": os.environ["TABLEAU_DB_PASSWORD"]}
+    else:
+        response = prompt_tableau_database_credentials()
+    return f"postgresql+psycopg2://{response.get('username')}:{response.get('password')}@{details}"
+
+def setup_database_connection(details:str=TABLEAU_DATABASE_CONNECTION_DETAILS):
+    # SQLAlchemy (and the psycopg2 driver) are only imported by the scripts that connect to the repository
+    from sqlalchemy.exc import OperationalError
+    # the engine and its connection pool are shared by the whole process, the credentials are only asked once
+    alchemyEngine = repository_engine(details, lambda: database_connection_string(details))
     
     try: 
         print("Attempting to sign into Tableau database...")
@@ -174,6 +301,7 @@ def setup_database_connection():
         print("Signed in succesully!\n")
         return dbConnection
     except OperationalError:
+        discard_repository_engine(details)
         error = (
             "\n\n----------------------------------------------------------------------------------------------------------------------------------------------------",
             "\t\t\t\t\t\t\t\t\t!ERROR!\n",
@@ -194,24 +322,48 @@ def setup_REST_connection(config_file:str, environment:str=DEFAULT_REST_ENV):
     
     if environment == 'XXXXXXXX':
         print("\n\nplease change the ts_config file to reflect your tableau server details")
-        print("then change the DEFAULT_REST_ENV variable in the helpers.py file to the default environment/site you want to run in\n\n")
+        print("then change the DEFAULT_REST_ENV variable in the ts_config.py file to the default environment/site you want to run in\n\n")
         sys.exit()
 
-    if ts_config.get(environment).get("personal_access_token_name") == "<YOUR_USERNAME>":
-        credentials = prompt_personal_access_token(environment)
-        ts_config[environment]["personal_access_token_name"] = credentials.get("pat_name")
-        ts_config[environment]["personal_access_token_secret"] = credentials.get("pat_secret")
+    from tableau_api_lib import TableauServerConnection # importing tableau_api_lib takes a while, it is only needed to sign in
+
+    def fill_personal_access_token():
+        if ts_config.get(environment).get("personal_access_token_name") == "<YOUR_USERNAME>":
+            credentials = personal_access_token(ts_config, environment)
+            ts_config[environment]["personal_access_token_name"] = credentials.get("pat_name")
+            ts_config[environment]["personal_access_token_secret"] = credentials.get("pat_secret")
+    
+    # all requests share one pool of kept alive connections and sign in again when the session expired
+    install_http_session()
+    token_cache = TokenCache()
+    token_key = f"{ts_config[environment].get('server')}|{ts_config[environment].get('site_url')}"
+    store_token = lambda response: token_cache.store(token_key, conn, response)
+    # a cassette starts with a sign in, a replayed sign in needs no credentials and its token is not cached
+    cassette = tableau_requests.cassette
+    if cassette is not None and cassette.replaying:
+        fill_personal_access_token = store_token = lambda *args: None
     
     with warnings.catch_warnings(): # we get a warning that no ssl is inplace. We ignore this warning since this is due to the company proxy
         warnings.simplefilter("ignore")
         conn = TableauServerConnection(ts_config, ssl_verify=False, env=environment)
+        
+        cached_token = token_cache.get(token_key) if cassette is None else None
+        if cached_token is not None:
+            conn.auth_token, conn.site_id, conn.user_id = cached_token["token"], cached_token["site_id"], cached_token["user_id"]
+            tableau_requests.register(conn, before_sign_in=fill_personal_access_token, on_sign_in=store_token)
+            print("Reusing the Tableau REST API session of a previous run\n")
+            return conn
     
         try:
+            fill_personal_access_token()
             print("Attempting to sign into Tableau REST API...")
-            response_code = conn.sign_in().status_code
+            response = conn.sign_in()
+            response_code = response.status_code
             if response_code != 200:  # success code voor connectie
                 
                 raise ValueError
+            store_token(response)
+            tableau_requests.register(conn, before_sign_in=fill_personal_access_token, on_sign_in=store_token)
             print("Signed in succesully!\n")    
             return conn
         except ValueError:
@@ -224,5 +376,16 @@ def setup_REST_connection(config_file:str, environment:str=DEFAULT_REST_ENV):
             )
             print(*msg, sep="\n")
             raise LoginError("Error whilst attempting to login to the REST API") from None
-            
-            
\ No newline at end of file
+
+def sign_out_REST_connection(conn) -> None:
+    # the session is kept for the next run when the token cache is enabled, a replayed session does not exist on the server
+    cassette = tableau_requests.cassette
+    if TokenCache().enabled or (cassette is not None and cassette.replaying):
+        return
+    conn.sign_out()
+
+def sign_out_cached_sessions() -> None:
+    with warnings.catch_warnings(): # we get a warning that no ssl is inplace. We ignore this warning since this is due to the company proxy
+        warnings.simplefilter("ignore")
+        signed_out = TokenCache().sign_out()
+    print(f"Signed out {signed_out} cached Tableau session(s), the token cache is removed")
@@ -0,0 +1,134 @@
+import os
+import json
+import threading
+import pandas as pd
+from .flattened_dataframe import FlattenedDataFrame
+from .graphql import filter_query, selection_columns
+from .helpers import query_pages, create_folder
+from .output_sinks import open_sink, DEFAULT_OUTPUT_FORMAT
+from .instrumentation import instrumentation
+
+__all__ = ["IncrementalState", "convert_query_incremental"]
+
+LUID_BATCH_SIZE = 100
+# the Metadata API reindexes changed items asynchronously, items updated this long before the watermark are extracted again
+# so a change that was not yet indexed by the previous run is picked up by the next one
+WATERMARK_OVERLAP_HOURS = 24
+
+# the TableauServerConnection method that lists the items of a content type
+REST_QUERIES = {
+    "workbooks": "query_workbooks_for_site",
+    "datasources": "query_data_sources"
+}
+
+
+class IncrementalState:
+    """
+    Keeps the watermark (the highest updatedAt that was extracted) and the snapshot of the previous run
+    of every incremental query, per environment.
+    """
+    _lock = threading.Lock()  # queries can run in parallel and share the watermarks file
+
+    def __init__(self, folder:str):
+        self.folder = folder
+        self.watermarks_file = os.path.join(folder, "watermarks.json")
+        if not os.path.exists(folder):
+            create_folder(folder)
+
+    def _snapshot_file(self, query_name:str, environment:str) -> str:
+        return os.path.join(self.folder, f"{query_name}_{environment}.pkl")
+
+    def _read_watermarks(self) -> dict:
+        if not os.path.exists(self.watermarks_file):
+            return {}
+        with open(self.watermarks_file) as f:
+            return json.load(f)
+
+    def watermark(self, query_name:str, environment:str):
+        with self._lock:
+            return self._read_watermarks().get(environment, {}).get(query_name)
+
+    def snapshot(self, query_name:str, environment:str):
+        snapshot_file = self._snapshot_file(query_name, environment)
+        return pd.read_pickle(snapshot_file) if os.path.exists(snapshot_file) else None
+
+    def save(self, query_name:str, environment:str, watermark:str, snapshot:pd.DataFrame) -> None:
+        # the snapshot is saved first, a watermark without its snapshot would make the next run skip changes
+        snapshot.to_pickle(self._snapshot_file(query_name, environment))
+        with self._lock:
+            watermarks = self._read_watermarks()
+            watermarks.setdefault(environment, {})[query_name] = watermark
+            with open(self.watermarks_file, "w") as f:
+                json.dump(watermarks, f, indent=4)
+
+
+def list_updated_at(connection, content_type:str) -> dict:
+    """
+    Returns {luid: updatedAt} of all items of the content type, only requesting these two fields keeps the listing cheap.
+    """
+    from tableau_api_lib.utils import extract_pages
+    query_func = getattr(connection, REST_QUERIES[content_type])
+    with instrumentation.stage("list items"):
+        items = extract_pages(query_func, parameter_dict={"fields": "fields=id,updatedAt"})
+    return {item["id"]: item["updatedAt"] for item in items if item}  # an empty site is returned as [{}]
+
+
+def convert_query_incremental(folder, connection, query_name, query, content_type, state, page_size=None, output_format=DEFAULT_OUTPUT_FORMAT) -> None:
+    """
+    Only extracts the items that were updated since the watermark of the previous run (minus WATERMARK_OVERLAP_HOURS) with a luidWithin filter
+    and merges them into the snapshot of that run. Items that were deleted from the site are removed from the snapshot.
+    The first run (without a snapshot) extracts everything.
+    """
+    print("\n-----------------------------------------------------------")
+    print(f"Executing query incrementally: {query_name} \n")
+
+    file_name = f"{query_name}_{connection._env}"
+    columns = selection_columns(query) + ["snapshot_date"]
+    if "luid" not in columns:
+        raise ValueError(f"The query '{query_name}' must select the luid of its root entities to be extracted incrementally")
+
+    try:
+        updated_at = list_updated_at(connection, content_type)
+        watermark = state.watermark(query_name, connection._env)
+        snapshot = state.snapshot(query_name, connection._env)
+
+        if watermark is None or snapshot is None:
+            print("No previous snapshot found, extracting everything")
+            filtered_queries = [query]
+        else:
+            since = pd.to_datetime(watermark, utc=True) - pd.Timedelta(hours=WATERMARK_OVERLAP_HOURS)
+            updated = pd.to_datetime(pd.Series(updated_at, dtype=object), utc=True)
+            changed = set(updated.index[updated > since])
+            # items that the previous run did not find (e.g. not yet indexed by the Metadata API) are retried
+            changed |= set(updated_at) - set(snapshot["luid"])
+            print(f"{len(changed)} of {len(updated_at)} {content_type} changed since {watermark} or in the {WATERMARK_OVERLAP_HOURS} hours before it")
+            luids = sorted(changed)
+            batches = [luids[i:i + LUID_BATCH_SIZE] for i in range(0, len(luids), LUID_BATCH_SIZE)]
+            filtered_queries = [filter_query(query, f"{{luidWithin: {json.dumps(batch)}}}") for batch in batches]
+
+        frames = []
+        for filtered_query in filtered_queries:
+            for nodes in query_pages(connection, filtered_query, page_size):
+                with instrumentation.stage("flatten"):
+                    frames.append(FlattenedDataFrame(nodes, verbose=False).reindex(columns=columns))
+
+        if snapshot is not None and watermark is not None:
+            # unchanged items are kept, updated items are replaced and deleted items are dropped
+            unchanged = snapshot["luid"].isin(updated_at.keys()) & ~snapshot["luid"].isin(changed)
+            frames.insert(0, snapshot.loc[unchanged].reindex(columns=columns))
+
+    except Exception as err:
+        print(f"The query '{query_name}' did not return a valid response and resulted in the following error:\n{err}")
+        print("-----------------------------------------------------------\n")
+        return
+
+    df = pd.concat(frames).reset_index(drop=True) if frames else pd.DataFrame(columns=columns)
+    df["snapshot_date"] = pd.to_datetime('today').strftime('%Y-%m-%d')
+
+    print(f"Saving file at {folder}: '{file_name}.{output_format}'")
+    with instrumentation.stage("write"), open_sink(output_format, folder, file_name, sheet_name=query_name, columns=columns) as sink:
+        sink.write(df)
+    instrumentation.count("rows written", len(df))
+    state.save(query_name, connection._env, max(updated_at.values(), default=watermark), df)
+    print(f"Finished running query: {query_name}")
+    print("-----------------------------------------------------------\n")
@@ -0,0 +1,141 @@
+import os
+import re
+import json
+import time
+import datetime
+import threading
+import contextlib
+from urllib.parse import urlsplit
+
+__all__ = ["Instrumentation", "instrumentation", "LATENCY_BUCKETS", "RUN_REPORT_NAME"]
+
+RUN_REPORT_NAME = "run_report"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30) # upper bounds in seconds of the request latency histogram
+BUCKET_NAMES = [*(f"<={bound}" for bound in LATENCY_BUCKETS), f">{LATENCY_BUCKETS[-1]}"]
+
+# the endpoint of the first pattern that matches the path of a request, the other requests are grouped by method
+ENDPOINTS = [
+    (re.compile(r"/auth/signin$"), "sign in"),
+    (re.compile(r"/serverinfo$"), "server info"),
+    (re.compile(r"/metadata/graphql$"), "metadata query"),
+    (re.compile(r"/(default-)?permissions(/\w+)?$"), "permissions"),
+    (re.compile(r"/content$"), "download"),
+    (re.compile(r"/sites/[^/]+/\w+$"), "list"),
+]
+
+
+def endpoint_name(method:str, url:str) -> str:
+    path = urlsplit(url).path
+    for pattern, name in ENDPOINTS:
+        if pattern.search(path):
+            return name
+    return method.lower()
+
+
+class Instrumentation:
+    """
+    Collects how long every stage of a run takes and what the requests to the Tableau server cost, and saves them
+    as a JSON run report next to the outputs. Stages can run on several threads at the same time: seconds is the total
+    time spent in a stage, wall_seconds the time between its first start and its last end.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.listeners = [] # called with the name of a stage when it starts and ends, e.g. by the memory profiler
+        self.start()
+
+    def start(self, script:str=None, environment:str=None) -> None:
+        with self._lock:
+            self.script = script
+            self.environment = environment
+            self.started_at = datetime.datetime.now()
+            self._start_time = time.perf_counter()
+            self.stages = {}
+            self.counters = {}
+            self.endpoints = {}
+
+    @contextlib.contextmanager
+    def stage(self, name:str):
+        for listener in self.listeners:
+            listener(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "first_start": start, "last_end": end})
+                stage["calls"] += 1
+                stage["seconds"] += end - start
+                stage["first_start"] = min(stage["first_start"], start)
+                stage["last_end"] = max(stage["last_end"], end)
+            for listener in self.listeners:
+                listener(name)
+
+    def count(self, name:str, amount:int=1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_request(self, method:str, url:str, status_code:int, seconds:float, bytes_received:int=0, bytes_sent:int=0) -> None:
+        # status_code None means the connection failed or timed out
+        bucket = next((name for bound, name in zip(LATENCY_BUCKETS, BUCKET_NAMES) if seconds <= bound), BUCKET_NAMES[-1])
+        with self._lock:
+            endpoint = self.endpoints.setdefault(endpoint_name(method, url), {
+                "requests": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes_received": 0, "bytes_sent": 0,
+                "status_codes": {}, "latency": dict.fromkeys(BUCKET_NAMES, 0)
+            })
+            endpoint["requests"] += 1
+            endpoint["seconds"] += seconds
+            endpoint["max_seconds"] = max(endpoint["max_seconds"], seconds)
+            endpoint["bytes_received"] += bytes_received
+            endpoint["bytes_sent"] += bytes_sent
+            status = str(status_code) if status_code is not None else "connection error"
+            endpoint["status_codes"][status] = endpoint["status_codes"].get(status, 0) + 1
+            endpoint["latency"][bucket] += 1
+
+    def report(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {"calls": stage["calls"], "seconds": round(stage["seconds"], 3), "wall_seconds": round(stage["last_end"] - stage["first_start"], 3)}
+                for name, stage in self.stages.items()
+            }
+            endpoints = {
+                name: {**endpoint, "seconds": round(endpoint["seconds"], 3), "max_seconds": round(endpoint["max_seconds"], 3),
+                       "mean_seconds": round(endpoint["seconds"] / endpoint["requests"], 3)}
+                for name, endpoint in self.endpoints.items()
+            }
+            return {
+                "script": self.script,
+                "environment": self.environment,
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "seconds": round(time.perf_counter() - self._start_time, 3),
+                "stages": stages,
+                "counters": dict(self.counters),
+                "http": {
+                    "requests": sum(endpoint["requests"] for endpoint in endpoints.values()),
+                    "bytes_received": sum(endpoint["bytes_received"] for endpoint in endpoints.values()),
+                    "bytes_sent": sum(endpoint["bytes_sent"] for endpoint in endpoints.values()),
+                    "endpoints": endpoints
+                }
+            }
+
+    def write(self, folder:str, name:str=RUN_REPORT_NAME) -> str:
+        """
+        Saves the run report in the folder, prints where the time went and returns the path of the report.
+        """
+        report = self.report()
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{name}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=4)
+
+        print(f"\n{'stage':<28}{'calls':>8}{'seconds':>10}{'wall seconds':>14}")
+        for stage, result in sorted(report["stages"].items(), key=lambda stage: -stage[1]["wall_seconds"]):
+            print(f"{stage:<28}{result['calls']:>8}{result['seconds']:>10.1f}{result['wall_seconds']:>14.1f}")
+        http = report["http"]
+        print(f"{http['requests']} requests to the Tableau server, {http['bytes_received'] / 1024 / 1024:.1f} MB received")
+        print(f"The run report is saved at {path}\n")
+        return path
+
+
+# the stages and requests of the script that runs in this process
+instrumentation = Instrumentation()
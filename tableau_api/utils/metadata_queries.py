@@ -1,220 +1,244 @@
-queries = {
-    "DatabaseServer": """
-        {
-            databaseServers {
-                id  
-                luid
-                name
-                hostName
-                isEmbedded
-                port
-                connectionType
-                isEmbedded     
-            
-                tables {
-                    id
-                    name
-                    schema
-                    fullName
-                    isEmbedded
-                }    
-            }
-        }""",
-    
-    "files": """
-        {
-            files {
-                id
-                luid
-                name
-                isEmbedded
-                filePath
-                __typename
-                connectionType
-                tables {
-                    id
-                    name
-                } 
-            }
-        }""",
-    
-    "Databases": """
-        {
-            databases{
-                id
-                luid
-                name
-                __typename
-                connectionType
-            }
-        }
-    """,
-    
-    "Tables": """
-        {
-            tables{
-                id
-                name
-                isEmbedded
-            }
-        }
-    """,
-    
-    "databasetable": """
-        {
-            databaseTables{
-                id
-                luid
-                name
-                isEmbedded
-                schema
-                fullName
-            }
-        }
-    """,
-    
-    "customsqltables": """
-        {
-            customSQLTables{
-                id
-                name
-                isEmbedded
-                query
-            }
-        }
-    """,
-    
-    "EmbeddedDatasources": """
-        {
-            embeddedDatasources{
-                id
-                name
-                hasExtracts
-                extractLastRefreshTime
-                extractLastUpdateTime
-                extractLastIncrementalUpdateTime
-                extractLastUpdateTime
-                
-                workbook {
-                    id
-                    name
-                    projectName
-                }
-                
-                upstreamTables {
-                    id
-                    name
-                }
-            }
-        }
-    """,
-    
-    "publisheddatasources": """
-        {
-            publishedDatasources {
-                id
-                name
-                projectName
-                
-                site {
-                    id
-                    name
-                }
-                
-                owner {
-                    id
-                    name
-                }
-                
-                hasExtracts
-                extractLastRefreshTime
-                extractLastUpdateTime
-                extractLastIncrementalUpdateTime
-                extractLastUpdateTime
-                
-                downstreamWorkbooks {
-                    name
-                    projectName
-                }
-                
-                upstreamTables {
-                    id
-                    name
-                    schema
-                    fullName
-                    database {
-                        name
-                    }
-                }
-                
-                downstreamTables {
-                    id
-                    name
-                }
-            }
-        }
-    """,
-    
-    "Disconnecteddatasources": """
-        {
-            workbooks {
-                name
-                projectName
-                embeddedDatasources {
-                    name
-                    upstreamDatasources {
-                        name
-                    }
-                    upstreamDatabases {
-                        name
-                    }
-                }  
-            }
-        }
-    """,
-    
-    "users": """
-        {
-            tableauUsers{
-                id
-                name
-                username
-                domain
-                email
-                
-                ownedWorkbooks {
-                    id
-                    name
-                    projectName
-                }
-            }
-        }
-    """,
-    
-    "workbooks": """
-        {
-            workbooks {
-                id
-                name
-                projectName
-                
-                dashboards {
-                    id
-                    name
-                    sheets {
-                        id
-                        name
-                        
-                        datasourceFields {
-                            id
-                            name
-                            upstreamTables {
-                                id
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    """
+# number of root entities (e.g. workbooks) requested per page of a paginated query
+# deeply nested queries get smaller pages to stay below the node limit of the Metadata API
+DEFAULT_PAGE_SIZE = 500
+page_sizes = {
+    "DatabaseServer": 100,
+    "files": 200,
+    "EmbeddedDatasources": 200,
+    "publisheddatasources": 100,
+    "Disconnecteddatasources": 100,
+    "users": 200,
+    "workbooks": 25
+}
+
+# queries that can be extracted incrementally, with the REST API content type that is used to find the changed items
+# the root entities of these queries select their luid, which is the id of the item in the REST API
+incremental_queries = {
+    "publisheddatasources": "datasources",
+    "Disconnecteddatasources": "workbooks",
+    "workbooks": "workbooks"
+}
+
+queries = {
+    "DatabaseServer": """
+        {
+            databaseServers {
+                id  
+                luid
+                name
+                hostName
+                isEmbedded
+                port
+                connectionType
+                isEmbedded     
+            
+                tables {
+                    id
+                    name
+                    schema
+                    fullName
+                    isEmbedded
+                }    
+            }
+        }""",
+    
+    "files": """
+        {
+            files {
+                id
+                luid
+                name
+                isEmbedded
+                filePath
+                __typename
+                connectionType
+                tables {
+                    id
+                    name
+                } 
+            }
+        }""",
+    
+    "Databases": """
+        {
+            databases{
+                id
+                luid
+                name
+                __typename
+                connectionType
+            }
+        }
+    """,
+    
+    "Tables": """
+        {
+            tables{
+                id
+                name
+                isEmbedded
+            }
+        }
+    """,
+    
+    "databasetable": """
+        {
+            databaseTables{
+                id
+                luid
+                name
+                isEmbedded
+                schema
+                fullName
+            }
+        }
+    """,
+    
+    "customsqltables": """
+        {
+            customSQLTables{
+                id
+                name
+                isEmbedded
+                query
+            }
+        }
+    """,
+    
+    "EmbeddedDatasources": """
+        {
+            embeddedDatasources{
+                id
+                name
+                hasExtracts
+                extractLastRefreshTime
+                extractLastUpdateTime
+                extractLastIncrementalUpdateTime
+                extractLastUpdateTime
+                
+                workbook {
+                    id
+                    name
+                    projectName
+                }
+                
+                upstreamTables {
+                    id
+                    name
+                }
+            }
+        }
+    """,
+    
+    "publisheddatasources": """
+        {
+            publishedDatasources {
+                id
+                luid
+                name
+                projectName
+                
+                site {
+                    id
+                    name
+                }
+                
+                owner {
+                    id
+                    name
+                }
+                
+                hasExtracts
+                extractLastRefreshTime
+                extractLastUpdateTime
+                extractLastIncrementalUpdateTime
+                extractLastUpdateTime
+                
+                downstreamWorkbooks {
+                    name
+                    projectName
+                }
+                
+                upstreamTables {
+                    id
+                    name
+                    schema
+                    fullName
+                    database {
+                        name
+                    }
+                }
+                
+                downstreamTables {
+                    id
+                    name
+                }
+            }
+        }
+    """,
+    
+    "Disconnecteddatasources": """
+        {
+            workbooks {
+                luid
+                name
+                projectName
+                embeddedDatasources {
+                    name
+                    upstreamDatasources {
+                        name
+                    }
+                    upstreamDatabases {
+                        name
+                    }
+                }  
+            }
+        }
+    """,
+    
+    "users": """
+        {
+            tableauUsers{
+                id
+                name
+                username
+                domain
+                email
+                
+                ownedWorkbooks {
+                    id
+                    name
+                    projectName
+                }
+            }
+        }
+    """,
+    
+    "workbooks": """
+        {
+            workbooks {
+                id
+                luid
+                name
+                projectName
+                
+                dashboards {
+                    id
+                    name
+                    sheets {
+                        id
+                        name
+                        
+                        datasourceFields {
+                            id
+                            name
+                            upstreamTables {
+                                id
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    """
 }
\ No newline at end of file
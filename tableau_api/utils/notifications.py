@@ -0,0 +1,245 @@
+import os
+import html
+import queue
+import shutil
+import ssl
+import smtplib
+import mailbox
+import tempfile
+import threading
+from email.message import EmailMessage
+from .instrumentation import instrumentation
+
+__all__ = ["Notifier", "OutlookBackend", "SmtpBackend", "MaildirBackend", "NOTIFICATION_BACKENDS", "DEFAULT_NOTIFICATION_BACKEND"]
+
+SENDER = "EMAILADDRESSTOSENDFROM"
+DEFAULT_NOTIFICATION_BACKEND = "outlook"
+
+
+def digest_subject(digest:dict) -> str:
+    items = digest["items"]
+    if len(items) == 1:
+        return f"Tableau: {items[0]['item_type']} - {items[0]['item_name']}"
+    return f"Tableau: {len(items)} items were archived"
+
+
+def digest_html(digest:dict) -> str:
+    rows = "".join(
+        f"<tr><td>{html.escape(str(item['item_type']))}</td><td>{html.escape(str(item['item_name']))}</td><td>{html.escape(str(item['tableau_location']))}</td></tr>"
+        for item in digest["items"]
+    )
+    return (
+        fr"""
+        HERE STRUCTURE YOUR EMAIL IN HTML FORMAT
+        <p>Dear {html.escape(str(digest['owner']))},</p>
+        <table>
+            <tr><th>Type</th><th>Name</th><th>Location on Tableau</th></tr>
+            {rows}
+        </table>
+        """
+    )
+
+
+def digest_message(digest:dict, sender:str) -> EmailMessage:
+    message = EmailMessage()
+    message["Subject"] = digest_subject(digest)
+    message["From"] = sender
+    message["To"] = digest["email"]
+    message.set_content("\n".join(f"{item['item_type']} - {item['item_name']} ({item['tableau_location']})" for item in digest["items"]))
+    message.add_alternative(digest_html(digest), subtype="html")
+    for item in digest["items"]:
+        with open(item["attachment_location"], "rb") as f:
+            message.add_attachment(f.read(), maintype="application", subtype="zip", filename=item["attachment_name"])
+    return message
+
+
+class OutlookBackend:
+    """
+    Creates the digests as mails in the Outlook of the user running the script, the mails are saved so they can be checked before sending.
+    Outlook is only dispatched when the first digest is delivered, from the thread that delivers the digests.
+    """
+    def __init__(self, sender:str=SENDER):
+        self.sender = sender
+        self._outlook = None
+
+    def open(self) -> None:
+        try:
+            import pythoncom
+            import win32com.client as win32
+        except ModuleNotFoundError:
+            raise ModuleNotFoundError("The outlook notification backend requires pywin32 (Windows only), use the smtp or maildir backend instead") from None
+        # COM has to be initialized in every thread that uses it
+        pythoncom.CoInitialize()
+        try:
+            self._outlook = win32.Dispatch('outlook.application')
+        except Exception:
+            raise Exception("Please open outlook") from None
+
+    def send(self, digest:dict) -> None:
+        mail = self._outlook.CreateItem(0)
+        mail.Subject = digest_subject(digest)
+        mail.SentOnBehalfOfName = self.sender
+        mail.to = digest["email"]
+        mail.HTMLBody = digest_html(digest)
+
+        # Outlook names attachments after the file, so they are copied under their original name first
+        with tempfile.TemporaryDirectory() as folder:
+            for i, item in enumerate(digest["items"]):
+                attachment = os.path.join(folder, str(i), item["attachment_name"])
+                os.makedirs(os.path.dirname(attachment))
+                shutil.copyfile(item["attachment_location"], attachment)
+                mail.Attachments.Add(os.path.abspath(attachment))
+            mail.Save()
+
+    def close(self) -> None:
+        if self._outlook is not None:
+            import pythoncom
+            self._outlook = None
+            pythoncom.CoUninitialize()
+
+
+class SmtpBackend:
+    """
+    Sends the digests over SMTP. starttls=None encrypts the connection whenever a username is given,
+    so the credentials are never sent in plain text unless starttls=False is asked for.
+    """
+    def __init__(self, host:str, port:int=25, sender:str=SENDER, username:str=None, password:str=None, starttls:bool=None):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = bool(username) if starttls is None else starttls
+        self._smtp = None
+
+    def open(self) -> None:
+        self._smtp = smtplib.SMTP(self.host, self.port)
+        if self.starttls:
+            # the default context verifies the certificate of the server
+            self._smtp.starttls(context=ssl.create_default_context())
+        if self.username:
+            self._smtp.login(self.username, self.password)
+
+    def send(self, digest:dict) -> None:
+        self._smtp.send_message(digest_message(digest, self.sender))
+
+    def close(self) -> None:
+        if self._smtp is not None:
+            self._smtp.quit()
+            self._smtp = None
+
+
+class MaildirBackend:
+    """
+    Writes the digests to a local maildir instead of sending them, useful to test or review the mails.
+    """
+    def __init__(self, folder:str, sender:str=SENDER):
+        self.folder = folder
+        self.sender = sender
+        self._maildir = None
+
+    def open(self) -> None:
+        self._maildir = mailbox.Maildir(self.folder, create=True)
+
+    def send(self, digest:dict) -> None:
+        self._maildir.add(digest_message(digest, self.sender))
+
+    def close(self) -> None:
+        self._maildir = None
+
+
+NOTIFICATION_BACKENDS = {
+    "outlook": OutlookBackend,
+    "smtp": SmtpBackend,
+    "maildir": MaildirBackend
+}
+
+
+class Notifier:
+    """
+    Groups the notifications per owner (email) into one digest and delivers the digests on a background thread,
+    so the archive pipeline never waits for the mail backend.
+    The number of items of an owner is announced with expect, its digest is delivered as soon as all of them were added
+    (or skipped). seal delivers the digests that are left and waits until everything was delivered.
+    on_sent is called with every digest that was delivered.
+    """
+    def __init__(self, backend, on_sent=None):
+        self.backend = backend
+        self.on_sent = on_sent
+        self.errors = []
+        self._lock = threading.Lock()
+        self._expected = {}
+        self._digests = {}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._deliver, name="notifier", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.seal()
+
+    def expect(self, email:str, count:int=1) -> None:
+        with self._lock:
+            self._expected[email] = self._expected.get(email, 0) + count
+
+    def add(self, email:str, owner:str, item:dict) -> None:
+        with self._lock:
+            digest = self._digests.setdefault(email, {"email": email, "owner": owner, "items": []})
+            digest["items"].append(item)
+            self._queue_if_complete(email)
+
+    def skip(self, email:str) -> None:
+        # an expected item that will not be added, e.g. because archiving it failed
+        with self._lock:
+            self._expected[email] = self._expected.get(email, 0) - 1
+            self._queue_if_complete(email)
+
+    def _queue_if_complete(self, email:str) -> None:
+        digest = self._digests.get(email)
+        if digest is not None and len(digest["items"]) >= self._expected.get(email, 0):
+            self._queue.put(self._digests.pop(email))
+            self._expected.pop(email, None)
+
+    def seal(self) -> list:
+        """
+        Delivers the remaining digests, waits for the background thread and returns the digests that could not be delivered.
+        """
+        if self._thread.is_alive():
+            with self._lock:
+                for email in list(self._digests):
+                    self._queue.put(self._digests.pop(email))
+                self._expected = {}
+            self._queue.put(None)
+            self._thread.join()
+        return self.errors
+
+    def _deliver(self) -> None:
+        try:
+            self.backend.open()
+        except Exception as err:
+            print(f"The notification backend could not be opened, no mails will be delivered:\n{err}")
+            opened = False
+        else:
+            opened = True
+
+        while True:
+            digest = self._queue.get()
+            if digest is None:
+                break
+            if not opened:
+                self.errors.append(digest)
+                continue
+            try:
+                with instrumentation.stage("mail"):
+                    self.backend.send(digest)
+                instrumentation.count("mails sent")
+                if self.on_sent is not None:
+                    self.on_sent(digest)
+            except Exception as err:
+                print(f"The mail to {digest['email']} could not be delivered:\n{err}")
+                self.errors.append(digest)
+
+        if opened:
+            self.backend.close()
@@ -0,0 +1,269 @@
+import os
+import importlib.util
+
+__all__ = ["OUTPUT_FORMATS", "DEFAULT_OUTPUT_FORMAT", "output_format_error", "open_sink", "read_tables", "ExcelSink", "CsvSink", "ParquetSink", "FeatherSink"]
+
+DEFAULT_OUTPUT_FORMAT = "xlsx"
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_SHEET_NAME_LENGTH = 31
+EXCEL_CHUNK_SIZE = 50000  # rows that are converted to python values at once
+PYARROW_MISSING = "Saving results as parquet or feather requires pyarrow, install it with 'pip install pyarrow'"
+
+
+def excel_sheet_names(tables) -> dict:
+    """
+    Excel only allows sheet names of at most 31 characters, so every table is named after the last part of its path.
+    Duplicate names are made unique by adding a number.
+    """
+    sheet_names = {}
+    for table in tables:
+        name = table.split("_")[-1][:EXCEL_MAX_SHEET_NAME_LENGTH]
+        sheet_name, i = name, 2
+        while sheet_name in sheet_names.values():
+            sheet_name = f"{name[:EXCEL_MAX_SHEET_NAME_LENGTH - len(str(i)) - 1]}_{i}"
+            i += 1
+        sheet_names[table] = sheet_name
+    return sheet_names
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+        return pyarrow
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError(PYARROW_MISSING) from None
+
+
+class OutputSink:
+    """
+    Writes dataframes chunk by chunk to one or more tables of an output, so results never have to be held in memory at once.
+    The main table (table=None) is saved as {name}.{extension}, other tables as {name}_{table}.{extension}.
+    A table continues in a new part (e.g. {name}_2.csv) when a chunk does not fit the current part.
+    When columns are given, every chunk of the main table is reindexed to them, so it never continues in a new part for its columns.
+    """
+    extension = None
+
+    def __init__(self, folder:str, name:str, columns:list=None):
+        self.folder = folder
+        self.name = name
+        self.columns = columns
+        self._parts = {}  # the part that is currently written for every table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def path(self, table=None, number:int=1) -> str:
+        name = self.name if table is None else f"{self.name}_{table}"
+        name = name if number == 1 else f"{name}_{number}"
+        return os.path.join(self.folder, f"{name}.{self.extension}")
+
+    def write(self, df, table=None) -> None:
+        df = self._fixed_columns(df, table)
+        part = self._parts.get(table)
+        if part is None:
+            part = self._new_part(table, df, 1)
+        elif not self._accepts(part, df):
+            self._close_part(part)
+            part = self._new_part(table, df, part["number"] + 1)
+        self._write_part(part, df.reindex(columns=part["columns"]))
+        part["rows"] += len(df)
+
+    def close(self) -> None:
+        for part in self._parts.values():
+            self._close_part(part)
+        self._parts = {}
+
+    def _fixed_columns(self, df, table):
+        return df.reindex(columns=self.columns) if table is None and self.columns is not None else df
+
+    def _new_part(self, table, df, number:int) -> dict:
+        part = self._parts[table] = {"table": table, "number": number, "columns": list(df.columns), "rows": 0}
+        part["writer"] = self._open_part(part, df)
+        return part
+
+    def _accepts(self, part, df) -> bool:
+        # columns that were not in the first chunk of a part can not be added to it anymore
+        return all(column in part["columns"] for column in df.columns)
+
+    def _open_part(self, part, df):
+        raise NotImplementedError
+
+    def _write_part(self, part, df) -> None:
+        raise NotImplementedError
+
+    def _close_part(self, part) -> None:
+        pass
+
+
+class ExcelSink(OutputSink):
+    """
+    Streams rows into a write-only openpyxl workbook, which keeps memory flat. Every table is a sheet and
+    a sheet continues on a new sheet (e.g. Tableau_permissions_2) when it reaches the Excel row limit.
+    """
+    extension = "xlsx"
+
+    def __init__(self, folder:str, name:str, sheet_name:str=None, columns:list=None):
+        super().__init__(folder, name, columns=columns)
+        from openpyxl import Workbook
+        self.sheet_name = sheet_name or name
+        self._workbook = Workbook(write_only=True)
+        self._sheet_names = {}
+
+    def path(self, table=None, number:int=1) -> str:
+        return os.path.join(self.folder, f"{self.name}.{self.extension}")
+
+    def write(self, df, table=None) -> None:
+        # chunks that do not fit on the current sheet are split over the next sheets
+        df = self._fixed_columns(df, table)
+        part = self._parts.get(table)
+        space = EXCEL_MAX_ROWS - 1 - part["rows"] if part and super()._accepts(part, df) else EXCEL_MAX_ROWS - 1
+        while len(df) > space:
+            if space:
+                super().write(df.iloc[:space], table)
+            df, space = df.iloc[space:], EXCEL_MAX_ROWS - 1
+            self._parts[table]["rows"] = EXCEL_MAX_ROWS  # the next rows have to start a new sheet
+        super().write(df, table)
+
+    def _accepts(self, part, df) -> bool:
+        return super()._accepts(part, df) and part["rows"] + len(df) < EXCEL_MAX_ROWS
+
+    def _sheet_name(self, table, number:int) -> str:
+        if table not in self._sheet_names:
+            # names of earlier tables do not change when new tables are added
+            tables = [name for name in [*self._sheet_names, table] if name is not None]
+            self._sheet_names = {None: self.sheet_name[:EXCEL_MAX_SHEET_NAME_LENGTH], **excel_sheet_names(tables)}
+        name = self._sheet_names[table]
+        return name if number == 1 else f"{name[:EXCEL_MAX_SHEET_NAME_LENGTH - len(str(number)) - 1]}_{number}"
+
+    def _open_part(self, part, df):
+        worksheet = self._workbook.create_sheet(self._sheet_name(part["table"], part["number"]))
+        worksheet.append([str(column) for column in df.columns])
+        return worksheet
+
+    def _write_part(self, part, df) -> None:
+        for start in range(0, len(df), EXCEL_CHUNK_SIZE):
+            chunk = df.iloc[start:start + EXCEL_CHUNK_SIZE]
+            for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+                # nested values that could not be unpacked are written as text
+                part["writer"].append([str(value) if isinstance(value, (dict, list)) else value for value in row])
+
+    def close(self) -> None:
+        if self._parts:
+            self._workbook.save(self.path())
+        self._parts = {}
+
+
+class CsvSink(OutputSink):
+    extension = "csv"
+
+    def _open_part(self, part, df):
+        path = self.path(part["table"], part["number"])
+        df.iloc[:0].to_csv(path, index=False)
+        return path
+
+    def _write_part(self, part, df) -> None:
+        df.to_csv(part["writer"], mode="a", header=False, index=False)
+
+
+class _ArrowSink(OutputSink):
+    """
+    Base class of the pyarrow based sinks. The schema of a part is taken from its first chunk,
+    a chunk that can not be converted to that schema continues in a new part.
+    """
+    compression = "zstd"
+
+    def __init__(self, folder:str, name:str, columns:list=None):
+        super().__init__(folder, name, columns=columns)
+        self._pa = _import_pyarrow()
+
+    def write(self, df, table=None) -> None:
+        df = self._fixed_columns(df, table)
+        try:
+            super().write(df, table)
+        except (self._pa.ArrowInvalid, self._pa.ArrowTypeError):
+            part = self._parts[table]
+            self._close_part(part)
+            part = self._new_part(table, df, part["number"] + 1)
+            self._write_part(part, df)
+            part["rows"] += len(df)
+
+    def _open_part(self, part, df):
+        schema = self._pa.Schema.from_pandas(df, preserve_index=False)
+        # columns without any value in the first chunk are typed as text instead of null
+        part["schema"] = self._pa.schema([field.with_type(self._pa.string()) if self._pa.types.is_null(field.type) else field for field in schema])
+        return self._new_writer(self.path(part["table"], part["number"]), part["schema"])
+
+    def _write_part(self, part, df) -> None:
+        part["writer"].write_table(self._pa.Table.from_pandas(df, schema=part["schema"], preserve_index=False))
+
+    def _close_part(self, part) -> None:
+        part["writer"].close()
+
+
+class ParquetSink(_ArrowSink):
+    extension = "parquet"
+
+    def _new_writer(self, path, schema):
+        return self._pa.parquet.ParquetWriter(path, schema, compression=self.compression)
+
+
+class FeatherSink(_ArrowSink):
+    extension = "feather"
+
+    def _new_writer(self, path, schema):
+        # feather (version 2) is the arrow IPC file format, which can be written batch by batch
+        return self._pa.ipc.new_file(path, schema, options=self._pa.ipc.IpcWriteOptions(compression=self.compression))
+
+
+OUTPUT_FORMATS = {
+    "xlsx": ExcelSink,
+    "csv": CsvSink,
+    "parquet": ParquetSink,
+    "feather": FeatherSink
+}
+
+
+def output_format_error(output_format:str) -> str:
+    """
+    Returns why output_format can not be written in this python environment, or None when it can.
+    The scripts check this while parsing their arguments, so a missing pyarrow is reported before anything runs.
+    """
+    sink = OUTPUT_FORMATS.get(output_format)
+    if sink is not None and issubclass(sink, _ArrowSink) and importlib.util.find_spec("pyarrow") is None:
+        return PYARROW_MISSING
+    return None
+
+
+def open_sink(output_format:str, folder:str, name:str, sheet_name:str=None, columns:list=None) -> OutputSink:
+    """
+    Returns the sink that writes {name}.{output_format} in folder, sheet_name is only used by Excel.
+    columns fixes the columns of the main table, e.g. to the selection_columns of a query.
+    """
+    sink = OUTPUT_FORMATS.get(output_format)
+    if sink is None:
+        raise NotImplementedError(f"The output format {output_format} has not yet been implemented. Implemented formats: {list(OUTPUT_FORMATS)}")
+    if sink is ExcelSink:
+        return ExcelSink(folder, name, sheet_name=sheet_name, columns=columns)
+    return sink(folder, name, columns=columns)
+
+
+def read_tables(path:str) -> dict:
+    """
+    Reads an output file back as {table: dataframe}. Every sheet of an Excel file is a table (named after the sheet),
+    the other formats hold a single table (None).
+    """
+    import pandas as pd # the sinks write the dataframes they are given, only reading needs pandas itself
+    extension = os.path.splitext(path)[1].lstrip(".")
+    if extension == "xlsx":
+        return pd.read_excel(path, sheet_name=None)
+    if extension == "csv":
+        return {None: pd.read_csv(path, low_memory=False)}
+    if extension in ("parquet", "feather"):
+        _import_pyarrow()
+        return {None: pd.read_parquet(path) if extension == "parquet" else pd.read_feather(path)}
+    raise NotImplementedError(f"The output format {extension} has not yet been implemented. Implemented formats: {list(OUTPUT_FORMATS)}")
@@ -0,0 +1,57 @@
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .instrumentation import instrumentation
+
+__all__ = ["fetch_permissions", "PERMISSION_ENDPOINTS", "DEFAULT_PERMISSION_OBJECTS", "DEFAULT_MAX_WORKERS"]
+
+DEFAULT_MAX_WORKERS = 8
+
+# the TableauServerConnection method used to retrieve the permissions of each item type
+PERMISSION_ENDPOINTS = {
+    "project": "query_project_permissions",
+    "workbook": "query_workbook_permissions",
+    "datasource": "query_data_source_permissions",
+    "flow": "query_flow_permissions",
+}
+
+# the permissions object of query_default_permissions for every item type that has default permissions on a project
+# jobs of type default_{item type} retrieve these default permissions of a project instead of the permissions of an item
+DEFAULT_PERMISSION_OBJECTS = {
+    "workbook": "workbooks",
+    "datasource": "datasources",
+    "flow": "flows",
+}
+
+
+def fetch_permissions(conn, jobs, max_workers:int=DEFAULT_MAX_WORKERS) -> list:
+    """
+    Retrieves the grantee capabilities of every (item_type, item_id) pair in jobs using a bounded thread pool.
+    An item_type default_{item type} (e.g. default_workbook) retrieves the default permissions of the project item_id.
+    The results are returned in the same order as the jobs, so they can be zipped back onto the items.
+    """
+    implemented_types = [*PERMISSION_ENDPOINTS, *[f"default_{item_type}" for item_type in DEFAULT_PERMISSION_OBJECTS]]
+    for item_type, _ in jobs:
+        if item_type not in implemented_types:
+            raise NotImplementedError(f"Permissions for type {item_type} have not yet been implemented. Implemented types: {implemented_types}")
+
+    local = threading.local()
+
+    def worker_connection():
+        # TableauServerConnection stores the active endpoint on the instance, so sharing one instance between threads
+        # would mix up the urls. Every thread gets its own shallow copy that shares the signed in auth token.
+        if not hasattr(local, "conn"):
+            local.conn = copy.copy(conn)
+        return local.conn
+
+    def fetch(job):
+        item_type, item_id = job
+        with instrumentation.stage("permission fetch per item"):
+            if item_type.startswith("default_"):
+                response = worker_connection().query_default_permissions(item_id, DEFAULT_PERMISSION_OBJECTS[item_type[len("default_"):]])
+            else:
+                response = getattr(worker_connection(), PERMISSION_ENDPOINTS[item_type])(item_id)
+            return response.json().get("permissions").get("granteeCapabilities")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fetch, jobs))
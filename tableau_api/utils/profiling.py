@@ -0,0 +1,135 @@
+import os, sys
+import io
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+from .instrumentation import instrumentation
+
+__all__ = ["profiled", "PROFILE_FOLDER_NAME"]
+
+PROFILE_FOLDER_NAME = "profile"
+HOT_FUNCTIONS = 15 # functions in the printed summary, the profile file holds all of them
+TOP_ALLOCATORS = 25 # lines in the memory report
+TRACEBACK_LIMIT = 10 # frames kept per allocation, more frames make tracing slower
+SNAPSHOT_GROWTH = 1.1 # a new snapshot is only taken when the traced memory grew by 10% since the largest snapshot
+
+
+def _short_path(file_name:str) -> str:
+    # site-packages/pandas/core/frame.py -> pandas/core/frame.py
+    parts = file_name.replace("\\", "/").split("/")
+    for marker in ("site-packages", "tableau_api"):
+        if marker in parts:
+            return "/".join(parts[len(parts) - parts[::-1].index(marker):])
+    return "/".join(parts[-2:])
+
+
+def hot_functions(stats:pstats.Stats, top:int=HOT_FUNCTIONS) -> str:
+    """
+    The functions that take the most time themselves, with the number of calls and the time including the functions they call.
+    """
+    rows = sorted(stats.stats.items(), key=lambda item: -item[1][2])[:top]
+    lines = [f"{'own seconds':>12}{'total seconds':>15}{'calls':>12}  function"]
+    for (file_name, line, function), (_, calls, own_time, total_time, _) in rows:
+        location = f"{_short_path(file_name)}:{line}" if line else file_name
+        lines.append(f"{own_time:>12.3f}{total_time:>15.3f}{calls:>12}  {function} ({location})")
+    return "\n".join(lines)
+
+
+class MemorySnapshots:
+    """
+    Keeps the snapshot of the moment the most memory was allocated, taken at the start and end of the stages of the run report.
+    A snapshot at the end of the run only shows what is still allocated, the dataframes of a stage are freed by then.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.snapshot, self.size, self.stage = None, 0, None
+
+    def __call__(self, stage:str=None) -> None:
+        # stage None is the end of the run
+        if tracemalloc.get_traced_memory()[0] < self.size * SNAPSHOT_GROWTH:
+            return
+        with self._lock:
+            size = tracemalloc.get_traced_memory()[0]
+            if size < self.size * SNAPSHOT_GROWTH:
+                return
+            snapshot = tracemalloc.take_snapshot()
+            self.snapshot, self.size, self.stage = snapshot, size, stage
+
+
+@contextlib.contextmanager
+def profiled(folder:str, name:str, memory:bool=False):
+    """
+    Profiles the code in the with block and saves the profile in the profile folder of folder: {name}-{time}.prof can be
+    opened with pstats or snakeviz, {name}-{time}.txt holds the full listing. Threads started in the block are profiled as well.
+    With memory, the allocations are traced and the lines that held the most memory at the stage boundary with the most memory
+    allocated are saved in {name}-{time}-memory.txt.
+    """
+    profilers, lock = [], threading.Lock()
+
+    def profile_thread(*args):
+        # called on the first event of every new thread, which from then on is profiled by its own profiler
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with lock:
+            profilers.append(profiler)
+        profiler.enable()
+
+    snapshots = MemorySnapshots() if memory else None
+    if memory:
+        tracemalloc.start(TRACEBACK_LIMIT)
+        instrumentation.listeners.append(snapshots)
+    profiler = cProfile.Profile()
+    # since python 3.12 the profiler sees every thread by itself
+    if sys.version_info < (3, 12):
+        threading.setprofile(profile_thread)
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        peak = None
+        if memory:
+            instrumentation.listeners.remove(snapshots)
+            snapshots()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        _save(folder, name, profiler, profilers, snapshots, peak)
+
+
+def _save(folder:str, name:str, profiler:cProfile.Profile, thread_profilers:list, snapshots:MemorySnapshots, peak:int) -> None:
+    profile_folder = os.path.join(folder, PROFILE_FOLDER_NAME)
+    os.makedirs(profile_folder, exist_ok=True)
+    path = os.path.join(profile_folder, f"{name}-{time.strftime('%Y-%m-%d-%HH-%MM-%SS')}")
+
+    stats = pstats.Stats(profiler)
+    for thread_profiler in thread_profilers:
+        stats.add(thread_profiler)
+    stats.dump_stats(f"{path}.prof")
+    listing = io.StringIO()
+    stats.stream = listing
+    stats.sort_stats("cumulative").print_stats()
+    with open(f"{path}.txt", "w") as f:
+        f.write(hot_functions(stats, top=50) + "\n\n" + listing.getvalue())
+
+    print(f"\nHot functions ({stats.total_tt:.1f} seconds profiled over {len(thread_profilers) + 1} threads):")
+    print(hot_functions(stats))
+    print(f"The profile is saved at {path}.prof")
+
+    if snapshots is not None and snapshots.snapshot is not None:
+        moment = f"{snapshots.size / 1024 / 1024:.1f} MB allocated at " + (f"the start or end of the stage {snapshots.stage}" if snapshots.stage else "the end of the run")
+        with open(f"{path}-memory.txt", "w") as f:
+            f.write(f"peak traced memory: {peak / 1024 / 1024:.1f} MB\nlargest snapshot: {moment}\n\n")
+            for statistic in snapshots.snapshot.statistics("traceback")[:TOP_ALLOCATORS]:
+                f.write(f"{statistic.size / 1024 / 1024:.1f} MB in {statistic.count} blocks\n")
+                f.write("\n".join(statistic.traceback.format()) + "\n\n")
+        # the memory that was allocated when the most memory was allocated, by the line that allocated it
+        print(f"\nTop allocators ({moment}, peak traced memory {peak / 1024 / 1024:.1f} MB):")
+        for statistic in snapshots.snapshot.statistics("lineno")[:10]:
+            frame = statistic.traceback[0]
+            print(f"{statistic.size / 1024:>12.1f} KB  {_short_path(frame.filename)}:{frame.lineno}")
+        print(f"The memory report is saved at {path}-memory.txt")
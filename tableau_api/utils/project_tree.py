@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+__all__ = ["ProjectTree"]
+
+
+class ProjectTree:
+    """
+    Index of the project hierarchy that resolves the root project, depth and path of all projects at once.
+    Every project points to the position of its parent. These pointers are doubled until they reach the root,
+    which takes log2(depth) vectorized steps instead of one lookup per project per level.
+    The path is built the same way as the "project path" of the unused items queries: root/.../project.
+    """
+    def __init__(self, ids, parent_ids, names):
+        self.ids = pd.Index(ids)
+        if not self.ids.is_unique:
+            raise ValueError("Project ids must be unique to build a ProjectTree")
+
+        # projects without a parent (or with a parent that is not known) are root projects
+        parents = self.ids.get_indexer(pd.Index(parent_ids))
+        positions = np.arange(len(self.ids))
+        is_root = parents < 0
+
+        pointers = np.where(is_root, positions, parents)
+        depths = np.where(is_root, 0, 1)
+        for _ in range(len(self.ids).bit_length() + 1):
+            if (pointers[pointers] == pointers).all():
+                break
+            # the distance to the ancestor of the ancestor is added before jumping to it
+            depths = depths + depths[pointers]
+            pointers = pointers[pointers]
+        else:
+            raise ValueError("The project hierarchy contains a cycle")
+
+        # paths are built level by level, so the path of the parent is always known
+        names = np.array([str(name) for name in names], dtype=object)
+        paths = names.copy()
+        for depth in range(1, depths.max(initial=0) + 1):
+            level = np.flatnonzero(depths == depth)
+            paths[level] = paths[parents[level]] + "/" + names[level]
+
+        self._roots = self.ids[pointers]
+        self._depths = depths
+        self._paths = paths
+
+    @classmethod
+    def from_dataframe(cls, df, id_column="id", parent_column="parentProjectId", name_column="name"):
+        return cls(df[id_column], df[parent_column], df[name_column])
+
+    def _lookup(self, values, project_ids) -> pd.Series:
+        # unknown project ids result in a missing value
+        index = project_ids.index if isinstance(project_ids, pd.Series) else None
+        positions = self.ids.get_indexer(pd.Index(project_ids))
+        found = pd.Series(np.asarray(values, dtype=object)[positions], index=index)
+        return found.where(positions >= 0, None)
+
+    def root(self, project_ids) -> pd.Series:
+        return self._lookup(self._roots, project_ids)
+
+    def depth(self, project_ids) -> pd.Series:
+        """
+        The root project has depth 0, this is one lower than the level of the SQL queries.
+        """
+        return self._lookup(self._depths, project_ids)
+
+    def path(self, project_ids) -> pd.Series:
+        return self._lookup(self._paths, project_ids)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "project id": self.ids,
+            "root project id": self._roots,
+            "depth": self._depths,
+            "project path": self._paths
+        })
@@ -0,0 +1,149 @@
+import re
+import time
+import random
+import datetime
+import threading
+import email.utils
+import requests
+
+__all__ = ["RetryPolicy", "AdaptiveLimiter", "RETRY_POLICIES", "DEFAULT_RETRY_POLICY", "request_limiter", "retry_policy", "send_with_retry"]
+
+THROTTLE_STATUS_CODES = (429, 503) # the server refused the request before handling it, it is always safe to send it again
+TRANSIENT_STATUS_CODES = (500, 502, 504) # the request may have been handled, only idempotent requests are sent again
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+
+class RetryPolicy:
+    """
+    How often a request is sent again and how long is waited in between: attempt n waits a random time up to
+    backoff * 2 ** n seconds (at most max_backoff), or longer when the server asks so with Retry-After.
+    idempotent=True also sends requests with other methods again after a transient error (e.g. the POST of a GraphQL query).
+    """
+    def __init__(self, retries:int=4, backoff:float=1.0, max_backoff:float=60.0, idempotent:bool=False):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idempotent = idempotent
+
+    def should_retry(self, method:str, status_code:int=None) -> bool:
+        # status_code None means the connection failed or timed out
+        if status_code in THROTTLE_STATUS_CODES:
+            return True
+        if status_code is None or status_code in TRANSIENT_STATUS_CODES:
+            return self.idempotent or method.upper() in IDEMPOTENT_METHODS
+        return False
+
+    def wait_time(self, attempt:int, response=None) -> float:
+        # full jitter, so threads that were throttled together do not come back together
+        wait = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+        return max(wait, retry_after) if retry_after is not None else wait
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+# the policy of the first pattern that matches the url is used
+RETRY_POLICIES = [
+    (re.compile(r"/auth/signin$"), RetryPolicy(retries=2, backoff=2.0, idempotent=True)),
+    (re.compile(r"/metadata/graphql$"), RetryPolicy(retries=6, backoff=2.0, max_backoff=120.0, idempotent=True)), # queries only read
+    (re.compile(r"/content(\?.*)?$"), RetryPolicy(retries=3, backoff=5.0, max_backoff=120.0)), # downloads are large, retrying them is expensive
+    (re.compile(r"/permissions$"), RetryPolicy(retries=5, backoff=1.0)),
+]
+
+
+def retry_policy(url:str) -> RetryPolicy:
+    for pattern, policy in RETRY_POLICIES:
+        if pattern.search(url):
+            return policy
+    return DEFAULT_RETRY_POLICY
+
+
+def parse_retry_after(value:str):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of requests that are sent at the same time. The limit is halved when the server throttles
+    and grows by one after limit successful requests, so it settles just below what the server accepts.
+    Only requests that were sent after the last decrease can halve the limit again, so a burst of requests
+    that were throttled together counts once.
+    """
+    def __init__(self, initial:int=8, minimum:int=1, maximum:int=32):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._sent = 0
+        self._decreased_at = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> int:
+        # returns the number of the request, which is passed to throttled
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            self._sent += 1
+            return self._sent
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def succeeded(self) -> None:
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def throttled(self, request:int) -> None:
+        with self._condition:
+            if request > self._decreased_at:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._decreased_at = self._sent
+                print(f"The Tableau server is throttling, at most {int(self.limit)} requests are sent at the same time")
+
+
+request_limiter = AdaptiveLimiter()
+
+
+def send_with_retry(send, method:str, url:str, limiter:AdaptiveLimiter=request_limiter, **kwargs) -> requests.Response:
+    """
+    Sends the request with send(method, url, **kwargs) within the concurrency limit and sends it again according to
+    the retry policy of the url. The last response is returned (or the last connection error raised) when all retries failed.
+    """
+    policy = retry_policy(url)
+    for attempt in range(policy.retries + 1):
+        response = None
+        request = limiter.acquire()
+        try:
+            response = send(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == policy.retries or not policy.should_retry(method):
+                raise
+        else:
+            if response.status_code in THROTTLE_STATUS_CODES:
+                limiter.throttled(request)
+            elif response.status_code < 400:
+                limiter.succeeded()
+            if attempt == policy.retries or not policy.should_retry(method, response.status_code):
+                return response
+            response.close()
+        finally:
+            limiter.release()
+
+        wait = policy.wait_time(attempt, response)
+        print(f"{method} {url} failed ({response.status_code if response is not None else 'connection error'}), retrying in {wait:.1f} seconds...")
+        time.sleep(wait)
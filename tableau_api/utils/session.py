@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from .retry import send_with_retry
+from .instrumentation import instrumentation
+
+__all__ = ["http_session", "install_http_session", "tableau_requests", "TokenCache", "repository_engine", "discard_repository_engine", "HTTP_POOL_SIZE", "TOKEN_CACHE_LOCATION", "TOKEN_CACHE_VARIABLE"]
+
+HTTP_POOL_SIZE = 32 # connections kept open per host, at least the number of threads that send requests
+TOKEN_LIFETIME = 200 * 60 # seconds a token is trusted when the server does not tell, sessions last 240 minutes by default
+TOKEN_EXPIRY_MARGIN = 5 * 60 # tokens that expire within this many seconds are not reused
+TOKEN_CACHE_LOCATION = os.path.join(os.path.expanduser("~"), ".tableau_api", "token_cache.json")
+TOKEN_CACHE_VARIABLE = "TABLEAU_TOKEN_CACHE" # the sessions are only kept between runs when this environment variable is 1
+DATABASE_POOL_SIZE = 5
+
+_session = None
+_session_lock = threading.Lock()
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def http_session() -> requests.Session:
+    """
+    Returns the session that is shared by all requests of the process, its connections are kept alive and reused
+    so only the first request to a server pays for the TCP and TLS handshake.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, pool_block=False)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+class TableauRequests:
+    """
+    Stands in for the requests module inside tableau_api_lib, so every request goes through the shared session,
+    within the adaptive concurrency limit and with the retry policy of its endpoint (see retry.py).
+    A request that is refused with 401 is sent once more after the connection that owns the token signed in again.
+    Copies of a connection keep the old token, it is replaced by the renewed token before every request.
+    When a cassette is set (see cassette.py) the responses are recorded in it, or replayed from it instead of sent.
+    """
+    Response = requests.Response
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._connections = {}
+        self._renewed = {}
+        self.cassette = None
+
+    def register(self, conn, before_sign_in=None, on_sign_in=None) -> None:
+        # before_sign_in is called before signing in again (e.g. to ask for the credentials), on_sign_in with the response
+        with self._lock:
+            self._connections[conn.auth_token] = (conn, before_sign_in, on_sign_in)
+
+    def current_token(self, token:str) -> str:
+        with self._lock:
+            while token in self._renewed:
+                token = self._renewed[token]
+        return token
+
+    def _renew(self, token:str):
+        with self._lock:
+            if token in self._renewed:
+                return self.current_token(token)
+            if token not in self._connections:
+                return None
+            conn, before_sign_in, on_sign_in = self._connections[token]
+            print("The Tableau session expired, signing in again...")
+            if before_sign_in is not None:
+                before_sign_in()
+            # sign_in checks the server version first, that request must not be sent with the expired token
+            conn.auth_token = None
+            response = conn.sign_in()
+            if response.status_code != 200:
+                return None
+            self._renewed[token] = conn.auth_token
+            self._connections[conn.auth_token] = self._connections.pop(token)
+            if on_sign_in is not None:
+                on_sign_in(response)
+            return conn.auth_token
+
+    def _send(self, method:str, url:str, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            if self.cassette is not None:
+                response = self.cassette.send(http_session().request, method, url, **kwargs)
+            else:
+                response = http_session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            instrumentation.record_request(method, url, None, time.perf_counter() - start)
+            raise
+        # streamed downloads are not read here, their size is taken from the headers
+        received = int(response.headers.get("Content-Length", 0)) if kwargs.get("stream") else len(response.content)
+        sent = len(response.request.body or b"") if response.request is not None else 0
+        instrumentation.record_request(method, url, response.status_code, time.perf_counter() - start, received, sent)
+        return response
+
+    def request(self, method:str, url:str, headers:dict=None, **kwargs) -> requests.Response:
+        headers = dict(headers or {})
+        token = headers.get("X-Tableau-Auth")
+        if token:
+            headers["X-Tableau-Auth"] = self.current_token(token)
+
+        response = send_with_retry(self._send, method, url, headers=headers, **kwargs)
+        if response.status_code == 401 and token:
+            renewed_token = self._renew(headers["X-Tableau-Auth"])
+            if renewed_token:
+                response.close()
+                headers["X-Tableau-Auth"] = renewed_token
+                response = send_with_retry(self._send, method, url, headers=headers, **kwargs)
+        return response
+
+    def get(self, url:str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url:str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url:str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url:str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+
+tableau_requests = TableauRequests()
+
+
+def install_http_session() -> None:
+    # tableau_api_lib calls requests.get, requests.post, ... of its own module, those calls are routed through tableau_requests
+    from tableau_api_lib import tableau_server_connection
+    tableau_server_connection.requests = tableau_requests
+
+
+class TokenCache:
+    """
+    Keeps the tokens of the Tableau sessions on disk until they expire, so the next run reuses the session instead of signing in.
+    Signing in with a Personal Access Token ends its previous session, reusing the token avoids that as well.
+    The tokens are saved in plain text and only windows lets other users of the machine read the file, so the cache is only used
+    when TABLEAU_TOKEN_CACHE is 1 (or enabled is given). sign_out ends the cached sessions.
+    """
+    def __init__(self, path:str=TOKEN_CACHE_LOCATION, enabled:bool=None):
+        self.path = path
+        self.enabled = os.environ.get(TOKEN_CACHE_VARIABLE) == "1" if enabled is None else enabled
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, key:str):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None or entry["expires_at"] - TOKEN_EXPIRY_MARGIN < time.time():
+            return None
+        return entry
+
+    def store(self, key:str, conn, response=None) -> None:
+        if not self.enabled:
+            return
+        lifetime = TOKEN_LIFETIME
+        if response is not None:
+            # the server tells how long the session lasts as hh:mm:ss since api version 3.x
+            expiration = response.json().get("credentials", {}).get("estimatedTimeToExpiration")
+            if expiration:
+                hours, minutes, seconds = (int(part) for part in expiration.split(":"))
+                lifetime = hours * 3600 + minutes * 60 + seconds
+
+        entry = {
+            "token": conn.auth_token, "site_id": conn.site_id, "user_id": conn.user_id, "expires_at": time.time() + lifetime,
+            "sign_out_url": f"{conn.server}/api/{conn.api_version}/auth/signout"
+        }
+        with self._lock:
+            cache = self._load()
+            cache[key] = entry
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # the token gives access to the site, only the user may read the file
+            temporary_path = f"{self.path}.tmp"
+            with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+                json.dump(cache, f, indent=4)
+            os.replace(temporary_path, self.path)
+
+    def sign_out(self) -> int:
+        """
+        Signs out the cached sessions that did not expire yet and removes the cache, also when the cache is not enabled.
+        Returns the number of sessions that were signed out.
+        """
+        signed_out = 0
+        with self._lock:
+            for key, entry in self._load().items():
+                if entry["expires_at"] < time.time() or "sign_out_url" not in entry:
+                    continue
+                try:
+                    response = http_session().post(entry["sign_out_url"], headers={"X-Tableau-Auth": entry["token"]}, verify=False)
+                    signed_out += response.status_code == 204
+                except requests.RequestException as e:
+                    print(f"The session of {key} could not be signed out: {e}")
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        return signed_out
+
+
+def repository_engine(database:str, credentials=None):
+    """
+    Returns the pooled engine of the repository database, which is created the first time with credentials:
+    a function that returns the connection string. Connections that are returned to the pool are reused by the next connect.
+    """
+    with _engines_lock:
+        if database not in _engines:
+            if credentials is None:
+                return None
+            from sqlalchemy import create_engine # SQLAlchemy is only imported by the scripts that use the repository
+            _engines[database] = create_engine(
+                credentials(),
+                pool_size=DATABASE_POOL_SIZE,
+                pool_pre_ping=True, # connections the server closed in the meantime are replaced instead of failing the query
+                pool_recycle=3600
+            )
+        return _engines[database]
+
+
+def discard_repository_engine(database:str) -> None:
+    # e.g. when the credentials were wrong, the next repository_engine asks for them again
+    with _engines_lock:
+        engine = _engines.pop(database, None)
+    if engine is not None:
+        engine.dispose()
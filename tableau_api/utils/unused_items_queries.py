@@ -1,190 +1,181 @@
-__all__ = ['query_orphan_datasources', 'query_unused_workbooks']
-ORGANISATION_EMAIL_SUFFIX = "@ORGNAME.DOMAIN"
-
-def query_orphan_datasources() -> str: 
-    query = (
-        fr"""
-        WITH RECURSIVE recur_folder_structure AS 
-        (  
-            SELECT s.id AS "project site id",
-                   s.name AS "project site name",
-                   p.id AS "project id",
-                   p.name AS "project name",
-                   p.id AS "root project id",
-                   p.name AS "root project name",
-                   p.special AS "special",
-                   1 AS level
-            FROM public.projects p
-            JOIN public.sites s on p.site_id = s.id
-        UNION
-            SELECT s.id AS "project site id",
-                   s.name AS "project site name",
-                   p.id AS "project id",
-                   p.name AS "project name",
-                   COALESCE(recur_folder_structure."root project id", p.id) AS "root project id",
-                   COALESCE(recur_folder_structure."root project name", p.name) AS "root project name",
-                   p."special",
-                   recur_folder_structure.level + 1 AS level
-            FROM public.projects p
-            JOIN public.sites s on p.site_id = s.id
-            JOIN recur_folder_structure ON p.parent_project_id = recur_folder_structure."project id"
-        ), project_path AS
-        (
-            SELECT "project site id",
-                   "project site name",
-                   "project id",
-                   "project name",
-                   STRING_AGG("root project name",'/' ORDER BY level DESC) AS "project path",
-                   MAX(special) AS special,
-                   MAX(level) AS level    
-            FROM recur_folder_structure
-            GROUP BY "project site id",
-                     "project site name",
-                     "project id",
-                     "project name"
-        ), folder_structure AS 
-        (
-            SELECT pp."project site id",
-                   pp."project site name",
-                   pp."project id",
-                   pp."project name",
-                   "root project id",
-                   "root project name",
-                   pp."project path",
-            FROM project_path pp
-            JOIN recur_folder_structure rfs
-            ON pp."project site id" = rfs."project site id"
-            AND pp."project site name" = rfs."project site name"
-            AND pp."project id" = rfs."project id"
-            AND pp."project name" = rfs."project name"
-            AND pp.level = rfs.level
-        ), NO_DELETE AS
-        (
-        SELECT DISTINCT
-            COALESCE(v.workbook_id, tt.taggable_id)         AS tag_item_id,
-            CASE tt.taggable_type                               
-                WHEN 'View' THEN 'Workbook'
-                ELSE tt.taggable_type
-            END                                             AS tag_item_type,
-            t.name                                          AS tag_value
-        FROM tags t
-        JOIN taggings tt on t.id = tt.tag_id
-        LEFT JOIN views v on tt.taggable_id = v.id AND tt.taggable_type = 'View'
-        WHERE t.name = 'NO_DELETE'
-        )
-        SELECT 
-            ds.luid as id,
-            fs."project site name", 
-            fs."project path",
-            ds.name as "data source name", 
-            u.friendly_name as owner,
-            lower(u.name)||'{ORGANISATION_EMAIL_SUFFIX}' as email,
-            ds.last_published_at
-        FROM datasources ds
-        JOIN folder_structure fs ON ds.project_id = fs."project id"
-        LEFT JOIN _users u ON ds.owner_id = u.id
-        LEFT JOIN data_connections dc ON ds.repository_url = dc.dbname
-        LEFT JOIN NO_DELETE nd ON nd.tag_item_id = ds.id AND nd.tag_item_type = 'Datasource'
-        WHERE ds.parent_type is null
-        AND nd.tag_value IS NULL
-        AND dc.id is null
-        AND ds.last_published_at <= NOW() - INTERVAL '120 days' 
-        """
-    )
-    return query
-    
-def query_unused_workbooks() -> str:
-    query = (
-        fr"""
-        WITH RECURSIVE recur_folder_structure AS 
-        (  
-            SELECT s.id AS "project site id",
-                   s.name AS "project site name",
-                   p.id AS "project id",
-                   p.name AS "project name",
-                   p.id AS "root project id",
-                   p.name AS "root project name",
-                   p.special AS "special",
-                   1 AS level
-            FROM public.projects p
-            JOIN public.sites s on p.site_id = s.id
-        UNION
-            SELECT s.id AS "project site id",
-                   s.name AS "project site name",
-                   p.id AS "project id",
-                   p.name AS "project name",
-                   COALESCE(recur_folder_structure."root project id", p.id) AS "root project id",
-                   COALESCE(recur_folder_structure."root project name", p.name) AS "root project name",
-                   p."special",
-                   recur_folder_structure.level + 1 AS level
-            FROM public.projects p
-            JOIN public.sites s on p.site_id = s.id
-            JOIN recur_folder_structure ON p.parent_project_id = recur_folder_structure."project id"
-        ), project_path AS
-        (
-            SELECT "project site id",
-                   "project site name",
-                   "project id",
-                   "project name",
-                   STRING_AGG("root project name",'/' ORDER BY level DESC) AS "project path",
-                   MAX(special) AS special,
-                   MAX(level) AS level    
-            FROM recur_folder_structure
-            GROUP BY "project site id",
-                     "project site name",
-                     "project id",
-                     "project name"
-        ), folder_structure AS 
-        (
-            SELECT pp."project site id",
-                   pp."project site name",
-                   pp."project id",
-                   pp."project name",
-                   "root project id",
-                   "root project name",
-                   pp."project path",
-            FROM project_path pp
-            JOIN recur_folder_structure rfs
-            ON pp."project site id" = rfs."project site id"
-            AND pp."project site name" = rfs."project site name"
-            AND pp."project id" = rfs."project id"
-            AND pp."project name" = rfs."project name"
-            AND pp.level = rfs.level
-        ), NO_DELETE AS
-        (
-            SELECT DISTINCT
-                COALESCE(v.workbook_id, tt.taggable_id)         AS tag_item_id,
-                CASE tt.taggable_type                               
-                    WHEN 'View' THEN 'Workbook'
-                    ELSE tt.taggable_type
-                END                                             AS tag_item_type,
-                t.name                                          AS tag_value
-            FROM tags t
-            JOIN taggings tt on t.id = tt.tag_id
-            LEFT JOIN views v on tt.taggable_id = v.id AND tt.taggable_type = 'View'
-            WHERE t.name = 'NO_DELETE'
-        )   
-        SELECT 
-            w.luid as id, 
-            fs."project site name", 
-            fs."project path", 
-            w.name as "workbook name", 
-            u.friendly_name as owner,
-            lower(u.name)||'{ORGANISATION_EMAIL_SUFFIX}' as email,
-            pa."project lead emails",
-            MAX(he.created_at) AS "last used passed six months"
-        FROM workbooks w 
-        JOIN folder_structure fs ON fs."project id" = w.project_id
-        LEFT JOIN hist_workbooks hw ON hw.workbook_id = w.id
-        LEFT JOIN historical_events he ON hw.id = he.hist_workbook_id
-        LEFT JOIN _users u ON w.owner_id = u.id
-        LEFT JOIN NO_DELETE nd ON nd.tag_item_id = w.id and nd.tag_item_type = 'Workbook'
-        WHERE  
-        w.created_at <= NOW() - INTERVAL '30 days' -- to not delete just created dashboards 
-        AND nd.tag_value IS NULL
-        GROUP BY fs."project site name", fs."project path", w.luid, w.name, u.friendly_name, u.name
-        HAVING (MAX(he.created_at) IS NULL OR MAX(he.created_at) <= NOW() - INTERVAL '120 days')
-        """
-    )
-    return query
-    
\ No newline at end of file
+__all__ = ['create_project_hierarchy', 'query_project_structure', 'query_orphan_datasources', 'query_unused_workbooks', 'query_workbook_usage', 'UNUSED_DAYS', 'NEW_WORKBOOK_DAYS', 'NO_DELETE_TAG']
+ORGANISATION_EMAIL_SUFFIX = "@ORGNAME.DOMAIN"
+TABLEAU_SERVER_URL = "TABLEAUSERVERURL"
+UNUSED_DAYS = 120 # items that were not used (or published) for this many days are archived
+NEW_WORKBOOK_DAYS = 30 # to not delete just created dashboards
+NO_DELETE_TAG = "NO_DELETE" # items with this tag are never archived
+PROJECT_HIERARCHY_TABLE = "project_hierarchy"
+
+
+def text(query:str):
+    # SQLAlchemy is only imported once a query is built, the scripts read the settings above before they parse their arguments
+    from sqlalchemy import text
+    return text(query)
+
+# the filters are bound as parameters, so the database only computes the rows that are needed
+# all queries are built on the project hierarchy, which has to be created first with create_project_hierarchy
+
+def create_project_hierarchy(dbConnection, site:str=None) -> None:
+    """
+    Computes the path and root project of every project of the site (site=None for all sites) once and stores them in a
+    temporary table, which the queries of this module join on. The table lives as long as the database connection,
+    calling this function again for the same site reuses it.
+    """
+    if dbConnection.info.get(PROJECT_HIERARCHY_TABLE, ()) == (site,):
+        return
+
+    # the hierarchy is walked from the root projects down, every project extends the path of its parent
+    query = (
+        f"""
+        CREATE TEMPORARY TABLE {PROJECT_HIERARCHY_TABLE} AS
+        WITH RECURSIVE hierarchy AS
+        (
+            SELECT s.id AS "project site id",
+                   s.name AS "project site name",
+                   s.url_namespace AS "project site url namespace",
+                   p.id AS "project id",
+                   p.name AS "project name",
+                   p.id AS "root project id",
+                   p.name AS "root project name",
+                   CAST(p.name AS TEXT) AS "project path",
+                   p.special AS "special",
+                   1 AS level
+            FROM public.projects p
+            JOIN public.sites s on p.site_id = s.id
+            WHERE p.parent_project_id IS NULL
+            AND (:site IS NULL OR s.name = :site)
+        UNION ALL
+            SELECT h."project site id",
+                   h."project site name",
+                   h."project site url namespace",
+                   p.id AS "project id",
+                   p.name AS "project name",
+                   h."root project id",
+                   h."root project name",
+                   h."project path"||'/'||p.name AS "project path",
+                   p."special",
+                   h.level + 1 AS level
+            FROM public.projects p
+            JOIN hierarchy h ON p.parent_project_id = h."project id"
+        )
+        SELECT *
+        FROM hierarchy
+        """
+    )
+    dbConnection.execute(text(f"DROP TABLE IF EXISTS {PROJECT_HIERARCHY_TABLE}"))
+    dbConnection.execute(text(query).bindparams(site=site))
+    dbConnection.execute(text(f'CREATE INDEX ON {PROJECT_HIERARCHY_TABLE} ("project id")'))
+    dbConnection.execute(text(f"ANALYZE {PROJECT_HIERARCHY_TABLE}"))
+    if hasattr(dbConnection, "commit"): # the table must survive queries that end their transaction with an error
+        dbConnection.commit()
+    dbConnection.info[PROJECT_HIERARCHY_TABLE] = (site,)
+
+def query_no_delete() -> str:
+    # the items that are tagged with :no_delete_tag, tags on views protect their workbook
+    return (
+        """
+        SELECT DISTINCT
+            COALESCE(v.workbook_id, tt.taggable_id)         AS tag_item_id,
+            CASE tt.taggable_type
+                WHEN 'View' THEN 'Workbook'
+                ELSE tt.taggable_type
+            END                                             AS tag_item_type,
+            t.name                                          AS tag_value
+        FROM tags t
+        JOIN taggings tt on t.id = tt.tag_id
+        LEFT JOIN views v on tt.taggable_id = v.id AND tt.taggable_type = 'View'
+        WHERE t.name = :no_delete_tag
+        """
+    )
+
+def query_project_structure():
+    query = (
+        f"""
+        SELECT "project site id",
+               "project site name",
+               "project id",
+               "project name",
+               :server_url||'/'||"project site url namespace"||'/projects/'||"project id" AS "project link",
+               "root project id",
+               "root project name",
+               "project path",
+               COALESCE(special, 0) AS "special"
+        FROM {PROJECT_HIERARCHY_TABLE}
+        ORDER BY 1, 2, 4
+        """
+    )
+    return text(query).bindparams(server_url=TABLEAU_SERVER_URL)
+
+def query_orphan_datasources(unused_days:int=UNUSED_DAYS, no_delete_tag:str=NO_DELETE_TAG):
+    query = (
+        f"""
+        WITH NO_DELETE AS
+        (
+            {query_no_delete()}
+        )
+        SELECT
+            ds.luid as id,
+            fs."project site name",
+            fs."project path",
+            ds.name as "data source name",
+            u.friendly_name as owner,
+            lower(u.name)||:email_suffix as email,
+            ds.last_published_at
+        FROM datasources ds
+        JOIN {PROJECT_HIERARCHY_TABLE} fs ON ds.project_id = fs."project id"
+        LEFT JOIN _users u ON ds.owner_id = u.id
+        LEFT JOIN data_connections dc ON ds.repository_url = dc.dbname
+        LEFT JOIN NO_DELETE nd ON nd.tag_item_id = ds.id AND nd.tag_item_type = 'Datasource'
+        WHERE ds.parent_type is null
+        AND nd.tag_value IS NULL
+        AND dc.id is null
+        AND ds.last_published_at <= NOW() - :unused_days * INTERVAL '1 day'
+        """
+    )
+    return text(query).bindparams(unused_days=unused_days, no_delete_tag=no_delete_tag, email_suffix=ORGANISATION_EMAIL_SUFFIX)
+
+def query_unused_workbooks(new_workbook_days:int=NEW_WORKBOOK_DAYS, no_delete_tag:str=NO_DELETE_TAG):
+    # the candidates to archive, whether they were used recently is checked against the UsageIndex afterwards
+    query = (
+        f"""
+        WITH NO_DELETE AS
+        (
+            {query_no_delete()}
+        )
+        SELECT
+            w.luid as id,
+            w.id as "workbook repository id",
+            fs."project site name",
+            fs."project path",
+            w.name as "workbook name",
+            u.friendly_name as owner,
+            lower(u.name)||:email_suffix as email
+        FROM workbooks w
+        JOIN {PROJECT_HIERARCHY_TABLE} fs ON fs."project id" = w.project_id
+        LEFT JOIN _users u ON w.owner_id = u.id
+        LEFT JOIN NO_DELETE nd ON nd.tag_item_id = w.id and nd.tag_item_type = 'Workbook'
+        WHERE
+        w.created_at <= NOW() - :new_workbook_days * INTERVAL '1 day' -- to not delete just created dashboards
+        AND nd.tag_value IS NULL
+        """
+    )
+    return text(query).bindparams(new_workbook_days=new_workbook_days, no_delete_tag=no_delete_tag, email_suffix=ORGANISATION_EMAIL_SUFFIX)
+
+def query_workbook_usage(watermark:int=0):
+    # the last use of every workbook in the historical events after the watermark (historical_events.id)
+    # only the new events are read, the id is the primary key of historical_events so no full scan is needed
+    # the events of other items are grouped under a missing workbook_id, so they move the watermark as well
+    query = (
+        """
+        SELECT
+            hw.workbook_id,
+            MAX(he.created_at) AS last_used,
+            MAX(he.id) AS last_event_id,
+            COUNT(*) AS events
+        FROM historical_events he
+        LEFT JOIN hist_workbooks hw ON hw.id = he.hist_workbook_id
+        WHERE he.id > :watermark
+        GROUP BY hw.workbook_id
+        """
+    )
+    return text(query).bindparams(watermark=watermark)
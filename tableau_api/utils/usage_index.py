@@ -0,0 +1,77 @@
+import os
+import sqlite3
+import pandas as pd
+from .helpers import read_sql_chunks
+from .unused_items_queries import query_workbook_usage
+
+__all__ = ["UsageIndex"]
+
+# ids of historical events are handed out before their transaction commits, so an event with a lower id than the watermark
+# can appear after an update. every update reads this many ids below the watermark again, reading an event twice changes nothing
+WATERMARK_OVERLAP = 10000
+
+
+class UsageIndex:
+    """
+    Keeps the last time every workbook was used in a local SQLite file. The index remembers the id of the last
+    historical event it processed (the watermark), so an update only reads the events that were added since.
+    Workbooks are identified by their repository id (workbooks.id), which is why an index belongs to one repository.
+    """
+    def __init__(self, path:str):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=60) # the index is shared by the sites of a repository
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS last_used (workbook_id INTEGER PRIMARY KEY, last_used TEXT NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS watermark (id INTEGER NOT NULL)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def watermark(self) -> int:
+        row = self._connection.execute("SELECT MAX(id) FROM watermark").fetchone()
+        return row[0] if row[0] is not None else 0
+
+    def update(self, dbConnection, overlap:int=WATERMARK_OVERLAP) -> int:
+        """
+        Adds the historical events after the watermark (minus the overlap) to the index and returns the number of events that were read.
+        The first update reads the whole history.
+        """
+        watermark, events = self.watermark(), 0
+        for chunk in read_sql_chunks(query_workbook_usage(max(watermark - overlap, 0)), dbConnection):
+            if chunk.empty:
+                continue
+            watermark = max(watermark, int(chunk["last_event_id"].max()))
+            events += int(chunk["events"].sum())
+            chunk = chunk.dropna(subset=["workbook_id"])
+            chunk["last_used"] = pd.to_datetime(chunk["last_used"]).dt.strftime("%Y-%m-%d %H:%M:%S")
+            # a workbook can be in several chunks, the most recent use is kept
+            self._connection.executemany(
+                """
+                INSERT INTO last_used (workbook_id, last_used) VALUES (?, ?)
+                ON CONFLICT (workbook_id) DO UPDATE SET last_used = MAX(last_used, excluded.last_used)
+                """,
+                zip(chunk["workbook_id"].astype(int).tolist(), chunk["last_used"].tolist())
+            )
+
+        # the usage and the watermark are committed together, so an interrupted update is simply done again
+        self._connection.execute("DELETE FROM watermark")
+        self._connection.execute("INSERT INTO watermark (id) VALUES (?)", (watermark,))
+        self._connection.commit()
+        return events
+
+    def last_used(self, workbook_ids) -> pd.Series:
+        """
+        Returns the last time every workbook was used, workbooks that were never used get a missing value.
+        """
+        index = pd.Series(dict(self._connection.execute("SELECT workbook_id, last_used FROM last_used").fetchall()), dtype=object)
+        return pd.to_datetime(pd.Series(workbook_ids).astype(int).map(index))
+
+    def close(self) -> None:
+        self._connection.close()